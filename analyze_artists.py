@@ -1,78 +1,157 @@
 import os
 import sys
-import time
-import requests
-import urllib.parse
-from collections import defaultdict
-from datetime import datetime, timezone
-from zoneinfo import ZoneInfo
-import matplotlib.pyplot as plt
+import numpy as np
 import utils
+import chart_utils
+from config import TOP_ARTISTS_COUNT
 from database import db
-from config import TIMEZONE, MIN_PLAY_DURATION
+from dataset import load_dataset, group_sum, ranked_by_group
+from lastfm import get_fetcher, LastFmError
+from incremental import ChangeSet
 
-def main(input_filename: str):
-    input_path = os.path.join("userdata", input_filename)
-    output_dir = os.path.join("output", input_filename.replace(".json", ""))
+def main(input_filename: str, dataset=None, changes=None, pages=None):
+    output_dir = utils.get_output_path(input_filename)
     os.makedirs(os.path.join(output_dir, "artists"), exist_ok=True)
 
     output_file = os.path.join(output_dir, "artists.md")
 
-    print(f"📂 Lese Daten aus: {input_path}")
-    data = utils.load_data(input_path)
+    if dataset is None:
+        dataset = load_dataset(input_filename)
 
-    utils.clear_md(output_file)
-    analyse(data, output_file, output_dir)
+    if pages is None:
+        pages = utils.PageRegistry.scan(output_dir)
+    analyse(dataset, output_file, output_dir, changes or ChangeSet(), pages)
 
 
-def analyse(data, output_file, output_dir):
+def analyse(dataset, output_file, output_dir, changes, pages):
     print("📊 Analysiere Artists...")
 
-    artist_times = defaultdict(int)
-    artist_urls = {}
-
-    for song in data:
-        artist = song.get("master_metadata_album_artist_name")
-        if not artist:
-            continue
-
-        track_id = song.get("spotify_track_uri")
-        lastfm_data = db.get_song_data(track_id)
-        if lastfm_data:
-            if artist not in artist_urls:
-                artist_urls[artist] = lastfm_data.get("artist", {}).get("url")
-        artist_times[artist] += song.get("ms_played", 0)
-
-    top_artists = sorted(artist_times.items(), key=lambda x: x[1], reverse=True)[:500]
+    has_artist = dataset.artist_codes >= 0
+    artist_codes = dataset.artist_codes[has_artist]
+    track_codes = dataset.track_codes[has_artist]
 
-    utils.append_md(output_file, "### Top 500 Artists\n")
+    ranked_codes, ranked_ms = ranked_by_group(np.zeros(len(artist_codes), dtype=np.int32), artist_codes, dataset.ms_played[has_artist],
+                                              limit=TOP_ARTISTS_COUNT).get(0, ([], []))
+    top_artists = [(dataset.artists[code], played_ms) for code, played_ms in zip(ranked_codes, ranked_ms)]
 
-    for i, (artist, played_ms) in enumerate(top_artists, start=1):
-        filename = utils.sanitize_filename(artist) + ".md"
-        playtime_h = played_ms / 1000 / 60 / 60
-        utils.append_md(output_file, f"{i}. **[[./artists/{filename}|{artist}]]** mit **{playtime_h:.2f} Stunden** Spielzeit")
-        get_artist_data(i, data, artist, output_dir, artist_url=artist_urls.get(artist))
-
-
-def get_artist_data(index, data, artist_name, output_dir, artist_url=None):
-    start = time.time()
+    # Last.fm-Link: erster Song (in Hörreihenfolge) des Artists mit gecachten Daten
+    songs_with_data = db.get_song_fields_many(dataset.track_uris)
+    top_artist_codes = set(ranked_codes)
+    artist_urls = {}
+    offset = len(dataset.track_uris) + 1
+    artist_tracks, _, _ = group_sum(artist_codes.astype(np.int64) * offset + track_codes + 1)
+    for key in artist_tracks:
+        artist_code, track_code = divmod(int(key), offset)
+        artist = dataset.artists[artist_code]
+        if artist_code not in top_artist_codes or artist in artist_urls:
+            continue
+        song_fields = songs_with_data.get(dataset.track_uri(track_code - 1))
+        if song_fields:
+            artist_urls[artist] = song_fields["artist_url"]
+
+    # Nur Seiten von Artists mit neuen Einträgen (oder fehlender Datei) neu erzeugen
+    existing = utils.PageRegistry.scan(output_dir)
+    outdated = {artist for artist, _ in top_artists if changes.artist(artist) or not existing.has("artists", artist)}
+    artist_index = build_artist_index(dataset, [artist for artist, _ in top_artists])
+
+    # Nicht gecachte Artist-Infos vorab parallel anfragen
+    fetcher = get_fetcher()
+    failed_artists = db.get_fetch_failures("artist", outdated)
+    artist_requests = {
+        artist: fetcher.artist_info(artist)
+        for artist, _ in top_artists
+        if artist in outdated and artist not in failed_artists and db.get_artist_data(artist) is None
+    }
+
+    artists_md = utils.MarkdownDocument(output_file)
+    artists_md.append(f"### Top {TOP_ARTISTS_COUNT} Artists\n")
+
+    with db.batch_writes():
+        for i, (artist, played_ms) in enumerate(top_artists, start=1):
+            filename = utils.sanitize_filename(artist) + ".md"
+            playtime_h = played_ms / 1000 / 60 / 60
+            artists_md.append(f"{i}. **[[./artists/{filename}|{artist}]]** mit **{playtime_h:.2f} Stunden** Spielzeit")
+            if artist not in outdated:
+                # Seite bleibt, die Diagramme hängen aber auch von Monatsachse und Gesamtzeit ab
+                render_artist_charts(dataset, artist, output_dir, artist_index[artist])
+                pages.add("artists", artist)
+                continue
+            written = get_artist_data(i, dataset, artist, output_dir, artist_url=artist_urls.get(artist), artist_stats=artist_index[artist],
+                                      artist_request=artist_requests.get(artist), known_failure=artist in failed_artists)
+            if written or existing.has("artists", artist):
+                pages.add("artists", artist)
+    chart_utils.wait_for_charts()
+    artists_md.save()
+
+
+def build_artist_index(dataset, artist_names):
+    """
+    Aggregates the listening data of the given artists in a single pass over the dataset.
+    Returns {artist_name: {"monthly_ms": [ms per month of dataset.months], "total_ms": int,
+    "top_songs": [(track_code, times_played), ...] of the 25 most played songs}}.
+    """
+    month_count = len(dataset.months)
+
+    # Artist-Code → Zeile im Index (-1 = Artist nicht angefragt)
+    rows = np.full(len(dataset.artists) + 1, -1, dtype=np.int64)
+    for row, artist_name in enumerate(artist_names):
+        rows[dataset.artist_index.get(artist_name, -1) + 1] = row
+    event_rows = rows[dataset.artist_codes + 1]
+    selected = event_rows >= 0
+
+    monthly_ms = np.bincount(
+        event_rows[selected] * month_count + dataset.month_codes[selected],
+        weights=dataset.ms_played[selected],
+        minlength=len(artist_names) * month_count,
+    ).reshape(len(artist_names), month_count)
+
+    # Songs nur mit Mindest-Hördauer zählen
+    played = selected & dataset.valid
+    top_songs = ranked_by_group(event_rows[played], dataset.track_codes[played], limit=25)
+
+    return {
+        artist_name: {
+            "monthly_ms": monthly_ms[row].tolist(),
+            "total_ms": int(monthly_ms[row].sum()),
+            "top_songs": list(zip(*top_songs.get(row, ([], [])))),
+        }
+        for row, artist_name in enumerate(artist_names)
+    }
+
+
+def get_artist_data(index, dataset, artist_name, output_dir, artist_url=None, artist_stats=None, artist_request=None, known_failure=None):
+    """Write the page of an artist, returns True if it was written"""
+    if artist_stats is None:
+        artist_stats = build_artist_index(dataset, [artist_name])[artist_name]
 
     artist_data = db.get_artist_data(artist_name)
+    if known_failure is None:
+        known_failure = bool(db.get_fetch_failures("artist", [artist_name]))
 
     if artist_data:
         from_cache = True
+    elif known_failure:
+        # Last.fm kennt den Artist nicht: Seite ohne Last.fm-Infos erzeugen
+        artist_data = {}
+        from_cache = True
     else:
-        api_url = (
-            f"https://ws.audioscrobbler.com/2.0/?method=artist.getinfo"
-            f"&api_key={os.getenv('LASTFM_API_KEY')}&artist={urllib.parse.quote(artist_name)}&format=json"
-        )
-        response = requests.get(api_url)
-        if response.status_code != 200:
-            print(f"❌ Fehler beim Laden von {artist_name}: HTTP {response.status_code}")
+        import requests
+        if artist_request is None:
+            artist_request = get_fetcher().artist_info(artist_name)
+        try:
+            artist_data = artist_request.result()
+        except LastFmError as e:
+            print(f"❌ Fehler beim Laden von {artist_name}: HTTP {e.status_code}")
+            if not e.permanent:
+                return
+            db.store_fetch_failure("artist", artist_name, e.error_code, e.text)
+            artist_data = {}
+        except requests.RequestException as e:
+            # Last.fm nicht erreichbar (auch nach allen Wiederholungen): beim nächsten Lauf erneut versuchen
+            print(f"❌ Fehler beim Laden von {artist_name}: {e}")
             return
-
-        artist_data = response.json()
-        db.store_artist_data(artist_name, artist_data)
+        else:
+            db.store_artist_data(artist_name, artist_data)
         from_cache = False
 
     # Markdown-Datei schreiben
@@ -83,60 +162,59 @@ def get_artist_data(index, data, artist_name, output_dir, artist_url=None):
     summary = utils.html_to_md_links(summary)
     tags = artist_data.get("artist", {}).get("tags", {}).get("tag", [])
 
-    utils.clear_md(artist_filepath)
-    utils.append_md(artist_filepath, f"# {artist_name}")
+    artist_md = utils.MarkdownDocument(artist_filepath)
+    artist_md.append(f"# {artist_name}")
     if artist_url:
-        utils.append_md(artist_filepath, f"[Last.fm-Profil]({artist_url})\n")
+        artist_md.append(f"[Last.fm-Profil]({artist_url})\n")
     if tags:
         tag_list = ", ".join(tag["name"] for tag in tags)
-        utils.append_md(artist_filepath, f"**Tags**: {tag_list}")
+        artist_md.append(f"**Tags**: {tag_list}")
     else:
-        utils.append_md(artist_filepath, "Keine Tags gefunden.")
-    utils.append_md(artist_filepath, "\n" + summary)
-    utils.append_md(artist_filepath, "\n")
+        artist_md.append("Keine Tags gefunden.")
+    artist_md.append("\n" + summary)
+    artist_md.append("\n")
     
+    monthly_chart_filename, pie_chart_filename = render_artist_charts(dataset, artist_name, output_dir, artist_stats)
+
+    if monthly_chart_filename:
+        artist_md.append(f"![Listening behavior per month](../img/{monthly_chart_filename})")
+    else:
+        artist_md.append("_Keine Daten für monatliches Hörverhalten gefunden._")
+
+    if pie_chart_filename:
+        artist_md.append(f"![Proportion of total playing time](../img/{pie_chart_filename})")
+    else:
+        artist_md.append("_Keine Hörzeit für diesen Artist vorhanden._")
+
+    get_most_heared_songs(dataset, artist_name, artist_md, output_dir, artist_stats=artist_stats)
+    written = artist_md.save()
+
+    print(f"✅ | {str(index).zfill(len(str(TOP_ARTISTS_COUNT)))} / {TOP_ARTISTS_COUNT} | {'📄 (Cache)' if from_cache else '🆕 (API)'}: {artist_name}")
+    return written
+
+
+def render_artist_charts(dataset, artist_name, output_dir, artist_stats):
+    """
+    Queue the monthly minutes chart and the share pie chart of an artist.
+    Returns their filenames (None if the chart has no data).
+    """
+    monthly_chart_filename = pie_chart_filename = None
+
     # === Monatsbalkendiagramm ===
-    monthly_minutes = defaultdict(float)
-    total_artist_minutes = 0
-    total_all_minutes = 0
+    total_artist_minutes = artist_stats["total_ms"] / 60000
+    total_all_minutes = dataset.total_ms_played / 60000
 
-    for entry in data:
-        ts = entry.get("ts")
-        if not ts:
-            continue
-        ms_played = entry.get("ms_played", 0)
-        dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-        if TIMEZONE:
-            dt = dt.astimezone(ZoneInfo(TIMEZONE))
-        month = dt.strftime("%Y-%m")
-        minutes = ms_played / 60000
-        total_all_minutes += minutes
-        if not monthly_minutes[month]: monthly_minutes[month] = 0
-        if entry.get("master_metadata_album_artist_name") == artist_name:
-            monthly_minutes[month] += minutes
-            total_artist_minutes += minutes
-
-    # Monats-Balkendiagramm generieren
-    if monthly_minutes:
-        months = sorted(monthly_minutes.keys())
-        minutes = [monthly_minutes[m] for m in months]
-
-        plt.figure(figsize=(12, 6))
-        plt.bar(months, minutes, color='skyblue')
-        plt.title(f"Listening minutes per month for {utils.to_ascii(artist_name)}")
-        plt.ylabel("listening minutes")
-        plt.xticks(rotation=45)
-        plt.tight_layout()
+    # Monats-Balkendiagramm generieren (alle Monate, 0 wenn nicht gehört)
+    if dataset.months:
+        months = dataset.months
+        minutes = [ms / 60000 for ms in artist_stats["monthly_ms"]]
 
         monthly_chart_filename = f"{utils.sanitize_filename(artist_name)}_monthly_minutes.png"
-        monthly_chart_path = os.path.join(output_dir, "img", monthly_chart_filename)
-        os.makedirs(os.path.dirname(monthly_chart_path), exist_ok=True)
-        plt.savefig(monthly_chart_path, bbox_inches='tight', pad_inches=0.5)
-        plt.close()
-
-        utils.append_md(artist_filepath, f"![Listening behavior per month](../img/{monthly_chart_filename})")
-    else:
-        utils.append_md(artist_filepath, "_Keine Daten für monatliches Hörverhalten gefunden._")
+        chart_utils.render(chart_utils.bar_chart(
+            os.path.join(output_dir, "img", monthly_chart_filename),
+            months, minutes, f"Listening minutes per month for {utils.to_ascii(artist_name)}",
+            ylabel="listening minutes",
+        ))
 
     # === Kreisdiagramm Gesamtzeit: Artist vs. Rest ===
     if total_artist_minutes > 0:
@@ -144,74 +222,43 @@ def get_artist_data(index, data, artist_name, output_dir, artist_url=None):
         labels = [f"{utils.to_ascii(artist_name)}", "others"]
         sizes = [total_artist_minutes, rest_minutes]
 
-        plt.figure(figsize=(6, 6))
-        plt.pie(sizes, labels=labels, autopct="%1.1f%%", startangle=90, counterclock=False, colors=["#ff9999", "#dddddd"])
-        plt.title(f"{utils.to_ascii(artist_name)} vs. rest - total listening time")
-        plt.axis("equal")
         pie_chart_filename = f"{utils.sanitize_filename(artist_name)}_share_vs_rest.png"
-        pie_chart_path = os.path.join(output_dir, "img", pie_chart_filename)
-        plt.savefig(pie_chart_path, bbox_inches='tight', pad_inches=0.5)
-        plt.close()
+        chart_utils.render(chart_utils.pie_chart(
+            os.path.join(output_dir, "img", pie_chart_filename),
+            labels, sizes, f"{utils.to_ascii(artist_name)} vs. rest - total listening time",
+            colors=["#ff9999", "#dddddd"],
+        ))
 
-        utils.append_md(artist_filepath, f"![Proportion of total playing time](../img/{pie_chart_filename})")
-    else:
-        utils.append_md(artist_filepath, "_Keine Hörzeit für diesen Artist vorhanden._")
+    return monthly_chart_filename, pie_chart_filename
 
-    get_most_heared_songs(data, artist_name, artist_filepath, output_dir)
 
-    print(f"✅ | {str(index).zfill(3)} / 500 | {'📄 (Cache)' if from_cache else '🆕 (API)'}: {artist_name}")
-
-    # API-Rate-Limit beachten
-    elapsed = time.time() - start
-    if not from_cache and elapsed < 0.25:
-        time.sleep(0.25 - elapsed)
-
-
-def get_most_heared_songs(data, artist, artist_filepath, output_dir):
+def get_most_heared_songs(dataset, artist, artist_md, output_dir, artist_stats=None):
     """
     Fügt die 25 meistgehörten Songs eines Artists zur Markdown-Datei hinzu.
     """
-    song_stats = {}
-    for entry in data:
-        artist_name = entry.get("master_metadata_album_artist_name", "")
-        track_uri = entry.get("spotify_track_uri")
-        track_name = entry.get("master_metadata_track_name", "Unbekannt")
-        ms_played = entry.get("ms_played")
-
-        if artist_name != artist or not track_uri or not ms_played or ms_played < MIN_PLAY_DURATION:
-            continue
-
-        lastfm_data = db.get_song_data(track_uri)
-
-        if track_uri not in song_stats:
-            song_stats[track_uri] = {
-                "track_name": track_name,
-                "times_played": 1,
-                "lastfm_data": lastfm_data,
-            }
-        else:
-            song_stats[track_uri]["times_played"] += 1
-
-    top_songs = sorted(song_stats.items(), key=lambda x: x[1]["times_played"], reverse=True)[:25]
+    if artist_stats is None:
+        artist_stats = build_artist_index(dataset, [artist])[artist]
+    top_songs = artist_stats["top_songs"][:25]
 
     if not top_songs:
-        utils.append_md(artist_filepath, "\n**Keine Songs gefunden.**")
+        artist_md.append("\n**Keine Songs gefunden.**")
         return
 
-    utils.append_md(artist_filepath, "\n### Meistgehörte Songs\n")
+    artist_md.append("\n### Meistgehörte Songs\n")
+
+    songs_with_data = db.get_song_fields_many(dataset.track_uris[track_code] for track_code, _ in top_songs)
 
-    for i, (track_uri, song) in enumerate(top_songs, start=1):
+    for i, (track_code, times_played) in enumerate(top_songs, start=1):
         if i == 1:
-            utils.append_md(artist_filepath, "##### 1 bis 10\n")
+            artist_md.append("##### 1 bis 10\n")
         elif i == 11:
-            utils.append_md(artist_filepath, "##### 11 bis 25\n")
+            artist_md.append("##### 11 bis 25\n")
 
-        track_name = song["track_name"]
-        times_played = song["times_played"]
-        lastfm_data = song["lastfm_data"]
+        track_uri = dataset.track_uris[track_code]
+        track_name = dataset.track_names[track_code]
 
-        link = f'[[../songs/{track_uri[14:]}.md|{track_name}]]' if lastfm_data else track_name
-        utils.append_md(artist_filepath, f"{i}. **{link}** – **{times_played}** mal gehört")
+        link = f'[[../songs/{track_uri[14:]}.md|{track_name}]]' if track_uri in songs_with_data else track_name
+        artist_md.append(f"{i}. **{link}** – **{times_played}** mal gehört")
 
 
 if __name__ == "__main__":
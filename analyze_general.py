@@ -1,119 +1,132 @@
-import matplotlib.pyplot as plt
 import sys
 import os
-from datetime import datetime, timedelta, timezone
-from zoneinfo import ZoneInfo
-from collections import defaultdict
+from datetime import datetime
+import numpy as np
 import utils
-import copy
-import json
+import chart_utils
+import ranking
 from database import db
-from config import TIMEZONE, MIN_PLAY_DURATION
+from dataset import load_dataset, group_sum, ranked_by_group, totals_by_group, day_to_date
+from config import MIN_PLAY_DURATION
+from incremental import ChangeSet
 
-def main(input_filename):
-    input_path = os.path.join("userdata", input_filename)
-    output_path = os.path.join("output", input_filename.replace(".json", ""))
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def main(input_filename, dataset=None, changes=None, pages=None):
+    output_path = utils.get_output_path(input_filename)
     os.makedirs(output_path, exist_ok=True)
     os.makedirs(os.path.join(output_path, "img"), exist_ok=True)
     os.makedirs(os.path.join(output_path, "songs"), exist_ok=True)
     os.makedirs(os.path.join(output_path, "tags"), exist_ok=True)
-    output_file = os.path.join("output", input_filename.replace(".json", ""), "general.md")
-    print(f"📂 Lese Daten aus: {input_path}")
-    data = utils.load_data(input_path)
-
-    utils.clear_md(output_file)
-    utils.append_md(output_file, f"# WICHTIG:\n"
+    output_file = os.path.join(utils.get_output_path(input_filename), "general.md")
+    if dataset is None:
+        dataset = load_dataset(input_filename)
+    if changes is None:
+        changes = ChangeSet()
+    if pages is None:
+        pages = utils.PageRegistry.scan(output_path)
+
+    # Monatsseiten nur für Monate mit neuen Einträgen (oder fehlender Datei) neu schreiben
+    months_path = os.path.join(output_path, "months")
+    month_mds = {
+        month: utils.MarkdownDocument(os.path.join(months_path, month + ".md"))
+        for month in dataset.months
+        if changes.month(month) or not os.path.exists(os.path.join(months_path, month + ".md"))
+    }
+
+    general_md = utils.MarkdownDocument(output_file)
+    general_md.append(f"# WICHTIG:\n"
                             f"- Es werden in bestimmten Statistiken nur Songs verarbeitet, die mindestens {(MIN_PLAY_DURATION / 1000):.0f} Sekunden lang angehört wurden.\n"
                             f"- Songs, zu denen keine Tags auf Last.fm gefunden wurden, fließen nicht in tagspezifische Statistiken ein.\n")
     
-    utils.append_md(output_file, f"# Analyse")
-    month_keys = prepare_month_files(data, output_path)
-    analyse_general(data, output_file)
-    analyse_activity_by_time(data, output_file, output_path)
-    analyse_top_songs(data, output_file, output_path)
-    analyse_top_artists(data, output_file, output_path)
-    utils.append_md(output_file, f"### Links\n#### Listen\n- [[./artists.md|Artist-Liste]]\n- [[./songs.md|Songs-Liste]]\n#### Monate\n" + "".join(f'- [[./months/{month_key}.md]]\n' for month_key in month_keys))
-
+    general_md.append(f"# Analyse")
+    month_keys = prepare_month_files(dataset, output_path, month_mds)
+    analyse_general(dataset, general_md)
+    analyse_activity_by_time(dataset, general_md, output_path)
+    analyse_top_songs(dataset, general_md, output_path, month_mds)
+    analyse_top_artists(dataset, general_md, output_path, month_mds, pages)
+    general_md.append(f"### Links\n#### Listen\n- [[./artists.md|Artist-Liste]]\n- [[./songs.md|Songs-Liste]]\n#### Monate\n" + "".join(f'- [[./months/{month_key}.md]]\n' for month_key in month_keys))
+    chart_utils.wait_for_charts()
+
+    general_md.save()
+    for month_md in month_mds.values():
+        if month_md.lines:
+            month_md.save()
     return output_file
 
-def prepare_month_files(data, output_path):
+def prepare_month_files(dataset, output_path, month_mds):
     months_path = os.path.join(output_path, "months")
     os.makedirs(months_path, exist_ok=True)
-    
-    songs_per_month = defaultdict(list)
-    for entry in data:
-        ts = entry.get('ts')
-        ms_played = entry.get('ms_played')  # Dauer in Millisekunden
 
-        if not ts or not ms_played:
+    # Nur Einträge mit Hördauer berücksichtigen
+    played = dataset.ms_played > 0
+    month_codes = dataset.month_codes[played]
+    ms_played = dataset.ms_played[played]
+    days = dataset.day[played]
+    tracks = dataset.track_codes[played]
+    month_count = len(dataset.months)
+
+    total_songs = np.bincount(month_codes, minlength=month_count)
+    songs_with_min_duration = np.bincount(month_codes[ms_played >= MIN_PLAY_DURATION], minlength=month_count)
+    total_ms = np.bincount(month_codes, weights=ms_played, minlength=month_count).astype(np.int64)
+    with_track = tracks >= 0
+    track_count = max(len(dataset.track_uris), 1)
+    month_tracks = np.unique(month_codes[with_track].astype(np.int64) * track_count + tracks[with_track])
+    different_songs = np.bincount(month_tracks // track_count, minlength=month_count)
+
+    # Ein Tag gehört immer zu genau einem Monat
+    active_days, first_index = np.unique(days, return_index=True)
+    active_day_months = month_codes[first_index]
+    days_with_activity = np.bincount(active_day_months, minlength=month_count)
+    daily_ms = np.bincount(np.searchsorted(active_days, days), weights=ms_played, minlength=len(active_days))
+
+    # Minuten je (Monat, Wochentag, Stunde) und aktive Tage je (Monat, Wochentag)
+    activity = np.bincount(
+        (month_codes.astype(np.int64) * 7 + dataset.weekday[played]) * 24 + dataset.hour[played],
+        weights=ms_played / 60000,
+        minlength=month_count * 7 * 24,
+    ).reshape(month_count, 7, 24)
+    weekday_days = np.bincount(
+        active_day_months.astype(np.int64) * 7 + (active_days + 3) % 7,  # 1970-01-01 war ein Donnerstag
+        minlength=month_count * 7,
+    ).reshape(month_count, 7)
+
+    month_keys = []
+    for month_code, month_key in enumerate(dataset.months):
+        if not total_songs[month_code]:
+            continue
+        month_keys.append(month_key)
+        if month_key not in month_mds:
             continue
-        
-        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-        month_key = date.strftime("%Y-%m")
-        songs_per_month[month_key].append(entry)
-    
-    for month_key, month_data in songs_per_month.items():
         print(f"📊 Analysiere Monat {month_key}...")
-        month_file = os.path.join(months_path, month_key + ".md")
-        utils.clear_md(month_file)
-        
-        utils.append_md(month_file, f"# Statistiken des Monats {month_key}")
-        total_songs = len(month_data)
-        songs_with_min_duration = sum(1 for entry in month_data if entry.get('ms_played', 0) >= MIN_PLAY_DURATION)
-        total_duration = sum(entry.get('ms_played', 0) for entry in month_data) / 1000  # in Sekunden
+        month_md = month_mds[month_key]
+
+        month_md.append(f"# Statistiken des Monats {month_key}")
+        month_days = active_days[active_day_months == month_code]
+        total_duration = int(total_ms[month_code]) / 1000  # in Sekunden
         total_duration_hours = total_duration / 3600
         total_duration_days = total_duration_hours / 24
-        different_songs = set()
-        for entry in month_data:
-            track_uri = entry.get('spotify_track_uri')
-            if track_uri:
-                different_songs.add(track_uri)
+        month_songs = int(total_songs[month_code])
+        month_songs_with_min_duration = int(songs_with_min_duration[month_code])
+        month_days_with_activity = int(days_with_activity[month_code])
 
-        start_date = datetime.strptime(month_data[0].get('ts'), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).date()
-        end_date = datetime.strptime(month_data[-1].get('ts'), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).date()
+        start_date = day_to_date(month_days[0])
+        end_date = day_to_date(month_days[-1])
 
         days_count = (end_date - start_date).days + 1  # +1, damit Start- und Endtag mitzählen
 
-        days_with_activity = set()
-        for entry in month_data:
-            ts = entry.get('ts')
-            if ts:
-                date = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).date()
-                days_with_activity.add(date)
-
-        utils.append_md(month_file, f"### Allgemeine Statistiken\n"
+        month_md.append(f"### Allgemeine Statistiken\n"
                                 f"- **Zeitspanne der Daten:** {start_date} bis {end_date} ({days_count} Tage)\n"
-                                f"- **Anzahl der Tage (mit Höraktivität):** {len(days_with_activity)}\n"
-                                f"- **Anzahl der gehörten Songs:** {total_songs}\n"
-                                f"- **Anzahl der gehörten Songs mit mindestens {(MIN_PLAY_DURATION / 1000):.0f} Sekunden Hördauer:** {songs_with_min_duration}\n"
-                                f"- **Anzahl der unterschiedlichen Songs:** {len(different_songs)}\n"
+                                f"- **Anzahl der Tage (mit Höraktivität):** {month_days_with_activity}\n"
+                                f"- **Anzahl der gehörten Songs:** {month_songs}\n"
+                                f"- **Anzahl der gehörten Songs mit mindestens {(MIN_PLAY_DURATION / 1000):.0f} Sekunden Hördauer:** {month_songs_with_min_duration}\n"
+                                f"- **Anzahl der unterschiedlichen Songs:** {int(different_songs[month_code])}\n"
                                 f"- **Gesamthördauer:** {total_duration_days:.2f} Tage ({total_duration_hours:.2f} Stunden) ({total_duration / 60:.2f} Minuten)\n"
                                 f"- **Durchschnittliche Hördauer pro Tag:** {total_duration / days_count / 60:.2f} Minuten\n"
-                                f"- **Durchschnittliche Hördauer pro Tag (mit Höraktivität):** {total_duration / len(days_with_activity)/60:.2f} Minuten\n"
-                                f"- **Durchschnittliche Hördauer pro Song:** {(total_duration / total_songs) / 60:.2f} Minuten\n"
-                                f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag:** {songs_with_min_duration / days_count:.2f}\n"
-                                f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag (mit Höraktivität):** {songs_with_min_duration / len(days_with_activity):.2f}\n")
-    
-        activity = defaultdict(lambda: defaultdict(float))
-        days = defaultdict(set)
-
-        for entry in month_data:
-            ts = entry.get('ts')
-            ms_played = entry.get('ms_played')  # Dauer in Millisekunden
-
-            if not ts or not ms_played:
-                continue
-            
-            date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-            weekday = date.strftime("%A")
-            hour = date.hour
-            month_key = date.strftime("%Y-%m")
-            date_str = date.strftime("%Y-%m-%d")
-
-            duration_min = ms_played / 60000  # Millisekunden in Minuten umrechnen
-
-            activity[weekday][hour] += duration_min
-            days[weekday].add(date_str)
+                                f"- **Durchschnittliche Hördauer pro Tag (mit Höraktivität):** {total_duration / month_days_with_activity/60:.2f} Minuten\n"
+                                f"- **Durchschnittliche Hördauer pro Song:** {(total_duration / month_songs) / 60:.2f} Minuten\n"
+                                f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag:** {month_songs_with_min_duration / days_count:.2f}\n"
+                                f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag (mit Höraktivität):** {month_songs_with_min_duration / month_days_with_activity:.2f}\n")
 
         # Farben definieren für Wochentage
         weekday_colors = {
@@ -126,306 +139,205 @@ def prepare_month_files(data, output_path):
             "Sunday": "pink"
         }
 
-        plt.figure(figsize=(12, 6))
-        for weekday in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-            hour_counts = activity[weekday]
-            total_days = len(days[weekday]) or 1  # Verhindert Division durch 0
+        series = []
+        for weekday_index, weekday in enumerate(WEEKDAYS):
+            total_days = int(weekday_days[month_code, weekday_index]) or 1  # Verhindert Division durch 0
             # Mittelwert pro Stunde berechnen
-            hourly_avg = [hour_counts.get(h, 0) / total_days for h in range(24)]
-            plt.plot(range(24), hourly_avg, label=weekday, color=weekday_colors[weekday])
-        plt.title(f"Durchschnittliche Höraktivität pro Stunde – {month_key}")
-        plt.xlabel("Stunde (0–23)")
-        plt.ylabel("⌀ Minuten pro Stunde")
-        plt.ylim(0, 60)
-        plt.xticks(range(0, 24))
-        plt.grid(True, linestyle='--', alpha=0.5)
-        plt.legend()
-        plt.tight_layout()
-        chart_path = os.path.join(output_path, "img", f"songs_per_hour_{month_key}.png")
-        plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
-        plt.close()
-        utils.append_md(month_file, f"### Hörverhalten nach Uhrzeit\n"
+            hourly_avg = list(activity[month_code, weekday_index] / total_days)
+            series.append((hourly_avg, {"label": weekday, "color": weekday_colors[weekday]}))
+        chart_utils.render(chart_utils.line_chart(
+            os.path.join(output_path, "img", f"songs_per_hour_{month_key}.png"),
+            range(24), series,
+            f"Durchschnittliche Höraktivität pro Stunde – {month_key}",
+            xlabel="Stunde (0–23)", ylabel="⌀ Minuten pro Stunde",
+            xticks={"ticks": range(0, 24)}, ylim=(0, 60), grid=True,
+        ))
+        month_md.append(f"### Hörverhalten nach Uhrzeit\n"
                                 f"![Songs pro Stunde – {month_key}](../img/songs_per_hour_{month_key}.png)\n")
         
-        # Hördauer pro Tag im Monat berechnen (Balkendiagramm)
-        daily_duration = defaultdict(float)
-        for entry in month_data:
-            ts = entry.get('ts')
-            ms_played = entry.get('ms_played')
-            if not ts or not ms_played:
-                continue
-            date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(
-                tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-            date_str = date.strftime("%Y-%m-%d")
-            daily_duration[date_str] += ms_played / 60000  # Minuten
-
-        # Sortieren der Daten nach Datum
-        sorted_days = sorted(daily_duration.items())
-        dates, durations = zip(*sorted_days)
-
-        plt.figure(figsize=(14, 6))
-        plt.bar(dates, durations, color="skyblue")
-        plt.xticks(rotation=45, ha='right')
-        plt.ylabel("Minuten")
-        plt.title(f"Hördauer pro Tag – {month_key}")
-        plt.tight_layout()
-        chart_daily_path = os.path.join(output_path, "img", f"daily_minutes_{month_key}.png")
-        plt.savefig(chart_daily_path, bbox_inches='tight', pad_inches=0.5)
-        plt.close()
-
-        utils.append_md(month_file, f"### Tägliche Hördauer\n"
+        # Hördauer pro Tag im Monat (Balkendiagramm), bereits nach Datum sortiert
+        dates = [day_to_date(day).strftime("%Y-%m-%d") for day in month_days]
+        durations = list(daily_ms[active_day_months == month_code] / 60000)  # Minuten
+
+        chart_utils.render(chart_utils.bar_chart(
+            os.path.join(output_path, "img", f"daily_minutes_{month_key}.png"),
+            dates, durations, f"Hördauer pro Tag – {month_key}",
+            ylabel="Minuten", figsize=(14, 6), xticks={"rotation": 45, "ha": "right"},
+        ))
+
+        month_md.append(f"### Tägliche Hördauer\n"
                                     f"![Hördauer pro Tag – {month_key}](../img/daily_minutes_{month_key}.png)\n")
 
         
-    return songs_per_month.keys()
+    return month_keys
 
-def analyse_general(data, output_file):
+def analyse_general(dataset, general_md):
     print("📊 Analysiere allgemeine Statistiken...")
-    total_songs = len(data)
-    songs_with_min_duration = sum(1 for entry in data if entry.get('ms_played', 0) >= MIN_PLAY_DURATION)
-    total_duration = sum(entry.get('ms_played', 0) for entry in data) / 1000  # in Sekunden
+    total_songs = len(dataset)
+    songs_with_min_duration = int(np.count_nonzero(dataset.ms_played >= MIN_PLAY_DURATION))
+    total_duration = dataset.total_ms_played / 1000  # in Sekunden
     total_duration_hours = total_duration / 3600
     total_duration_days = total_duration_hours / 24
-    different_songs = set()
-    for entry in data:
-        track_uri = entry.get('spotify_track_uri')
-        if track_uri:
-            different_songs.add(track_uri)
+    different_songs = len(np.unique(dataset.track_codes[dataset.track_codes >= 0]))
 
-    start_date = datetime.strptime(data[0].get('ts'), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).date()
-    end_date = datetime.strptime(data[-1].get('ts'), '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).date()
+    active_days = np.unique(dataset.day)
+    start_date = day_to_date(active_days[0])
+    end_date = day_to_date(active_days[-1])
 
     days_count = (end_date - start_date).days + 1  # +1, damit Start- und Endtag mitzählen
 
-    days_with_activity = set()
-    for entry in data:
-        ts = entry.get('ts')
-        if ts:
-            date = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).date()
-            days_with_activity.add(date)
+    days_with_activity = len(active_days)
 
-    utils.append_md(output_file, f"## Allgemeine Statistiken\n"
+    general_md.append(f"## Allgemeine Statistiken\n"
                             f"- **Zeitspanne der Daten:** {start_date} bis {end_date} ({days_count} Tage)\n"
-                            f"- **Anzahl der Tage (mit Höraktivität):** {len(days_with_activity)}\n"
+                            f"- **Anzahl der Tage (mit Höraktivität):** {days_with_activity}\n"
                             f"- **Anzahl der gehörten Songs:** {total_songs}\n"
                             f"- **Anzahl der gehörten Songs mit mindestens {(MIN_PLAY_DURATION / 1000):.0f} Sekunden Hördauer:** {songs_with_min_duration}\n"
-                            f"- **Anzahl der unterschiedlichen Songs:** {len(different_songs)}\n"
+                            f"- **Anzahl der unterschiedlichen Songs:** {different_songs}\n"
                             f"- **Gesamthördauer:** {total_duration_days:.2f} Tage ({total_duration_hours:.2f} Stunden) ({total_duration / 60:.2f} Minuten)\n"
                             f"- **Durchschnittliche Hördauer pro Tag:** {total_duration / days_count / 60:.2f} Minuten\n"
-                            f"- **Durchschnittliche Hördauer pro Tag (mit Höraktivität):** {total_duration / len(days_with_activity)/60:.2f} Minuten\n"
+                            f"- **Durchschnittliche Hördauer pro Tag (mit Höraktivität):** {total_duration / days_with_activity/60:.2f} Minuten\n"
                             f"- **Durchschnittliche Hördauer pro Song:** {(total_duration / total_songs) / 60:.2f} Minuten\n"
                             f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag:** {songs_with_min_duration / days_count:.2f}\n"
-                            f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag (mit Höraktivität):** {songs_with_min_duration / len(days_with_activity):.2f}\n")
+                            f"- **Durchschnittliche Anzahl Songs (min {(MIN_PLAY_DURATION / 1000):.0f}s) pro Tag (mit Höraktivität):** {songs_with_min_duration / days_with_activity:.2f}\n")
 
-def analyse_activity_by_time(data, output_file, output_path):
+def analyse_activity_by_time(dataset, general_md, output_path):
     print("📊 Analysiere Hörverhalten zu verschiedenen Zeiten...")
-    utils.append_md(output_file, f"## Zeitliche Verteilung der Songs")
+    general_md.append(f"## Zeitliche Verteilung der Songs")
 
-    # Gesamtanzahl Songs pro Monat zählen
-    songs_per_month = defaultdict(int)
+    min_duration = dataset.ms_played >= MIN_PLAY_DURATION
 
-    for entry in data:
-        ts = entry.get('ts')
-        if not ts or entry.get('ms_played', 0) < MIN_PLAY_DURATION:
-            continue
-        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-        month = date.strftime("%Y-%m")  # z.B. "2025-07"
-        songs_per_month[month] += 1
+    # Gesamtanzahl Songs pro Monat zählen
+    songs_per_month = np.bincount(dataset.month_codes[min_duration], minlength=len(dataset.months))
 
-    # Sortieren nach Monat (chronologisch)
-    sorted_months = sorted(songs_per_month.keys())
-    counts = [songs_per_month[m] for m in sorted_months]
+    # Chronologisch sortiert, nur Monate mit Höraktivität
+    sorted_months = [month for month, count in zip(dataset.months, songs_per_month) if count]
+    counts = [int(count) for count in songs_per_month if count]
 
     # Monatsnamen im deutschen Format für die x-Achse (z.B. "07.2025")
-    labels = [datetime.strptime(m, "%Y-%m").replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None).strftime("%m.%Y") for m in sorted_months]
+    labels = [datetime.strptime(m, "%Y-%m").strftime("%m.%Y") for m in sorted_months]
 
-    plt.figure(figsize=(12, 6))
-    plt.bar(labels, counts, color="skyblue")
-    plt.ylabel("Anzahl gehörter Songs")
-    plt.title("Gesamte Anzahl der gehörten Songs pro Monat")
-    plt.xticks(rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.tight_layout()
+    chart_utils.render(chart_utils.bar_chart(
+        os.path.join(output_path, "img", "songs_per_month.png"),
+        labels, counts, "Gesamte Anzahl der gehörten Songs pro Monat",
+        ylabel="Anzahl gehörter Songs", grid=True,
+    ))
 
-    chart_path = os.path.join(output_path, "img", "songs_per_month.png")
-    plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
-    plt.close()
-
-    utils.append_md(output_file, "### Höraktivität pro Monat\n"
+    general_md.append("### Höraktivität pro Monat\n"
                             "![Songs pro Monat](./img/songs_per_month.png)\n")
 
-    # Dictionaries für Gesamtanzahl & Vorkommen des Wochentags
-    total_songs = defaultdict(int)
-    weekday_counts = defaultdict(int)
-
-    for entry in data:
-        ts = entry.get('ts')
-        if not ts or entry.get('ms_played', 0) < MIN_PLAY_DURATION:
-            continue
-        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-        weekday = date.strftime("%A")
-        date_str = date.strftime("%Y-%m-%d")
-
-        total_songs[weekday] += 1
-        weekday_counts[f"{weekday}_{date_str}"] = 1  # pro Tag nur einmal zählen
-
-    # Anzahl einzelner Tage pro Wochentag berechnen
-    unique_days_per_weekday = defaultdict(int)
-    for key in weekday_counts.keys():
-        wd = key.split("_")[0]
-        unique_days_per_weekday[wd] += 1
+    # Gesamtanzahl Songs & Anzahl einzelner Tage pro Wochentag
+    total_songs = np.bincount(dataset.weekday[min_duration], minlength=7)
+    active_days = np.unique(dataset.day[min_duration])
+    unique_days_per_weekday = np.bincount((active_days + 3) % 7, minlength=7)  # 1970-01-01 war ein Donnerstag
 
     # Durchschnitt berechnen
     average_songs = {}
-    for weekday in ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]:
-        days_count = unique_days_per_weekday.get(weekday, 1)  # zur Sicherheit nicht durch 0 teilen
-        average_songs[weekday] = total_songs[weekday] / days_count
-
-    # Plotten
-    plt.figure(figsize=(10, 6))
-    plt.bar(average_songs.keys(), average_songs.values(), color="skyblue")
-
-    # Zahlen über Balken schreiben
-    for i, (day, value) in enumerate(average_songs.items()):
-        plt.text(i, value + 0.2, f"{value:.1f}", ha='center', va='bottom', fontsize=9)
-
-    plt.title("Durchschnittliche Songs pro Wochentag")
-    plt.ylabel("⌀ Anzahl Songs pro Tag")
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    chart_path = os.path.join(output_path, "img", "songs_per_day_in_week.png")
-    plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
-    plt.close()
-
-    utils.append_md(output_file, f"### Hörverhalten nach Wochentag\n"
+    for weekday_index, weekday in enumerate(WEEKDAYS):
+        days_count = int(unique_days_per_weekday[weekday_index]) or 1  # zur Sicherheit nicht durch 0 teilen
+        average_songs[weekday] = int(total_songs[weekday_index]) / days_count
+
+    # Plotten (mit Zahlen über den Balken)
+    chart_utils.render(chart_utils.bar_chart(
+        os.path.join(output_path, "img", "songs_per_day_in_week.png"),
+        average_songs.keys(), average_songs.values(), "Durchschnittliche Songs pro Wochentag",
+        ylabel="⌀ Anzahl Songs pro Tag", figsize=(10, 6), grid=True, value_labels=True,
+    ))
+
+    general_md.append(f"### Hörverhalten nach Wochentag\n"
                             f"![Anzahl der Songs pro Tag](./img/songs_per_day_in_week.png)\n")
 
-def analyse_top_songs(data, output_file, output_path):
+def analyse_top_songs(dataset, general_md, output_path, month_mds):
     print("📊 Analysiere Top-Songs...")
-    utils.append_md(output_file, "## Top-Songs")
-
-    # Songs nach Monaten gruppieren
-    top_songs_per_month = defaultdict(dict)  # Monat -> {spotify_track_uri: song_entry}
-    top_songs_full_time = {}  # spotify_track_uri -> song_entry
-
-    for entry in data:
-        ts = entry.get("ts")
-        if (
-            not ts
-            or entry.get("ms_played", 0) < MIN_PLAY_DURATION
-            or not entry.get("master_metadata_track_name")
-        ):
-            continue
-
-        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-        date = date.astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-        month = date.strftime("%Y-%m")
-
-        uri = entry["spotify_track_uri"]
+    general_md.append("## Top-Songs")
 
-        # Monatliche Songs
-        if uri not in top_songs_per_month[month]:
-            new_entry = copy.deepcopy(entry)  # deepcopy via copy-Modul
-            new_entry["times_played"] = 1
-            top_songs_per_month[month][uri] = new_entry
-        else:
-            top_songs_per_month[month][uri]["times_played"] += 1
-
-        # Gesamt
-        if uri not in top_songs_full_time:
-            new_entry = copy.deepcopy(entry)  # deepcopy via copy-Modul
-            new_entry["times_played"] = 1
-            top_songs_full_time[uri] = new_entry
-        else:
-            top_songs_full_time[uri]["times_played"] += 1
+    valid = dataset.valid
+    tracks = dataset.track_codes[valid]
+    songs_with_data = db.get_song_fields_many(dataset.track_uris)
 
-    top_songs_full_time = sorted(top_songs_full_time.values(), key=lambda x: x["times_played"], reverse=True)
-    top_songs_full_time_top_25 = top_songs_full_time[:25]
+    # Gesamt
+    top_songs_full_time = ranked_by_group(np.zeros(len(tracks), dtype=np.int32), tracks, limit=25)
+    top_songs_full_time_top_25 = dataset.track_stats(*top_songs_full_time.get(0, ([], [])))
 
-    utils.append_md(output_file, f"### Top-Songs (gesamt)")
+    general_md.append(f"### Top-Songs (gesamt)")
 
     i = 0
-    utils.append_md(output_file, "##### 1 bis 10")
+    general_md.append("##### 1 bis 10")
     for song in top_songs_full_time_top_25:
-        if i == 10: utils.append_md(output_file, "##### 11 bis 25")
+        if i == 10: general_md.append("##### 11 bis 25")
         i+=1
-        
-        lastfm_data = db.get_song_data(song["spotify_track_uri"])
 
-        track_name = song.get("master_metadata_track_name", "Unbekannt")
-        artist_name = song.get("master_metadata_album_artist_name", "Unbekannt")
-        times_played = song.get("times_played", 0)
-        if lastfm_data:
-            link = f'[[./songs/{song["spotify_track_uri"][14:]}.md|{track_name}]]'
+        if song.uri in songs_with_data:
+            link = f'[[./songs/{song.uri[14:]}.md|{song.track_name}]]'
         else:
-            link = track_name
+            link = song.track_name
+
+        general_md.append(f"{i}. **{link}** von {song.artist_name} – **{song.times_played}** mal gehört")
+    general_md.append("\n")
 
-        utils.append_md(
-            output_file,
-            f"{i}. **{link}** von {artist_name} – **{times_played}** mal gehört",
-        )
-    utils.append_md(output_file, "\n")
+    # Songs nach Monaten gruppieren (chronologisch)
+    top_songs_per_month = ranked_by_group(dataset.month_codes[valid], tracks, limit=25)
 
-    for month in sorted(top_songs_per_month.keys()):
-        month_file = os.path.join(output_path, "months", month + ".md")
-        songs = top_songs_per_month[month]
-        # Sortiere Songs nach Anzahl der Plays
-        songs = sorted(songs.values(), key=lambda x: x["times_played"], reverse=True)
+    for month_code, (track_codes, play_counts) in top_songs_per_month.items():
+        month = dataset.months[month_code]
+        month_md = month_mds.get(month)
+        if month_md is None:
+            general_md.append("\n")
+            continue
 
-        # Nimm die Top 10 Songs
-        top_songs = songs[:25]
+        # Die Top 25 Songs
+        top_songs = dataset.track_stats(track_codes, play_counts)
 
-        utils.append_md(month_file, "### Top-Songs")
+        month_md.append("### Top-Songs")
 
         i = 0
-        utils.append_md(month_file, "##### 1 bis 10")
+        month_md.append("##### 1 bis 10")
         for song in top_songs:
-            if i == 10: utils.append_md(month_file, "##### 11 bis 25")
+            if i == 10: month_md.append("##### 11 bis 25")
             i+=1
 
-            lastfm_data = db.get_song_data(song["spotify_track_uri"])
-
-            track_name = song.get("master_metadata_track_name", "Unbekannt")
-            artist_name = song.get("master_metadata_album_artist_name", "Unbekannt")
-            times_played = song.get("times_played", 0)
-
-            if lastfm_data:
-                link = f'[[../songs/{song["spotify_track_uri"][14:]}.md|{track_name}]]'
+            if song.uri in songs_with_data:
+                link = f'[[../songs/{song.uri[14:]}.md|{song.track_name}]]'
             else:
-                link = track_name
+                link = song.track_name
 
-            utils.append_md(
-                month_file,
-                f"{i}. **{link}** von {artist_name} – **{times_played}** mal gehört",
-            )
-        utils.append_md(output_file, "\n")
+            month_md.append(f"{i}. **{link}** von {song.artist_name} – **{song.times_played}** mal gehört")
+        general_md.append("\n")
 
-def analyse_top_artists(data, output_file, output_path):
+def analyse_top_artists(dataset, general_md, output_path, month_mds, pages):
     print("📊 Analysiere Top-Artists...")
-    utils.append_md(output_file, "## Top-Artists")
-
-    artist_times = defaultdict(int)
-    artist_urls = defaultdict(str)
-    artist_times_by_month = defaultdict(lambda: defaultdict(int)) # Monat → Künstler → Zeit
-
-    for song in data:
-        if song is None: continue
-        artist = song.get("master_metadata_album_artist_name")
-        lastfm_data = db.get_song_data(song.get("spotify_track_uri"))
-        artist_urls[artist] = lastfm_data['artist']['url'] if lastfm_data else None
-        artist_times[artist] += song['ms_played']
-        ts = song['ts']
-        dt = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-        month = dt.strftime("%Y-%m")
-        artist_times_by_month[month][artist] += song['ms_played']
-
-    artist_times_sorted = sorted(artist_times.items(), key=lambda x: x[1], reverse=True)
-
-    top_artists = artist_times_sorted[:40]
-
-    utils.append_md(output_file, f"### Top-Artists (gesamt)")
+    general_md.append("## Top-Artists")
+
+    artist_codes = dataset.artist_codes
+    ms_played = dataset.ms_played
+
+    # Letzter Eintrag je Artist (-1 = ohne Artist) bestimmt den Last.fm-Link
+    last_event = np.full(len(dataset.artists) + 1, -1, dtype=np.int64)
+    np.maximum.at(last_event, artist_codes + 1, np.arange(len(artist_codes)))
+    artist_urls = {}
+
+    def artist_url(artist_code):
+        if artist_code not in artist_urls:
+            track_code = dataset.track_codes[last_event[artist_code + 1]]
+            artist_urls[artist_code] = db.get_artist_url_from_song_data(dataset.track_uri(track_code))
+        return artist_urls[artist_code]
+
+    def artist_link(artist_code, prefix):
+        artist = dataset.artist_name(artist_code)
+        link = pages.link("artists", artist, artist, prefix)
+        if link:
+            return link
+        url = artist_url(artist_code)
+        return f"[{artist}]({url})" if url else artist
+
+    # Gesamtzeit je Artist (in Reihenfolge des ersten Auftretens), gerankt werden nur die Top 40
+    total_codes, total_ms, first_index = group_sum(artist_codes, ms_played)
+    artist_times = {dataset.artist_name(code): played_ms for code, played_ms in zip(total_codes.tolist(), total_ms.tolist())}
+
+    top_rows = ranking.top_k(total_ms, 40, first_index)
+    top_artists = list(zip(total_codes[top_rows].tolist(), total_ms[top_rows].tolist()))
+
+    general_md.append(f"### Top-Artists (gesamt)")
     
     # --- Kuchendiagramm (Gesamt) ---
     pie_path = utils.plot_pie_chart(artist_times,
@@ -434,74 +346,66 @@ def analyse_top_artists(data, output_file, output_path):
                                     output_path,
                                     data_size=35,
                                     show_percentages_in_legend=True)
-    utils.append_md(output_file, f"![Top 25 Artists Gesamt](./img/{os.path.basename(pie_path)})")
+    general_md.append(f"![Top 25 Artists Gesamt](./img/{os.path.basename(pie_path)})")
 
     i = 0
-    utils.append_md(output_file, "##### 1 bis 10")
-    for artist, played_ms in top_artists:
-        if not artist: continue
-        if i == 10: utils.append_md(output_file, "##### 11 bis 25")
-        if i == 25: utils.append_md(output_file, "##### 26 bis 40")
+    general_md.append("##### 1 bis 10")
+    for artist_code, played_ms in top_artists:
+        if artist_code < 0: continue
+        if i == 10: general_md.append("##### 11 bis 25")
+        if i == 25: general_md.append("##### 26 bis 40")
         i+=1
-        link = f"[[./artists/{utils.sanitize_filename(artist)}.md|{artist}]]" if os.path.exists(os.path.join(output_path, "artists", utils.sanitize_filename(artist or "") + ".md")) else f"[{artist}]({artist_urls[artist]})" if artist_urls[artist] else artist
-        utils.append_md(output_file, f"{i}. **{link}** mit **{(played_ms / 1000 / 60 / 60):.2f} Stunden** Spielzeit")
-
-    # Monatliche Auswertung
-    for month in sorted(artist_times_by_month):
-        month_file = os.path.join(output_path, "months", month + ".md")
-        utils.append_md(month_file, "\n### Top-Artists")
+        general_md.append(f"{i}. **{artist_link(artist_code, '.')}** mit **{(played_ms / 1000 / 60 / 60):.2f} Stunden** Spielzeit")
+
+    # Monatliche Auswertung (Monat → Künstler → Zeit)
+    artist_times_by_month = totals_by_group(dataset.month_codes, artist_codes, ms_played)
+    for month_code, (month_artist_codes, month_ms) in artist_times_by_month.items():
+        month = dataset.months[month_code]
+        month_md = month_mds.get(month)
+        if month_md is None:
+            continue
+        month_md.append("\n### Top-Artists")
         
         # Kuchendiagramm für diesen Monat
-        pie_path_month = utils.plot_pie_chart(artist_times_by_month[month], 
+        pie_path_month = utils.plot_pie_chart({dataset.artist_name(code): played_ms for code, played_ms in zip(month_artist_codes, month_ms)},
                                         f"Top 25 Artists im Monat {month}", 
                                         f"top25_artists_{month}.png", 
                                         output_path,
                                         data_size=25,
                                         show_percentages_in_legend=True)
-        utils.append_md(month_file, f"![Top 25 Artists {month}](../img/{os.path.basename(pie_path_month)})")
+        month_md.append(f"![Top 25 Artists {month}](../img/{os.path.basename(pie_path_month)})")
         
-        monthly_sorted = sorted(
-            artist_times_by_month[month].items(), key=lambda x: x[1], reverse=True
-        )[:10]
+        monthly_sorted = ranking.top_items(zip(month_artist_codes, month_ms), 10, key=lambda x: x[1])
 
-        for idx, (artist, played_ms) in enumerate(monthly_sorted, start=1):
-            if artist == "unknown":
+        for idx, (artist_code, played_ms) in enumerate(monthly_sorted, start=1):
+            if dataset.artist_name(artist_code) == "unknown":
                 continue
-            link = f"[[../artists/{utils.sanitize_filename(artist)}.md|{artist}]]" if os.path.exists(os.path.join(output_path, "artists", utils.sanitize_filename(artist or "") + ".md")) else f"[{artist}]({artist_urls[artist]})" if artist_urls[artist] else artist
             stunden = played_ms / 1000 / 60 / 60
-            utils.append_md(month_file, f"{idx}. **{link}** – **{stunden:.2f} Stunden**")
+            month_md.append(f"{idx}. **{artist_link(artist_code, '..')}** – **{stunden:.2f} Stunden**")
     
     # --- Diagramm: Top 10 Artists pro Monat (Stunden gehört) ---
 
     # Alle Monate chronologisch sortieren
-    all_months = sorted(artist_times_by_month.keys())
-    # Top 10 Artists nach Gesamtspielzeit
-    top10_artists = [artist for artist, _ in top_artists[:10]]
+    all_months = dataset.months
+    # Top 10 Artists nach Gesamtspielzeit (Einträge ohne Artist, z.B. Podcasts, zählen nicht)
+    top10_artists = [artist_code for artist_code, _ in top_artists if artist_code >= 0][:10]
 
     # Für jeden Artist: Liste der gehörten Stunden pro Monat (0 wenn nicht vorhanden)
-    artist_month_hours = {artist: [] for artist in top10_artists}
-    for month in all_months:
-        for artist in top10_artists:
-            ms = artist_times_by_month[month].get(artist, 0)
-            hours = ms / 1000 / 60 / 60
-            artist_month_hours[artist].append(hours)
-
-    plt.figure(figsize=(14, 7))
-    for artist in top10_artists:
-        plt.plot(all_months, artist_month_hours[artist], marker='o', label=utils.to_ascii(artist))
-
-    plt.title("Top 10 Artists: Gehört pro Monat (Stunden)")
-    plt.xlabel("Monat")
-    plt.ylabel("Gehörte Stunden")
-    plt.xticks(rotation=45)
-    plt.legend()
-    plt.tight_layout()
-
-    chart_path = os.path.join(output_path, "img", "top10_artists_per_month.png")
-    plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
-    plt.close()
-
-    utils.append_md(output_file, "### Top 10 Artists – Gehört pro Monat\n"
+    artist_month_hours = {}
+    for artist_code in top10_artists:
+        is_artist = artist_codes == artist_code
+        monthly_ms = np.bincount(dataset.month_codes[is_artist], weights=ms_played[is_artist], minlength=len(all_months))
+        artist_month_hours[artist_code] = list(monthly_ms / 1000 / 60 / 60)
+
+    chart_utils.render(chart_utils.line_chart(
+        os.path.join(output_path, "img", "top10_artists_per_month.png"),
+        all_months,
+        [(artist_month_hours[artist_code], {"marker": "o", "label": utils.to_ascii(dataset.artist_name(artist_code))}) for artist_code in top10_artists],
+        "Top 10 Artists: Gehört pro Monat (Stunden)",
+        xlabel="Monat", ylabel="Gehörte Stunden", figsize=(14, 7), xticks={"rotation": 45},
+    ))
+
+    general_md.append("### Top 10 Artists – Gehört pro Monat\n"
                                 "![Top 10 Artists pro Monat](./img/top10_artists_per_month.png)\n")
 
 if __name__ == "__main__":
@@ -1,180 +1,204 @@
 import utils
+import chart_utils
 import os
 import json
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-from datetime import datetime, timezone, timedelta
-from zoneinfo import ZoneInfo
+import numpy as np
 import sys
-from config import TIMEZONE, MIN_PLAY_DURATION, RECREATE_SONGDATA_FILES
+from config import MIN_PLAY_DURATION, RECREATE_SONGDATA_FILES, SONG_PAGE_WORKERS
 from database import db
+from dataset import load_dataset, ranked_by_group, local_timestamps
 
-created_files = set()
+PAGE_BATCH_SIZE = 1000  # Songs, deren Daten auf einmal geladen und an die Worker gegeben werden
+HISTORY_FILENAME = "listening_history.md"
+HISTORY_CHUNK_SIZE = 10000  # Zeilen der Hörverlauf-Tabelle, die auf einmal erzeugt und geschrieben werden
 
-def main(input_filename: str):
-    input_path = os.path.join("userdata", input_filename)
-    output_dir = os.path.join("output", input_filename.replace(".json", ""))
+def main(input_filename: str, dataset=None, changes=None, pages=None):
+    output_dir = utils.get_output_path(input_filename)
     os.makedirs(os.path.join(output_dir, "songs"), exist_ok=True)
 
     output_file = os.path.join(output_dir, "songs.md")
 
-    print(f"📂 Lese Daten aus: {input_path}")
-    data = utils.load_data(input_path)
-    
-    data_count = len(data)
-    for i, song in enumerate(data):
-        generate_songdata_file(song.get("spotify_track_uri"), os.path.join("userdata", input_filename), os.path.join("output", input_filename.replace(".json", ""), "songs"))
-        print(f"✅ | {str(i).zfill(len(str(data_count)))} / {data_count}")
+    if dataset is None:
+        dataset = load_dataset(input_filename)
+    if pages is None:
+        pages = utils.PageRegistry.scan(output_dir)
+    existing = utils.PageRegistry.scan(output_dir)
+
+    songs_with_data = db.get_song_fields_many(dataset.track_uris)
+    # Eine songdata file pro Song (nicht pro Eintrag)
+    generate_songdata_files(dataset, os.path.join(output_dir, "songs"), pages, existing, changes)
 
-    utils.clear_md(output_file)
     print("📊 Analysiere Songs...")
     
-    utils.append_md(output_file, "### All songs sorted by times listened\n")
+    songs_md = utils.MarkdownDocument(output_file)
+    songs_md.append("### All songs sorted by times listened\n")
     
-    all_songs_unsorted = {}  # spotify_track_uri -> song_entry
-
-    for entry in data:
-        ts = entry.get("ts")
-        if (
-            not ts
-            or entry.get("ms_played", 0) < MIN_PLAY_DURATION
-            or not entry.get("master_metadata_track_name")
-        ):
-            continue
-
-        uri = entry["spotify_track_uri"]
-
-        # Gesamt
-        if uri not in all_songs_unsorted:
-            new_entry = json.loads(json.dumps(entry))  # deepcopy via JSON
-            new_entry["times_played"] = 1
-            all_songs_unsorted[uri] = new_entry
-        else:
-            all_songs_unsorted[uri]["times_played"] += 1
-
-    all_songs_sorted = sorted(all_songs_unsorted.values(), key=lambda x: x["times_played"], reverse=True)
+    track_codes = dataset.track_codes[dataset.valid]
+    all_songs_sorted = dataset.track_stats(*ranked_by_group(np.zeros(len(track_codes), dtype=np.int32), track_codes).get(0, ([], [])))
     
     i = 0
     for song in all_songs_sorted:
         i+=1
         
-        lastfm_data = db.get_song_data(song.get("spotify_track_uri"))
-
-        track_name = song.get("master_metadata_track_name", "Unbekannt")
-        artist_name = song.get("master_metadata_album_artist_name", "Unbekannt")
-        times_played = song.get("times_played", 0)
-        if lastfm_data:
-            link = f'[[./songs/{song["spotify_track_uri"][14:]}.md|{track_name}]]'
+        if song.uri in songs_with_data:
+            link = f'[[./songs/{song.uri[14:]}.md|{song.track_name}]]'
         else:
-            link = track_name
-
-        utils.append_md(
-            output_file,
-            f"{i}. **{link}** von {artist_name} – **{times_played}** mal gehört",
-        )
-    utils.append_md(output_file, "\n")
-    
-    # append_full_listening_history(output_file, data) # produces too much lag
-
-def plot_song_listening_over_time(spotify_data, track_id, lastfm_data, filename, output_path):
-    song_name=lastfm_data.get("name", "Unbekannt")
-    artist_name=lastfm_data.get("artist", {}).get("name", "Unbekannt")
-    
-    TIMEZONE_OBJ = ZoneInfo(TIMEZONE) if TIMEZONE else None
-
-    # Gültige Plays des gewünschten Songs filtern
-    filtered = [
-        entry for entry in spotify_data
-        if entry.get("spotify_track_uri") == track_id
-        and entry.get("ms_played", 0) > MIN_PLAY_DURATION
-        and entry.get("spotify_track_uri") is not None
-    ]
-
-    if not filtered:
-        print(f"⚠️  Keine gültigen Abspiel-Daten für Song {song_name}. Kein Diagramm erstellt.")
+            link = song.track_name
+
+        songs_md.append(f"{i}. **{link}** von {song.artist_name} – **{song.times_played}** mal gehört")
+    songs_md.append("\n")
+    songs_md.append("### Full listening history")
+    songs_md.append(f"[[./{HISTORY_FILENAME}|Every play with date, time and how it ended]]")
+    write_full_listening_history(os.path.join(output_dir, HISTORY_FILENAME), dataset, pages)
+    chart_utils.wait_for_charts()
+    songs_md.save()
+
+def generate_songdata_files(dataset, output_path, pages, existing, changes=None):
+    """
+    Write the pages of all songs (pages: registry the pages are added to, existing: pages that were there before the run).
+    The pages are built by build_song_page on SONG_PAGE_WORKERS processes from precomputed per-track data.
+    This process renders the charts, writes the pages and registers them in the order of dataset.track_uris,
+    so the output is the same for any number of workers.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    play_counts = song_play_counts(dataset)
+    data_count = len(dataset.track_uris)
+
+    executor = _page_executor(dataset.month_axis, os.path.join(output_path, "..", "img"))
+    try:
+        for start in range(0, data_count, PAGE_BATCH_SIZE):
+            jobs = song_page_jobs(dataset, range(start, min(start + PAGE_BATCH_SIZE, data_count)), play_counts, existing, changes)
+            # map() liefert die Ergebnisse in der Reihenfolge der Jobs, egal welcher Worker zuerst fertig ist
+            results = executor.map(build_song_page, jobs, chunksize=64) if executor is not None else map(build_song_page, jobs)
+            for i, page in enumerate(results, start=start + 1):
+                write_song_page(page, output_path, pages, existing)
+                print(f"✅ | {str(i).zfill(len(str(data_count)))} / {data_count}")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+def song_play_counts(dataset):
+    """
+    Play data of all tracks for the song pages, computed in one pass:
+    events (number of events per track code) and the valid plays per month in CSR layout
+    (the months and counts of track code t are months[offsets[t]:offsets[t + 1]] and counts[offsets[t]:offsets[t + 1]]).
+    """
+    track_count, month_count = len(dataset.track_uris), max(len(dataset.month_axis), 1)
+    has_track = dataset.track_codes >= 0
+    played = has_track & (dataset.ms_played > MIN_PLAY_DURATION)
+
+    keys = dataset.track_codes[played].astype(np.int64) * month_count + dataset.month_axis_codes[dataset.month_codes[played]]
+    keys, counts = np.unique(keys, return_counts=True)
+    tracks, months = np.divmod(keys, month_count)
+    return {
+        "events": np.bincount(dataset.track_codes[has_track], minlength=track_count),
+        "offsets": np.searchsorted(tracks, np.arange(track_count + 1)),
+        "months": months,
+        "counts": counts,
+    }
+
+def song_page_jobs(dataset, track_codes, play_counts, existing, changes=None):
+    """
+    Everything build_song_page needs to build the pages of the given tracks.
+    Existing pages are kept unless the song has new plays or RECREATE_SONGDATA_FILES is set,
+    the Last.fm data is only loaded for pages or charts that are (re)built and passed on as undecoded JSON.
+    """
+    jobs = []
+    for track_code in track_codes:
+        track_id = dataset.track_uris[track_code]
+        changed = changes is not None and changes.track(track_id)
+        begin, end = play_counts["offsets"][track_code], play_counts["offsets"][track_code + 1]
+        jobs.append({
+            "track_id": track_id,
+            "keep_page": existing.has("songs", track_id) and not RECREATE_SONGDATA_FILES and not changed,
+            # Die Seite bleibt, das Diagramm hängt aber auch von der Monatsachse ab
+            "refresh_chart": changes is not None,
+            "song_json": None,
+            "events": int(play_counts["events"][track_code]),
+            "months": play_counts["months"][begin:end],
+            "counts": play_counts["counts"][begin:end],
+        })
+
+    needs_data = [job["track_id"] for job in jobs if job["track_id"] and (not job["keep_page"] or job["refresh_chart"])]
+    song_json = db.get_song_json_many(needs_data)
+    for job in jobs:
+        job["song_json"] = song_json.get(job["track_id"])
+    return jobs
+
+# === Worker ===
+_page_context = {}
+
+def _init_page_worker(month_axis, img_path):
+    _page_context["month_axis"] = month_axis
+    _page_context["img_path"] = img_path
+
+def _page_executor(month_axis, img_path):
+    """Process pool for build_song_page, None if the pages are built in this process (SONG_PAGE_WORKERS <= 1)"""
+    if SONG_PAGE_WORKERS <= 1:
+        _init_page_worker(list(month_axis), img_path)
         return None
+    return chart_utils.process_pool(SONG_PAGE_WORKERS, initializer=_init_page_worker, initargs=(list(month_axis), img_path))
 
-    # X-Achse: alle Monate im Datensatz (aus spotify_data)
-    months_all = [
-        datetime.strptime(e["ts"], "%Y-%m-%dT%H:%M:%SZ")
-        .replace(tzinfo=timezone.utc).astimezone(TIMEZONE_OBJ)
-        .replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        for e in spotify_data
-    ]
-    start, end = min(months_all), max(months_all)
-
-    # Zeitachse erzeugen (alle Monate im Zeitraum)
-    full_months = []
-    current = start
-    while current <= end:
-        full_months.append(current.strftime("%Y-%m"))
-        current += timedelta(days=32)
-        current = current.replace(day=1)
-
-    # Zählung gültiger Plays des Songs pro Monat
-    count_by_month = {}
-    for entry in filtered:
-        dt = datetime.strptime(entry["ts"], "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).astimezone(TIMEZONE_OBJ)
-        key = dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime("%Y-%m")
-        count_by_month[key] = count_by_month.get(key, 0) + 1
-
-    # Y-Achse: Anzahl Plays (0 wenn keine)
-    counts = [count_by_month.get(month, 0) for month in full_months]
-
-    # Plot
-    plt.figure(figsize=(10, 5))
-    plt.bar(full_months, counts, color="skyblue")
-    ax = plt.gca()
-    ax.yaxis.set_major_locator(ticker.MaxNLocator(integer=True))
-    plt.title(f"Listening activity per month: {utils.to_ascii(song_name)} - {utils.to_ascii(artist_name)}")
-    plt.ylabel("times listened")
-    plt.xticks(rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.tight_layout()
+def song_chart(job, lastfm_data, messages):
+    """Spec and hash of the chart of valid plays per month of a song, None if it has no valid plays"""
+    song_name = lastfm_data.get("name", "Unbekannt")
+    artist_name = lastfm_data.get("artist", {}).get("name", "Unbekannt")
 
-    os.makedirs(output_path, exist_ok=True)
-    path = os.path.join(output_path, filename)
-    plt.savefig(path, bbox_inches='tight', pad_inches=0.5)
-    plt.close()
-    return filename
+    if not len(job["counts"]):
+        messages.append(f"⚠️  Keine gültigen Abspiel-Daten für Song {song_name}. Kein Diagramm erstellt.")
+        return None
 
-def generate_songdata_file(track_id, data_path, output_path):
-    os.makedirs(os.path.join(output_path), exist_ok=True)
-    
-    if track_id in created_files: return
-    print(f"🆕 | Generiere songdata file {track_id}...")
+    # X-Achse: alle Monate im Zeitraum des Datensatzes, Y-Achse: gültige Plays pro Monat (0 wenn keine)
+    month_axis = _page_context["month_axis"]
+    counts = np.zeros(len(month_axis), dtype=np.int64)
+    counts[job["months"]] = job["counts"]
 
-    if not track_id or not data_path:
-        print("❌ | Zum Erstellen einer songdata file muss eine track_id und ein data_path gegeben sein! - Generierung wird übersprungen!")
-        return "error"
-    
-    songdata_file = os.path.join(output_path, track_id[14:] + ".md")
-    if os.path.exists(songdata_file) and not RECREATE_SONGDATA_FILES: 
-        print(f"ℹ️  | Songdata file existiert bereits. ({track_id})")
-        return "done"
-
-    spotify_data = [s for s in utils.load_data(data_path) if s.get("spotify_track_uri") == track_id]
-    if not spotify_data:
-        print(f"⚠️  | Es wurde keine Höraktivität für den Song {track_id} gefunden. - Diese wird der songdata file nicht beigefügt!")
-    
-    lastfm_data = db.get_song_data(track_id)
+    spec = chart_utils.bar_chart(
+        os.path.join(_page_context["img_path"], job["track_id"][14:] + "_listening_over_time.png"),
+        month_axis, counts.tolist(), f"Listening activity per month: {utils.to_ascii(song_name)} - {utils.to_ascii(artist_name)}",
+        ylabel="times listened", figsize=(10, 5), grid=True, integer_y=True,
+    )
+    return spec, chart_utils.spec_hash(spec)
+
+def build_song_page(job):
+    """
+    Build the page of a song from its job (see song_page_jobs), without using the database or the output directory.
+    Returns a dict with the track id, the page content (None if the page is kept or skipped),
+    the chart as (spec, hash) or None, the messages to print and the status ("done" or "error").
+    """
+    track_id = job["track_id"]
+    messages = [f"🆕 | Generiere songdata file {track_id}..."]
+    page = {"track_id": track_id, "content": None, "chart": None, "messages": messages, "status": "error"}
+
+    if not track_id:
+        messages.append("❌ | Zum Erstellen einer songdata file muss eine track_id gegeben sein! - Generierung wird übersprungen!")
+        return page
+
+    lastfm_data = json.loads(job["song_json"]).get("track") if job["song_json"] else None
+
+    if job["keep_page"]:
+        messages.append(f"ℹ️  | Songdata file existiert bereits. ({track_id})")
+        page["status"] = "done"
+        if job["refresh_chart"] and lastfm_data and lastfm_data.get("name"):
+            page["chart"] = song_chart(job, lastfm_data, messages)
+        return page
+
+    if not job["events"]:
+        messages.append(f"⚠️  | Es wurde keine Höraktivität für den Song {track_id} gefunden. - Diese wird der songdata file nicht beigefügt!")
 
     if lastfm_data is None:
-        print(f"❌ | Keine gecachten Last.FM-Daten für Song-ID {track_id} gefunden – Generierung wird übersprungen!")
-        return "error"
+        messages.append(f"❌ | Keine gecachten Last.FM-Daten für Song-ID {track_id} gefunden – Generierung wird übersprungen!")
+        return page
 
     if not lastfm_data or not lastfm_data.get("name"):
-        print(f"❌ | Unvollständige Last.FM-Daten für Song-ID {track_id} – Generierung wird übersprungen!")
-        return "error"
+        messages.append(f"❌ | Unvollständige Last.FM-Daten für Song-ID {track_id} – Generierung wird übersprungen!")
+        return page
 
-    
     album_data = lastfm_data.get("album", {})
     if not album_data:
-        print(f"⚠️  | Es wurden keine Album-Informationen für den Song {track_id} gefunden. - Diese werden der songdata file nicht beigefügt!")
+        messages.append(f"⚠️  | Es wurden keine Album-Informationen für den Song {track_id} gefunden. - Diese werden der songdata file nicht beigefügt!")
 
-    utils.clear_md(songdata_file)
     file_content = ""
-    created_files.add(track_id)
 
     file_content += f'# {lastfm_data["name"]}\n'
 
@@ -188,9 +212,8 @@ def generate_songdata_file(track_id, data_path, output_path):
     if duration_ms > 0:
         file_content += f"**Duration:** {duration_string}\n"
 
-    if spotify_data:
-        file_content += f"You've listened to this song **{len([s for s in spotify_data if s['ms_played'] > MIN_PLAY_DURATION])}** times.\n"
-
+    if job["events"]:
+        file_content += f"You've listened to this song **{int(job['counts'].sum())}** times.\n"
 
     cover_image = next(
         (item.get("#text") for item in album_data.get("image", []) if item.get("size") == "extralarge"),
@@ -199,7 +222,7 @@ def generate_songdata_file(track_id, data_path, output_path):
     if cover_image:
         file_content += f'\n![{album_data["title"] if album_data else "unknown album"}]({cover_image})\n'
     else:
-        print(f"⚠️  | Es wurde kein Cover für den Song {track_id} gefunden. - Dieses wird der songdata file nicht beigefügt!")
+        messages.append(f"⚠️  | Es wurde kein Cover für den Song {track_id} gefunden. - Dieses wird der songdata file nicht beigefügt!")
 
     song_wiki = lastfm_data.get("wiki", None)
     if song_wiki is not None:
@@ -212,61 +235,79 @@ def generate_songdata_file(track_id, data_path, output_path):
         file_content += "### Tags / Genres\n"
         for tag in tags:
             file_content += f"- [[../tags/{utils.sanitize_filename(tag['name'])}.md|{tag['name']}]]\n"
-            
-    # Create plot of listening activity per month (if spotify_data available)
-    if spotify_data:
-        plot_file = plot_song_listening_over_time(
-            utils.load_data(data_path),
-            track_id,
-            lastfm_data,
-            filename=track_id[14:] + "_listening_over_time.png",
-            output_path=os.path.join(output_path, "..", "img")
-        )
-        if plot_file:
+
+    # Create plot of listening activity per month (if listening activity available)
+    if job["events"]:
+        page["chart"] = song_chart(job, lastfm_data, messages)
+        if page["chart"]:
             # Bild im Markdown verlinken
             file_content += "### Listening Activity per Month\n"
-            file_content += f"![listening activity per month](../img/{plot_file})\n"
-
-    utils.append_md(songdata_file, file_content)
-    print(f"✅ | Songdata file erfolgreich generiert! ({track_id})")
-    return "done"
-    
-def append_full_listening_history(output_file, data):
-    utils.append_md(output_file, "### Full listening history")
-    utils.append_md(output_file, "| Date | Time | Song | Artist | Stopped after | Finished |\n|-|-|-|-|-|-|")
-    for song in data:
-        ts = song.get("ts")
-        if (not ts or not song.get("master_metadata_track_name") or not song.get("spotify_track_uri")): continue
-        
-        track_id = song.get("spotify_track_uri")
+            file_content += f"![listening activity per month](../img/{os.path.basename(page['chart'][0]['path'])})\n"
+
+    page["content"] = file_content
+    page["status"] = "done"
+    return page
+
+def write_song_page(page, output_path, pages, existing):
+    """Print the messages of a built page, queue its chart and write and register the page (in the main process)"""
+    for message in page["messages"]:
+        print(message)
+    if page["chart"] is not None:
+        chart_utils.render(*page["chart"])
+
+    track_id = page["track_id"]
+    if page["content"] is not None:
+        songdata_md = utils.MarkdownDocument(os.path.join(output_path, track_id[14:] + ".md"))
+        songdata_md.append(page["content"])
+        if songdata_md.save() or existing.has("songs", track_id):
+            pages.add("songs", track_id)
+        print(f"✅ | Songdata file erfolgreich generiert! ({track_id})")
+    elif page["status"] == "done":
+        # Bestehende Seite bleibt
+        pages.add("songs", track_id)
+
+def write_full_listening_history(filename, dataset, pages):
+    """
+    Page with a table of every play with a track (file order), songs and artists link to their pages.
+    The rows are built and written in chunks of HISTORY_CHUNK_SIZE, so the table is never held in memory as a whole.
+    """
+    history_md = utils.MarkdownDocument(filename)
+    history_md.append("# Full listening history")
+    history_md.append("| Date | Time | Song | Artist | Stopped after | Finished |\n|-|-|-|-|-|-|")
+
+    events = np.flatnonzero(dataset.track_codes >= 0)
+    song_links, artist_links = {}, {}
+    for start in range(0, len(events), HISTORY_CHUNK_SIZE):
+        chunk = events[start:start + HISTORY_CHUNK_SIZE]
+        # Lokale Zeit aller Einträge des Blocks auf einmal formatieren ("YYYY-MM-DDTHH:MM")
+        local_times = np.datetime_as_string(local_timestamps(dataset.ts[chunk], utils.get_timezone()).astype("datetime64[s]"), unit="m")
+
+        for event, local_time in zip(chunk.tolist(), local_times.tolist()):
+            track_code = int(dataset.track_codes[event])
+            title = dataset.track_names[track_code]
+            if not title:
+                continue
+
+            # | in Namen würde die Tabelle zerlegen
+            if track_code not in song_links:
+                label = title.replace("|", "\\|")
+                song_links[track_code] = pages.link("songs", dataset.track_uris[track_code], label, table=True) or label
+            artist_code = int(dataset.artist_codes[event])
+            if artist_code not in artist_links:
+                artist = dataset.artist_name(artist_code)
+                label = artist.replace("|", "\\|") if artist else artist
+                artist_links[artist_code] = pages.link("artists", artist, label, table=True) or label
+
+            date_string, time_string = local_time.split("T")
+            stopped_after = str(int(dataset.ms_played[event]) / 1000) + "s"
+            reason_code = int(dataset.reason_codes[event])
+            reason_end = dataset.reasons[reason_code] if reason_code >= 0 else None
+            finished = "✅ (trackdone)" if reason_end == "trackdone" else f"❌ ({reason_end})"
+
+            history_md.append(f"| {date_string} | {time_string.replace(':', '-')} | {song_links[track_code]} | {artist_links[artist_code]} | {stopped_after} | {finished} |")
+        history_md.flush()
+    history_md.save()
 
-        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-        date = date.astimezone(ZoneInfo(TIMEZONE) if TIMEZONE else None)
-        
-        date_string = date.strftime("%Y-%m-%d")
-        time_string = date.strftime("%H-%M")
-        
-        title = song.get("master_metadata_track_name")
-        artist = song.get("master_metadata_album_artist_name")
-        
-        ms_played = song.get("ms_played")
-        stopped_after = str(ms_played / 1000) + "s"
-        
-        reason_end = song.get("reason_end")
-        finished = "✅ (trackdone)" if reason_end == "trackdone" else f"❌ ({reason_end})"
-        
-        songdata_file_path = f"./songs/{track_id[14:]}.md"
-        songdata_file_full_path = os.path.join("output", input_filename.replace(".json", ""), songdata_file_path)
-        if not os.path.exists(songdata_file_full_path):
-            songdata_file_path = None
-            
-        artist_file_path = f"./artists/{utils.sanitize_filename(artist)}.md"
-        artist_full_path = os.path.join("output", input_filename.replace(".json", ""), artist_file_path)
-        if not os.path.exists(artist_full_path):
-            artist_file_path = None
-        
-        utils.append_md(output_file, f"| {date_string} | {time_string} | {title} | {artist} | {stopped_after} | {finished} |")
-        
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("❌ Fehler: Gib den Namen der history-Datei als Argument an (z.B. history.json)")
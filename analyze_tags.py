@@ -0,0 +1,220 @@
+import os
+import sys
+import numpy as np
+import utils
+import chart_utils
+from config import TAG_CHARTS_COUNT
+from database import db
+from dataset import load_dataset, ranked_by_group
+
+def main(input_filename: str, dataset=None, pages=None):
+    output_dir = utils.get_output_path(input_filename)
+    os.makedirs(os.path.join(output_dir, "tags"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "img"), exist_ok=True)
+
+    output_file = os.path.join(output_dir, "tags.md")
+
+    if dataset is None:
+        dataset = load_dataset(input_filename)
+    if pages is None:
+        pages = utils.PageRegistry.scan(output_dir)
+
+    print("📊 Analysiere Tags...")
+    tag_index = build_tag_index(dataset)
+    tag_stats = aggregate_tags(dataset, tag_index)
+    # Tag-Seiten hängen von der Rangfolge aller Tags ab (Diagramm nur für die Top-Tags),
+    # deshalb werden sie immer alle geschrieben – die Diagramme überspringt der Hash-Cache
+    write_tag_pages(dataset, tag_stats, output_dir, pages)
+    write_overview(tag_stats, output_file, output_dir)
+    print(f"✅ {len(tag_stats['labels'])} Tag-Seiten erstellt")
+
+
+class TagIndex:
+    """
+    Track→tags index of the tracks in a dataset (CSR layout), built once from the cached Last.fm tags.
+    The tags of track code t are tag_codes[offsets[t]:offsets[t + 1]].
+
+    Tags whose names map to the same page file (they only differ in characters that sanitize_filename
+    replaces, e.g. "rock/pop" and "rock pop") share one code. names holds the page names,
+    labels the tag names as first seen.
+    """
+
+    def __init__(self, names, labels, offsets, tag_codes):
+        self.names = names
+        self.labels = labels
+        self.offsets = offsets
+        self.tag_codes = tag_codes
+
+    def __len__(self):
+        return len(self.names)
+
+    def counts(self):
+        """Number of tags per track code"""
+        return np.diff(self.offsets)
+
+
+def build_tag_index(dataset):
+    tags_by_track = db.get_tags_many(dataset.track_uris)
+
+    names, labels, name_index = [], [], {}
+    counts = np.zeros(len(dataset.track_uris), dtype=np.int64)
+    tag_codes = []
+    for track_code, track_uri in enumerate(dataset.track_uris):
+        track_tags = []
+        for tag in tags_by_track.get(track_uri, ()):
+            name = utils.PageRegistry.page_name("tags", tag)
+            if not name:
+                continue
+            code = name_index.get(name)
+            if code is None:
+                code = name_index[name] = len(names)
+                names.append(name)
+                labels.append(tag)
+            if code not in track_tags:
+                track_tags.append(code)
+        counts[track_code] = len(track_tags)
+        tag_codes.extend(track_tags)
+
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    return TagIndex(names, labels, offsets, np.array(tag_codes, dtype=np.int64))
+
+
+def aggregate_tags(dataset, tag_index):
+    """
+    Per-tag plays (valid plays), listening time, track count and monthly trend (over month_axis),
+    computed in one pass over the (track, month) groups of the dataset expanded by the tags of each track.
+
+    share_ms splits the listening time of a track evenly between its tags, so it adds up to the
+    listening time of all tagged tracks (a track with several tags would otherwise be counted several times).
+    """
+    tag_count, month_count = len(tag_index), len(dataset.month_axis)
+    has_track = dataset.track_codes >= 0
+    track_codes = dataset.track_codes[has_track]
+
+    # Einträge zu (Track, Monat)-Gruppen zusammenfassen, damit nur diese mit den Tags vervielfacht werden
+    keys = track_codes.astype(np.int64) * max(month_count, 1) + dataset.month_axis_codes[dataset.month_codes[has_track]]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    group_plays = np.bincount(inverse, weights=dataset.valid[has_track], minlength=len(unique_keys))
+    group_ms = np.bincount(inverse, weights=dataset.ms_played[has_track], minlength=len(unique_keys))
+    group_tracks, group_months = np.divmod(unique_keys, max(month_count, 1))
+
+    # Jede Gruppe einmal pro Tag ihres Tracks
+    tags_per_group = tag_index.counts()[group_tracks]
+    rows = np.repeat(np.arange(len(unique_keys)), tags_per_group)
+    first_tag = np.repeat(tag_index.offsets[group_tracks], tags_per_group)
+    position = np.arange(len(rows)) - np.repeat(np.cumsum(tags_per_group) - tags_per_group, tags_per_group)
+    row_tags = tag_index.tag_codes[first_tag + position]
+
+    cells = row_tags * month_count + group_months[rows]
+    monthly_plays = np.bincount(cells, weights=group_plays[rows], minlength=tag_count * month_count).reshape(tag_count, month_count)
+    monthly_ms = np.bincount(cells, weights=group_ms[rows], minlength=tag_count * month_count).reshape(tag_count, month_count)
+    share_ms = np.bincount(row_tags, weights=group_ms[rows] / tags_per_group[rows], minlength=tag_count)
+
+    # Songs und Artists je Tag, über die (Tag, Track)-Paare
+    track_plays = np.bincount(track_codes[dataset.valid[has_track]], minlength=len(dataset.track_uris))
+    track_ms = np.bincount(track_codes, weights=dataset.ms_played[has_track], minlength=len(dataset.track_uris)).astype(np.int64)
+    pair_tracks = np.repeat(np.arange(len(dataset.track_uris)), tag_index.counts())
+    pair_tags = tag_index.tag_codes
+    pair_artists = dataset.track_artist_codes[pair_tracks]
+    has_artist = pair_artists >= 0
+    # Songs, die nie mit Mindest-Hördauer gespielt wurden, gehören nicht in die Liste
+    was_played = track_plays[pair_tracks] > 0
+
+    return {
+        "names": tag_index.names,
+        "labels": tag_index.labels,
+        "plays": monthly_plays.sum(axis=1).astype(np.int64),
+        "ms": monthly_ms.sum(axis=1).astype(np.int64),
+        "share_ms": share_ms,
+        "track_count": np.bincount(pair_tags, minlength=tag_count),
+        "monthly_plays": monthly_plays.astype(np.int64),
+        "monthly_ms": monthly_ms,
+        "top_songs": ranked_by_group(pair_tags[was_played], pair_tracks[was_played], track_plays[pair_tracks[was_played]], limit=25),
+        "top_artists": ranked_by_group(pair_tags[has_artist], pair_artists[has_artist], track_ms[pair_tracks[has_artist]], limit=10),
+    }
+
+
+def tag_ranking(tag_stats):
+    """Tag codes by listening time (descending), ties keep the order in which the tags were first seen"""
+    return np.lexsort((np.arange(len(tag_stats["ms"])), -tag_stats["ms"])).tolist()
+
+
+def write_tag_pages(dataset, tag_stats, output_dir, pages):
+    ranking = tag_ranking(tag_stats)
+    with_chart = set(ranking[:TAG_CHARTS_COUNT])
+    total_ms = dataset.total_ms_played
+
+    for tag_code in ranking:
+        name, label = tag_stats["names"][tag_code], tag_stats["labels"][tag_code]
+        tag_ms = int(tag_stats["ms"][tag_code])
+
+        tag_md = utils.MarkdownDocument(os.path.join(output_dir, "tags", name + ".md"))
+        tag_md.append(f"# {label}")
+        tag_md.append(f"**{tag_stats['track_count'][tag_code]}** Songs mit diesem Tag – "
+                      f"**{tag_stats['plays'][tag_code]}** mal gehört – **{tag_ms / 1000 / 60 / 60:.2f} Stunden** Spielzeit")
+        if total_ms > 0:
+            tag_md.append(f"({tag_ms / total_ms * 100:.1f}% der gesamten Hörzeit)\n")
+
+        if tag_code in with_chart:
+            chart_filename = f"tag_{name}_monthly_minutes.png"
+            chart_utils.render(chart_utils.bar_chart(
+                os.path.join(output_dir, "img", chart_filename),
+                dataset.month_axis, (tag_stats["monthly_ms"][tag_code] / 60000).tolist(),
+                f"Listening minutes per month for {utils.to_ascii(label)}",
+                ylabel="listening minutes",
+            ))
+            tag_md.append(f"![Listening minutes per month](../img/{chart_filename})")
+        else:
+            tag_md.append("### Hörverlauf\n")
+            tag_md.append("| Monat | mal gehört | Minuten |\n|-|-|-|")
+            for month_code in np.flatnonzero(tag_stats["monthly_ms"][tag_code]):
+                tag_md.append(f"| {dataset.month_axis[month_code]} | {tag_stats['monthly_plays'][tag_code][month_code]} | "
+                              f"{tag_stats['monthly_ms'][tag_code][month_code] / 60000:.0f} |")
+
+        track_codes, plays = tag_stats["top_songs"].get(tag_code, ([], []))
+        tag_md.append("\n### Meistgehörte Songs\n")
+        for i, (track_code, times_played) in enumerate(zip(track_codes, plays), start=1):
+            track_name = dataset.track_names[track_code]
+            link = pages.link("songs", dataset.track_uris[track_code], track_name, "..") or track_name
+            artist_name = dataset.artist_name(dataset.track_artist_codes[track_code])
+            tag_md.append(f"{i}. **{link}** von {artist_name} – **{times_played}** mal gehört")
+
+        artist_codes, artist_ms = tag_stats["top_artists"].get(tag_code, ([], []))
+        tag_md.append("\n### Top-Artists\n")
+        for i, (artist_code, played_ms) in enumerate(zip(artist_codes, artist_ms), start=1):
+            artist = dataset.artist_name(artist_code)
+            link = pages.link("artists", artist, artist, "..") or artist
+            tag_md.append(f"{i}. **{link}** – **{played_ms / 1000 / 60 / 60:.2f} Stunden**")
+
+        if tag_md.save():
+            pages.add("tags", label)
+    chart_utils.wait_for_charts()
+
+
+def write_overview(tag_stats, output_file, output_dir):
+    tags_md = utils.MarkdownDocument(output_file)
+    tags_md.append("### Tags / Genres\n")
+
+    if len(tag_stats["names"]):
+        share = {label: float(ms) for label, ms in zip(tag_stats["labels"], tag_stats["share_ms"]) if ms > 0}
+        pie_path = utils.plot_pie_chart(share, "Genre-Anteil an der Hörzeit", "genre_share.png", output_dir,
+                                        data_size=15, show_percentages_in_legend=True)
+        tags_md.append(f"![Genre-Anteil an der Hörzeit](./img/{os.path.basename(pie_path)})")
+        tags_md.append("_Die Hörzeit eines Songs wird für das Diagramm gleichmäßig auf seine Tags verteilt._\n")
+    else:
+        tags_md.append("_Keine Tags gefunden._")
+
+    for i, tag_code in enumerate(tag_ranking(tag_stats), start=1):
+        name, label = tag_stats["names"][tag_code], tag_stats["labels"][tag_code]
+        tags_md.append(f"{i}. **[[./tags/{name}.md|{label}]]** mit **{tag_stats['ms'][tag_code] / 1000 / 60 / 60:.2f} Stunden** Spielzeit, "
+                       f"**{tag_stats['plays'][tag_code]}** mal gehört ({tag_stats['track_count'][tag_code]} Songs)")
+    chart_utils.wait_for_charts()
+    tags_md.save()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("❌ Fehler: Gib den Namen der history-Datei als Argument an (z.B. history.json)")
+        sys.exit(1)
+    input_filename = sys.argv[1]
+    main(input_filename)
@@ -0,0 +1,70 @@
+"""
+Import-time budget for the command line entry points.
+
+Every entry module is imported in a fresh interpreter (several times, the fastest run counts).
+The benchmark fails if an import takes longer than the budget, loads one of the heavy
+dependencies that are only needed for some commands (matplotlib, requests, unidecode, python-dotenv)
+or opens the cache database.
+
+Usage: python benchmarks/import_time.py [--budget-ms 300] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_MODULES = ("main", "fetch_songdata", "analyze_general", "analyze_songs", "analyze_artists", "analyze_tags", "dataset", "utils")
+DEFERRED_MODULES = ("matplotlib", "requests", "unidecode", "dotenv")
+
+# Läuft in einem frischen Interpreter, gibt Importzeit und geladene Module als JSON aus
+PROBE = """
+import sys, time, json
+sys.path.insert(0, {repo_dir!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+import config, database
+deferred = [name for name in {deferred!r} if name in sys.modules and not (name == "dotenv" and getattr(config, "_dotenv_path", None))]
+print(json.dumps({{"ms": elapsed * 1000, "deferred": deferred, "db_opened": getattr(database, "_manager", True) is not None}}))
+"""
+
+def measure(module, repeat):
+    """Fastest import time of module in ms and the violations seen in any run"""
+    timings, violations = [], set()
+    with tempfile.TemporaryDirectory() as cwd:
+        probe = PROBE.format(repo_dir=REPO_DIR, module=module, deferred=DEFERRED_MODULES)
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, "-c", probe], cwd=cwd, capture_output=True, text=True, check=True)
+            report = json.loads(result.stdout.strip().splitlines()[-1])
+            timings.append(report["ms"])
+            violations.update(f"lädt {name}" for name in report["deferred"])
+            if report["db_opened"]:
+                violations.add("öffnet die Datenbank")
+        if os.path.exists(os.path.join(cwd, ".cache")):
+            violations.add("legt .cache an")
+    return min(timings), sorted(violations)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget of the entry modules")
+    parser.add_argument("--budget-ms", type=float, default=300, help="maximum import time per module in ms")
+    parser.add_argument("--repeat", type=int, default=5, help="imports per module, the fastest counts")
+    args = parser.parse_args()
+
+    failed = False
+    for module in ENTRY_MODULES:
+        elapsed, violations = measure(module, args.repeat)
+        if elapsed > args.budget_ms:
+            violations.append(f"über dem Budget von {args.budget_ms:.0f} ms")
+        failed = failed or bool(violations)
+        status = "❌" if violations else "✅"
+        print(f"{status} {module:<16} {elapsed:7.1f} ms {'– ' + ', '.join(violations) if violations else ''}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,574 @@
+"""
+End-to-end benchmark of the analysis stages on a synthetic Spotify history.
+
+Generates an extended streaming history export (Streaming_History_Audio_*.json files) with
+Zipf-distributed track and artist popularity and listening sessions with a daily rhythm over a
+multi-year span, during which the listener moves between the given time zones. A matching Last.fm
+cache (.cache/cache.db with track, artist and tag data, a few tracks and artists marked as not found)
+is built alongside, so every stage runs on the warm path without network access.
+
+Every stage runs in its own process on the same working directory, in pipeline order:
+load (parse the export, write the snapshot), load_snapshot, fetch_songdata (warm cache),
+analyze_artists, analyze_songs, analyze_tags and analyze_general. Reported per stage: the wall time,
+the peak RSS of the stage process and the peak RSS of its worker processes (chart and page pools).
+
+The generated data is kept in the working directory and reused by runs with the same parameters.
+--save writes the results to a JSON file, --compare fails (exit code 1) if a stage is slower or
+needs more memory than in such a file by more than --tolerance.
+Peak RSS needs the resource module (Linux, macOS).
+
+Usage: python benchmarks/pipeline.py [--events 10000] [--tracks N] [--artists N] [--years 5]
+           [--timezones Europe/Berlin,America/New_York,Asia/Tokyo] [--seed 1] [--repeat 1]
+           [--stages load,analyze_songs,...] [--skip-charts] [--workdir DIR]
+           [--save results.json] [--compare baseline.json] [--tolerance 0.25]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import hashlib
+import tempfile
+import importlib
+import subprocess
+from datetime import date, datetime, timedelta
+from urllib.parse import quote
+from zoneinfo import ZoneInfo
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from ascii_names import generate_names, DECORATIONS
+
+# Erhöhen, wenn sich die erzeugten Daten ändern (vorhandene Arbeitsverzeichnisse werden dann neu erzeugt)
+GENERATOR_VERSION = 1
+
+STAGES = ("load", "load_snapshot", "fetch_songdata", "analyze_artists", "analyze_songs", "analyze_tags", "analyze_general")
+HISTORY_NAME = "synthetic"
+FILE_EVENTS = 20000  # Einträge pro Streaming_History_Audio-Datei
+SESSION_LENGTH = 14  # durchschnittliche Songs pro Hörsitzung
+EPISODE_SHARE = 0.02  # Anteil der Podcast-Einträge (ohne Track)
+MISSING_TRACK_SHARE = 0.05  # Songs, die Last.fm nicht kennt
+MISSING_ARTIST_SHARE = 0.02
+FAILURE_TTL_DAYS = 36500  # nicht gefundene Einträge sollen im Benchmark nie ablaufen
+
+# Relative Hörhäufigkeit je Stunde (Ortszeit)
+HOUR_WEIGHTS = [1, 0.5, 0.3, 0.2, 0.2, 0.3, 1, 2.5, 3.5, 3, 2.5, 2.5, 3, 3, 2.8, 3, 3.5, 4, 4.5, 5, 5, 4.5, 3.5, 2]
+# Wie eine Wiedergabe endet: (reason_end, Wahrscheinlichkeit)
+REASONS_END = [("trackdone", 0.62), ("fwdbtn", 0.25), ("backbtn", 0.04), ("endplay", 0.05), ("logout", 0.02), ("unexpected-exit-while-paused", 0.02)]
+SESSION_START_REASONS = ["clickrow", "appload", "playbtn", "remote"]
+PLATFORMS = ["android", "ios", "windows", "osx", "web_player"]
+COUNTRIES = {"Europe/Berlin": "DE", "America/New_York": "US", "Asia/Tokyo": "JP", "Europe/London": "GB", "Australia/Sydney": "AU"}
+SHOWS = ["Daily News Briefing", "Tech Talk Weekly", "Geschichten aus der Geschichte", "Science Hour"]
+
+GENRES = ["rock", "pop", "indie", "electronic", "hip-hop", "jazz", "metal", "folk", "soul", "punk", "classical", "ambient",
+          "house", "techno", "rnb", "country", "blues", "reggae", "k-pop", "j-pop", "synthwave", "trap", "lo-fi", "disco", "funk"]
+GENRE_PREFIXES = ["", "alternative ", "german ", "dream ", "post-", "experimental ", "80s ", "japanese ", "female vocalists "]
+
+HISTORY_FIELDS = (
+    "ts", "platform", "ms_played", "conn_country", "ip_addr",
+    "master_metadata_track_name", "master_metadata_album_artist_name", "master_metadata_album_album_name", "spotify_track_uri",
+    "episode_name", "episode_show_name", "spotify_episode_uri",
+    "audiobook_title", "audiobook_uri", "audiobook_chapter_uri", "audiobook_chapter_title",
+    "reason_start", "reason_end", "shuffle", "skipped", "offline", "offline_timestamp", "incognito_mode",
+)
+
+# === Erzeugung ===
+def zipf_weights(count, exponent=1.0):
+    weights = 1 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+def spotify_ids(rng, count):
+    alphabet = np.array(list("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+    return ["".join(row) for row in alphabet[rng.integers(0, len(alphabet), (count, 22))]]
+
+def artist_names(count, seed):
+    """Generated names without the track decorations (" – Remix", "「Live」", ...), unique because artists are identified by name"""
+    seen = {}
+    result = []
+    for name in generate_names(count, seed=seed):
+        for decoration in filter(None, DECORATIONS):
+            if name.endswith(decoration):
+                name = name[:-len(decoration)].strip()
+        seen[name] = seen.get(name, 0) + 1
+        result.append(name if seen[name] == 1 else f"{name} {seen[name]}")
+    return result
+
+def generate_catalog(rng, track_count, artist_count, seed):
+    """Artists, tracks and albums with Zipf-distributed popularity and tags (popular artists have more tracks)"""
+    artists = artist_names(artist_count, seed)
+    track_artists = rng.choice(artist_count, track_count, p=zipf_weights(artist_count, 1.1))
+
+    # Zehn Songs pro Album, in der Reihenfolge der Songs eines Artists
+    order = np.argsort(track_artists, kind="stable")
+    group_starts = np.searchsorted(track_artists[order], track_artists[order])
+    position = np.empty(track_count, dtype=np.int64)
+    position[order] = np.arange(track_count) - group_starts
+    album_keys, album_codes = np.unique(track_artists.astype(np.int64) * track_count + position // 10, return_inverse=True)
+    album_names = generate_names(len(album_keys), seed=seed + 1)
+
+    vocabulary = [prefix + genre for prefix in GENRE_PREFIXES for genre in GENRES]
+    rng.shuffle(vocabulary)
+    tag_weights = zipf_weights(len(vocabulary), 1.2)
+    artist_tags = [rng.choice(len(vocabulary), rng.integers(1, 6), replace=False, p=tag_weights).tolist() for _ in range(artist_count)]
+    track_tags = []
+    for artist in track_artists.tolist():
+        tags = artist_tags[artist][:rng.integers(1, len(artist_tags[artist]) + 1)]
+        if rng.random() < 0.2:
+            tags = tags + [int(rng.choice(len(vocabulary), p=tag_weights))]
+        track_tags.append(list(dict.fromkeys(tags)))
+
+    return {
+        "vocabulary": vocabulary,
+        "artist_names": artists,
+        "artist_tags": artist_tags,
+        "track_uris": ["spotify:track:" + track_id for track_id in spotify_ids(rng, track_count)],
+        "track_names": generate_names(track_count, seed=seed + 2),
+        "track_artists": track_artists,
+        "track_albums": [album_names[code] for code in album_codes],
+        "track_tags": track_tags,
+        "durations_ms": rng.integers(90000, 420000, track_count),
+    }
+
+def generate_events(rng, catalog, event_count, years, timezones, end):
+    """
+    Play events in listening sessions (consecutive songs at a local time of day drawn from HOUR_WEIGHTS).
+    The span is split into one period per time zone, the local times are converted to UTC with the
+    offset of the zone on that day. Returns columns sorted by UTC timestamp.
+    """
+    day_count = max(1, int(round(years * 365.25)))
+    first_day = end - timedelta(days=day_count - 1)
+    day_numbers = np.arange(day_count) + (first_day - date(1970, 1, 1)).days
+    day_zones = np.arange(day_count) * len(timezones) // day_count
+    offsets = np.array([
+        ZoneInfo(timezones[zone]).utcoffset(datetime.combine(first_day + timedelta(days=day), datetime.min.time()).replace(hour=12)).total_seconds()
+        for day, zone in enumerate(day_zones.tolist())
+    ], dtype=np.int64)
+
+    # Sitzungen mit geometrisch verteilter Länge, zusammen genau event_count Einträge
+    lengths = rng.geometric(1 / SESSION_LENGTH, event_count // SESSION_LENGTH * 2 + 2)
+    session_count = int(np.searchsorted(np.cumsum(lengths), event_count)) + 1
+    lengths = lengths[:session_count]
+    lengths[-1] -= lengths.sum() - event_count
+    sessions = np.repeat(np.arange(session_count), lengths)
+    session_days = rng.integers(0, day_count, session_count)
+    session_starts = rng.choice(24, session_count, p=np.array(HOUR_WEIGHTS) / sum(HOUR_WEIGHTS)) * 3600 + rng.integers(0, 3600, session_count)
+
+    is_episode = rng.random(event_count) < EPISODE_SHARE
+    tracks = np.where(is_episode, -1, rng.choice(len(catalog["track_uris"]), event_count, p=zipf_weights(len(catalog["track_uris"]))))
+    durations = np.where(is_episode, rng.integers(600000, 3600000, event_count), catalog["durations_ms"][tracks])
+
+    reasons_end = rng.choice(len(REASONS_END), event_count, p=[share for _, share in REASONS_END])
+    finished = reasons_end == 0
+    ms_played = np.where(finished, durations, (rng.random(event_count) * 0.6 * durations).astype(np.int64) + 500)
+
+    # Ende jeder Wiedergabe relativ zum Sitzungsbeginn (Songs laufen nacheinander, kurze Pausen dazwischen)
+    elapsed = ms_played + rng.integers(0, 3000, event_count)
+    session_first = np.cumsum(lengths) - lengths
+    total = np.cumsum(elapsed)
+    end_offsets = total - (total[session_first] - elapsed[session_first])[sessions]
+    local = day_numbers[session_days][sessions] * 86400 + session_starts[sessions] + end_offsets // 1000
+    ts = local - offsets[session_days][sessions]
+
+    # Beginn: wie der vorherige Song endete, am Sitzungsanfang ein Start-Grund
+    previous_end = np.roll(reasons_end, 1)
+    starts_session = np.zeros(event_count, dtype=bool)
+    starts_session[session_first] = True
+
+    order = np.argsort(ts, kind="stable")
+    return {
+        "ts": ts[order],
+        "tracks": tracks[order],
+        "ms_played": ms_played[order],
+        "reason_end": reasons_end[order],
+        "previous_end": previous_end[order],
+        "starts_session": starts_session[order],
+        "session_start_reason": rng.integers(0, len(SESSION_START_REASONS), session_count)[sessions][order],
+        "zones": day_zones[session_days][sessions][order],
+        "platforms": rng.integers(0, len(PLATFORMS), session_count)[sessions][order],
+        "shuffle": (rng.random(session_count) < 0.4)[sessions][order],
+        "offline": (rng.random(session_count) < 0.03)[sessions][order],
+        "hosts": rng.integers(1, 255, session_count)[sessions][order],
+        "episodes": rng.integers(0, 500, event_count)[order],
+    }
+
+def write_history(directory, catalog, events, timezones):
+    """Write the events as Streaming_History_Audio_<years>_<n>.json files of FILE_EVENTS events"""
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    timestamps = np.datetime_as_string(events["ts"].astype("datetime64[s]"), unit="s")
+    artists, track_artists = catalog["artist_names"], catalog["track_artists"]
+
+    for index, start in enumerate(range(0, len(timestamps), FILE_EVENTS)):
+        rows = range(start, min(start + FILE_EVENTS, len(timestamps)))
+        entries = []
+        for row in rows:
+            track = int(events["tracks"][row])
+            zone = timezones[events["zones"][row]]
+            reason_end = REASONS_END[events["reason_end"][row]][0]
+            previous_end = REASONS_END[events["previous_end"][row]][0]
+            if events["starts_session"][row]:
+                reason_start = SESSION_START_REASONS[events["session_start_reason"][row]]
+            else:
+                reason_start = previous_end if previous_end in ("trackdone", "fwdbtn", "backbtn") else "clickrow"
+            episode = int(events["episodes"][row])
+            entry = dict.fromkeys(HISTORY_FIELDS)
+            entry.update({
+                "ts": timestamps[row] + "Z",
+                "platform": PLATFORMS[events["platforms"][row]],
+                "ms_played": int(events["ms_played"][row]),
+                "conn_country": COUNTRIES.get(zone, "ZZ"),
+                "ip_addr": f"203.0.{events['zones'][row]}.{events['hosts'][row]}",
+                "reason_start": reason_start,
+                "reason_end": reason_end,
+                "shuffle": bool(events["shuffle"][row]),
+                "skipped": reason_end in ("fwdbtn", "backbtn"),
+                "offline": bool(events["offline"][row]),
+                "offline_timestamp": int(events["ts"][row]) if events["offline"][row] else None,
+                "incognito_mode": False,
+            })
+            if track >= 0:
+                entry.update({
+                    "master_metadata_track_name": catalog["track_names"][track],
+                    "master_metadata_album_artist_name": artists[track_artists[track]],
+                    "master_metadata_album_album_name": catalog["track_albums"][track],
+                    "spotify_track_uri": catalog["track_uris"][track],
+                })
+            else:
+                entry.update({
+                    "episode_name": f"Episode {episode}",
+                    "episode_show_name": SHOWS[episode % len(SHOWS)],
+                    "spotify_episode_uri": f"spotify:episode:{episode:022d}",
+                })
+            entries.append(entry)
+
+        first_year, last_year = timestamps[rows[0]][:4], timestamps[rows[-1]][:4]
+        years = first_year if first_year == last_year else f"{first_year}-{last_year}"
+        with open(os.path.join(directory, f"Streaming_History_Audio_{years}_{index}.json"), "w", encoding="utf-8") as file:
+            file.write("[\n" + ",\n".join(json.dumps(entry, ensure_ascii=False) for entry in entries) + "\n]")
+
+def build_lastfm_cache(rng, catalog):
+    """Fill the cache database of the working directory with Last.fm responses for the catalog"""
+    from database import get_db
+    db = get_db()
+    vocabulary = catalog["vocabulary"]
+
+    def tag_list(codes):
+        return [{"name": vocabulary[code], "url": f"https://www.last.fm/tag/{quote(vocabulary[code])}"} for code in codes]
+
+    with db.batch_writes(max_rows=10000, max_seconds=60):
+        for artist, name in enumerate(catalog["artist_names"]):
+            if rng.random() < MISSING_ARTIST_SHARE:
+                db.store_fetch_failure("artist", name, 6, "The artist you supplied could not be found", ttl_days=FAILURE_TTL_DAYS)
+                continue
+            db.store_artist_data(name, {"artist": {
+                "name": name,
+                "url": f"https://www.last.fm/music/{quote(name)}",
+                "tags": {"tag": tag_list(catalog["artist_tags"][artist])},
+                "bio": {"summary": f"{name} is an artist. <a href=\"https://www.last.fm/music/{quote(name)}\">Read more on Last.fm</a>"},
+            }})
+
+        for track, track_uri in enumerate(catalog["track_uris"]):
+            if rng.random() < MISSING_TRACK_SHARE:
+                db.store_fetch_failure("track", track_uri, 6, "Track not found", ttl_days=FAILURE_TTL_DAYS)
+                continue
+            name = catalog["track_names"][track]
+            artist = catalog["artist_names"][catalog["track_artists"][track]]
+            album = catalog["track_albums"][track]
+            url = f"https://www.last.fm/music/{quote(artist)}/_/{quote(name)}"
+            data = {
+                "name": name,
+                "url": url,
+                "duration": str(int(catalog["durations_ms"][track])),
+                "artist": {"name": artist, "url": f"https://www.last.fm/music/{quote(artist)}"},
+                "album": {
+                    "artist": artist,
+                    "title": album,
+                    "url": f"https://www.last.fm/music/{quote(artist)}/{quote(album)}",
+                    "image": [{"#text": f"https://lastfm.freetls.fastly.net/i/u/{size}/{track:08x}.png", "size": label}
+                              for size, label in (("34s", "small"), ("64s", "medium"), ("174s", "large"), ("300x300", "extralarge"))],
+                },
+                "toptags": {"tag": tag_list(catalog["track_tags"][track])},
+            }
+            if rng.random() < 0.25:
+                data["wiki"] = {
+                    "published": "01 Jan 2020, 00:00",
+                    "summary": f"{name} is a song by {artist}.",
+                    "content": f"{name} is a song by {artist}. <a href=\"{url}\">Read more on Last.fm</a>",
+                }
+            db.store_song_data(track_uri, {"track": data})
+    db.close()
+
+def prepare(workdir, params):
+    """Generate the history and the cache in workdir, unless it already holds the data for params"""
+    params_file = os.path.join(workdir, "params.json")
+    if os.path.exists(params_file):
+        with open(params_file, "r", encoding="utf-8") as file:
+            if json.load(file) == params:
+                print(f"♻️  Vorhandene Testdaten in {workdir}")
+                return
+    # Nur den Inhalt leeren, workdir ist das aktuelle Verzeichnis
+    for name in ("userdata", ".cache", "output", "logs"):
+        shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+    os.makedirs(os.path.join(workdir, "userdata"))
+
+    print(f"🧪 Erzeuge {params['events']} Einträge ({params['tracks']} Songs, {params['artists']} Artists) in {workdir}...")
+    start = time.perf_counter()
+    rng = np.random.default_rng(params["seed"])
+    catalog = generate_catalog(rng, params["tracks"], params["artists"], params["seed"])
+    events = generate_events(rng, catalog, params["events"], params["years"], params["timezones"], date.fromisoformat(params["end"]))
+    write_history(os.path.join(workdir, "userdata", HISTORY_NAME), catalog, events, params["timezones"])
+    build_lastfm_cache(rng, catalog)
+    with open(params_file, "w", encoding="utf-8") as file:
+        json.dump(params, file)
+    print(f"✅ Testdaten erzeugt ({time.perf_counter() - start:.1f} s)")
+
+# === Stufen ===
+def peak_rss_mb():
+    """
+    Peak RSS of this process in MB. On Linux from VmHWM: ru_maxrss keeps the peak of the
+    parent process (the harness) across exec and would be at least as high as that.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _rusage_mb("RUSAGE_SELF")
+
+_worker_peaks = []
+_probe_seconds = [0.0]  # Zeit der Abfragen, zählt nicht zur Stufe
+
+def _worker_peak(barrier):
+    # Alle Worker warten aufeinander, damit jeder genau eine Abfrage bekommt
+    barrier.wait(timeout=60)
+    return peak_rss_mb()
+
+def measured_process_pool(process_pool):
+    """
+    Wrap chart_utils.process_pool: before a pool shuts down, every worker reports its own peak RSS
+    (one task per worker, held together by a barrier) into _worker_peaks.
+    """
+    def create(max_workers, *args, **kwargs):
+        executor = process_pool(max_workers, *args, **kwargs)
+        shutdown = executor.shutdown
+
+        def measured_shutdown(*shutdown_args, **shutdown_kwargs):
+            if executor.shutdown is measured_shutdown:
+                executor.shutdown = shutdown
+                import multiprocessing
+                start = time.perf_counter()
+                # Manager-Prozess per spawn, diesen Prozess (mit laufenden Threads) nicht forken
+                with multiprocessing.get_context("spawn").Manager() as manager:
+                    barrier = manager.Barrier(max_workers)
+                    futures = [executor.submit(_worker_peak, barrier) for _ in range(max_workers)]
+                    _worker_peaks.extend(future.result() for future in futures)
+                _probe_seconds[0] += time.perf_counter() - start
+            shutdown(*shutdown_args, **shutdown_kwargs)
+
+        executor.shutdown = measured_shutdown
+        return executor
+    return create
+
+def _rusage_mb(who):
+    import resource
+    peak = resource.getrusage(getattr(resource, who)).ru_maxrss
+    # Linux meldet KiB, macOS Bytes
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+def _skip_chart(spec):
+    pass
+
+def run_stage(stage, result_file, skip_charts=False):
+    """Run one stage in this process (the stage subprocess, cwd = working directory) and write its result"""
+    import chart_utils
+    from dataset import HistoryDataset
+    from incremental import ChangeSet
+
+    if skip_charts:
+        # Specs und Hashes werden weiter erzeugt, nur das Zeichnen entfällt (in diesem Prozess, die Pool-Worker
+        # importieren chart_utils neu und würden trotzdem zeichnen)
+        for kind in list(chart_utils.RENDERERS):
+            chart_utils.RENDERERS[kind] = _skip_chart
+        chart_utils.CHART_WORKERS = 1
+    chart_utils.process_pool = measured_process_pool(chart_utils.process_pool)
+
+    input_path = os.path.join("userdata", HISTORY_NAME)
+    module = None if stage.startswith("load") else importlib.import_module(stage)
+    dataset = None if stage.startswith("load") else HistoryDataset.load(input_path)
+
+    start = time.perf_counter()
+    if stage.startswith("load"):
+        dataset = HistoryDataset.load(input_path)
+    elif stage == "fetch_songdata":
+        module.main(HISTORY_NAME, dataset)
+    elif stage == "analyze_tags":
+        module.main(HISTORY_NAME, dataset)
+    else:
+        module.main(HISTORY_NAME, dataset, ChangeSet())
+    chart_utils.wait_for_charts()
+    seconds = time.perf_counter() - start - _probe_seconds[0]
+
+    peak = peak_rss_mb()
+    if chart_utils._executor is not None:
+        chart_utils._executor.shutdown()
+    result = {
+        "seconds": seconds,
+        "peak_rss_mb": peak,
+        "worker_peak_rss_mb": max(_worker_peaks, default=0),
+        "events": len(dataset) if dataset is not None else 0,
+    }
+    with open(result_file, "w", encoding="utf-8") as file:
+        json.dump(result, file)
+
+def reset_outputs(workdir):
+    """Remove everything a previous run produced (pages, charts, chart hashes, snapshot), the test data stays"""
+    shutil.rmtree(os.path.join(workdir, "output"), ignore_errors=True)
+    shutil.rmtree(os.path.join(workdir, ".cache", "history"), ignore_errors=True)
+    with sqlite3.connect(os.path.join(workdir, ".cache", "cache.db")) as connection:
+        for table in ("chart_hash", "ingest_state"):
+            connection.execute(f"DELETE FROM {table}")
+
+def stage_environment(timezone):
+    env = dict(os.environ)
+    env.update({
+        "TIMEZONE": timezone,
+        "MPLBACKEND": "Agg",
+        # Der Warm-Pfad darf nichts abrufen: Anfragen schlagen sofort fehl statt das Ergebnis zu verfälschen
+        "LASTFM_API_URL": "http://127.0.0.1:9/",
+        "LASTFM_MAX_RETRIES": "0",
+        "LASTFM_API_KEY": env.get("LASTFM_API_KEY", "benchmark"),
+    })
+    return env
+
+def launch_stage(workdir, stage, env, skip_charts):
+    log_file = os.path.join(workdir, "logs", f"{stage}.log")
+    result_file = os.path.join(workdir, "logs", f"{stage}.json")
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    command = [sys.executable, os.path.abspath(__file__), "--run-stage", stage, "--result", result_file]
+    if skip_charts:
+        command.append("--skip-charts")
+    with open(log_file, "w", encoding="utf-8") as log:
+        returncode = subprocess.run(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    if returncode != 0:
+        with open(log_file, "r", encoding="utf-8", errors="replace") as log:
+            print("".join(log.readlines()[-20:]))
+        print(f"❌ Stufe {stage} fehlgeschlagen (Log: {log_file})")
+        sys.exit(1)
+
+    with open(log_file, "r", encoding="utf-8", errors="replace") as log:
+        output = log.read()
+    fetched = re.search(r"davon \d+ im Cache und (\d+) abzurufen", output)
+    if (fetched and int(fetched.group(1))) or "🆕 (API)" in output or "❌ Fehler beim Laden" in output:
+        print(f"⚠️  {stage}: Einträge fehlen im Cache, die Stufe lief nicht auf dem Warm-Pfad")
+    with open(result_file, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+def compare(results, baseline, tolerance):
+    """Stages that are slower or need more memory than in baseline (by more than tolerance)"""
+    regressions = []
+    for stage, result in results.items():
+        before = baseline["stages"].get(stage)
+        if before is None:
+            continue
+        for key, label, unit in (("seconds", "Zeit", "s"), ("peak_rss_mb", "Peak-RSS", "MB")):
+            if result[key] > before[key] * (1 + tolerance):
+                regressions.append(f"{stage}: {label} {result[key]:.2f} {unit} statt {before[key]:.2f} {unit}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark on a synthetic Spotify history")
+    parser.add_argument("--events", type=int, default=10000, help="number of history events")
+    parser.add_argument("--tracks", type=int, help="number of tracks in the catalog (default: events / 25)")
+    parser.add_argument("--artists", type=int, help="number of artists (default: tracks / 8)")
+    parser.add_argument("--years", type=float, default=5, help="span of the history in years")
+    parser.add_argument("--end", default="2024-12-31", help="last day of the history")
+    parser.add_argument("--timezones", default="Europe/Berlin,America/New_York,Asia/Tokyo",
+                        help="time zones the listener lives in, one after another (the first one is used for the analysis)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages to measure")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of all stages, the fastest time and the highest RSS count")
+    parser.add_argument("--skip-charts", action="store_true", help="build and hash the chart specs, but do not draw them")
+    parser.add_argument("--workdir", help="directory for the test data and outputs (default: in the temp directory, reused)")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file (from --save) to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown / memory growth against the baseline")
+    parser.add_argument("--run-stage", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        run_stage(args.run_stage, args.result, args.skip_charts)
+        return
+
+    tracks = args.tracks or max(50, args.events // 25)
+    params = {
+        "version": GENERATOR_VERSION,
+        "events": args.events,
+        "tracks": tracks,
+        "artists": args.artists or max(10, tracks // 8),
+        "years": args.years,
+        "end": args.end,
+        "timezones": args.timezones.split(","),
+        "seed": args.seed,
+    }
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (available: {', '.join(STAGES)})")
+    # Alle Stufen nach "load" brauchen den Snapshot
+    if "load" not in stages:
+        stages.insert(0, "load")
+
+    # Pfade auflösen, bevor ins Arbeitsverzeichnis gewechselt wird
+    save_file = os.path.abspath(args.save) if args.save else None
+    compare_file = os.path.abspath(args.compare) if args.compare else None
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    workdir = os.path.abspath(args.workdir or os.path.join(tempfile.gettempdir(), "spotify-history-benchmark", digest))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    prepare(workdir, params)
+
+    env = stage_environment(params["timezones"][0])
+    results = {}
+    for repetition in range(args.repeat):
+        reset_outputs(workdir)
+        for stage in sorted(stages, key=STAGES.index):
+            result = launch_stage(workdir, stage, env, args.skip_charts)
+            best = results.setdefault(stage, result)
+            best["seconds"] = min(best["seconds"], result["seconds"])
+            best["peak_rss_mb"] = max(best["peak_rss_mb"], result["peak_rss_mb"])
+            best["worker_peak_rss_mb"] = max(best["worker_peak_rss_mb"], result["worker_peak_rss_mb"])
+
+    print(f"📊 {params['events']} Einträge, {params['tracks']} Songs, {params['artists']} Artists, "
+          f"{params['years']:g} Jahre ({', '.join(params['timezones'])}){' – ohne Diagramme' if args.skip_charts else ''}")
+    print(f"  {'Stufe':<16} {'Zeit':>9} {'Peak-RSS':>10} {'Worker':>10}")
+    for stage, result in results.items():
+        print(f"  {stage:<16} {result['seconds']:>7.2f} s {result['peak_rss_mb']:>7.0f} MB {result['worker_peak_rss_mb']:>7.0f} MB")
+
+    report = {"params": params, "skip_charts": args.skip_charts, "stages": results}
+    if save_file:
+        with open(save_file, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    if compare_file:
+        with open(compare_file, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("params") != params or baseline.get("skip_charts") != args.skip_charts:
+            print("⚠️  Die Vergleichswerte wurden mit anderen Parametern gemessen")
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"❌ {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ Keine Stufe mehr als {args.tolerance:.0%} langsamer oder speicherhungriger als {args.compare}")
+
+if __name__ == "__main__":
+    main()
@@ -1,140 +1,214 @@
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
+"""
+Charts are described by specs (plain dicts with the data, labels and the target path) that are
+rendered by the functions in RENDERERS. Specs passed to render() are drawn on a process pool,
+wait_for_charts() blocks until all of them are written.
+
+The hash of every rendered spec is kept in cache.db, a chart whose spec did not change since
+the last run (and whose file still exists) is not rendered again.
+
+matplotlib is only imported once a chart actually has to be drawn.
+"""
+
 import os
-from datetime import datetime, timedelta
-from collections import defaultdict
-import utils
-from config import MIN_PLAY_DURATION
-
-def create_monthly_listening_chart(spotify_data, track_id, lastfm_data, filename, output_path):
-    """Create a chart showing listening activity per month for a specific song"""
-    song_name = lastfm_data.get("name", "Unbekannt")
-    artist_name = lastfm_data.get("artist", {}).get("name", "Unbekannt")
-
-    # Filter valid plays for the desired song
-    filtered = [
-        entry for entry in spotify_data
-        if entry.get("spotify_track_uri") == track_id
-        and entry.get("ms_played", 0) > MIN_PLAY_DURATION
-        and entry.get("spotify_track_uri") is not None
-    ]
-
-    if not filtered:
-        print(f"⚠️  Keine gültigen Abspiel-Daten für Song {song_name}. Kein Diagramm erstellt.")
-        return None
-
-    # Generate time axis using the new utility function
-    months_all = []
-    for entry in spotify_data:
-        date = utils.parse_timestamp(entry["ts"])
-        if date:
-            months_all.append(date.replace(day=1, hour=0, minute=0, second=0, microsecond=0))
-    
-    if not months_all:
-        return None
-        
-    start, end = min(months_all), max(months_all)
-
-    full_months = []
-    current = start
-    while current <= end:
-        full_months.append(current.strftime("%Y-%m"))
-        current += timedelta(days=32)
-        current = current.replace(day=1)
-
-    # Count plays per month
-    count_by_month = {}
-    for entry in filtered:
-        date = utils.parse_timestamp(entry["ts"])
-        if date:
-            key = date.replace(day=1, hour=0, minute=0, second=0, microsecond=0).strftime("%Y-%m")
-            count_by_month[key] = count_by_month.get(key, 0) + 1
-
-    counts = [count_by_month.get(month, 0) for month in full_months]
-
-    # Create plot
-    plt.figure(figsize=(10, 5))
-    plt.bar(full_months, counts, color="skyblue")
-    ax = plt.gca()
-    ax.yaxis.set_major_locator(ticker.MaxNLocator(integer=True))
-    plt.title(f"Listening activity per month: {utils.to_ascii(song_name)} - {utils.to_ascii(artist_name)}")
-    plt.ylabel("times listened")
-    plt.xticks(rotation=45)
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
+import json
+import hashlib
+import multiprocessing
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from config import CHART_WORKERS
+from database import db
+
+# Erhöhen, wenn sich die Renderer ändern (alle Diagramme werden dann neu erzeugt)
+RENDERER_VERSION = 1
+
+# === Chart-Specs ===
+def bar_chart(path, labels, values, title, ylabel=None, figsize=(12, 6), xticks=None, grid=False, integer_y=False, value_labels=False):
+    return {
+        "type": "bar", "path": path, "labels": list(labels), "values": list(values), "title": title,
+        "ylabel": ylabel, "figsize": figsize, "xticks": xticks or {"rotation": 45}, "grid": grid,
+        "integer_y": integer_y, "value_labels": value_labels,
+    }
+
+def line_chart(path, x, series, title, xlabel=None, ylabel=None, figsize=(12, 6), xticks=None, ylim=None, grid=False):
+    """series: list of (values, plot kwargs such as label, color or marker)"""
+    return {
+        "type": "line", "path": path, "x": list(x), "series": [(list(values), style) for values, style in series],
+        "title": title, "xlabel": xlabel, "ylabel": ylabel, "figsize": figsize, "xticks": xticks, "ylim": ylim, "grid": grid,
+    }
+
+def pie_chart(path, labels, sizes, title, figsize=(6, 6), colors=None, textprops=None, legend_labels=None, legend_title="", tight_layout=False):
+    return {
+        "type": "pie", "path": path, "labels": list(labels), "sizes": list(sizes), "title": title,
+        "figsize": figsize, "colors": colors, "textprops": textprops, "legend_labels": legend_labels,
+        "legend_title": legend_title, "tight_layout": tight_layout,
+    }
+
+# === Renderer ===
+@lru_cache(maxsize=None)
+def _pyplot():
+    """Import matplotlib with the Agg backend (pyplot takes most of a second to import)"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+@lru_cache(maxsize=None)
+def _matplotlib_version():
+    # Version aus den Paket-Metadaten, ohne matplotlib selbst zu importieren
+    from importlib.metadata import version
+    return version("matplotlib")
+
+def _render_bar(spec):
+    import matplotlib.ticker as ticker
+    plt = _pyplot()
+    plt.figure(figsize=spec["figsize"])
+    plt.bar(spec["labels"], spec["values"], color="skyblue")
+    if spec["integer_y"]:
+        plt.gca().yaxis.set_major_locator(ticker.MaxNLocator(integer=True))
+    if spec["value_labels"]:
+        # Zahlen über Balken schreiben
+        for i, value in enumerate(spec["values"]):
+            plt.text(i, value + 0.2, f"{value:.1f}", ha='center', va='bottom', fontsize=9)
+    plt.title(spec["title"])
+    if spec["ylabel"]:
+        plt.ylabel(spec["ylabel"])
+    plt.xticks(**spec["xticks"])
+    if spec["grid"]:
+        plt.grid(axis='y', linestyle='--', alpha=0.7)
     plt.tight_layout()
-
-    os.makedirs(output_path, exist_ok=True)
-    path = os.path.join(output_path, filename)
-    plt.savefig(path, bbox_inches='tight', pad_inches=0.5)
+    plt.savefig(spec["path"], bbox_inches='tight', pad_inches=0.5)
     plt.close()
-    return filename
-
-def create_artist_monthly_chart(data, artist_name, output_path):
-    """Create monthly listening chart for an artist"""
-    monthly_minutes = defaultdict(float)
-    
-    for entry in data:
-        if entry.get("master_metadata_album_artist_name") == artist_name:
-            date = utils.parse_timestamp(entry.get("ts"))
-            if date:
-                month = date.strftime("%Y-%m")
-                minutes = entry.get("ms_played", 0) / 60000
-                monthly_minutes[month] += minutes
-
-    if not monthly_minutes:
-        return None
-
-    months = sorted(monthly_minutes.keys())
-    minutes = [monthly_minutes[m] for m in months]
-
-    plt.figure(figsize=(12, 6))
-    plt.bar(months, minutes, color='skyblue')
-    plt.title(f"Listening minutes per month for {utils.to_ascii(artist_name)}")
-    plt.ylabel("listening minutes")
-    plt.xticks(rotation=45)
-    plt.tight_layout()
 
-    chart_filename = f"{utils.sanitize_filename(artist_name)}_monthly_minutes.png"
-    chart_path = os.path.join(output_path, chart_filename)
-    os.makedirs(os.path.dirname(chart_path), exist_ok=True)
-    plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
-    plt.close()
-    
-    return chart_filename
-
-def create_artist_share_chart(data, artist_name, output_path):
-    """Create pie chart showing artist's share of total listening time"""
-    total_artist_minutes = 0
-    total_all_minutes = 0
-
-    for entry in data:
-        ms_played = entry.get("ms_played", 0)
-        minutes = ms_played / 60000
-        total_all_minutes += minutes
-        if entry.get("master_metadata_album_artist_name") == artist_name:
-            total_artist_minutes += minutes
-
-    if total_artist_minutes <= 0:
-        return None
-
-    rest_minutes = total_all_minutes - total_artist_minutes
-    labels = [f"{utils.to_ascii(artist_name)}", "others"]
-    sizes = [total_artist_minutes, rest_minutes]
-
-    plt.figure(figsize=(6, 6))
-    plt.pie(sizes, labels=labels, autopct="%1.1f%%", startangle=90, counterclock=False, colors=["#ff9999", "#dddddd"])
-    plt.title(f"{utils.to_ascii(artist_name)} vs. rest - total listening time")
-    plt.axis("equal")
-    
-    chart_filename = f"{utils.sanitize_filename(artist_name)}_share_vs_rest.png"
-    chart_path = os.path.join(output_path, chart_filename)
-    plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
+def _render_line(spec):
+    plt = _pyplot()
+    plt.figure(figsize=spec["figsize"])
+    for values, style in spec["series"]:
+        plt.plot(spec["x"], values, **style)
+    plt.title(spec["title"])
+    if spec["xlabel"]:
+        plt.xlabel(spec["xlabel"])
+    if spec["ylabel"]:
+        plt.ylabel(spec["ylabel"])
+    if spec["ylim"]:
+        plt.ylim(*spec["ylim"])
+    if spec["xticks"]:
+        plt.xticks(**spec["xticks"])
+    if spec["grid"]:
+        plt.grid(True, linestyle='--', alpha=0.5)
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(spec["path"], bbox_inches='tight', pad_inches=0.5)
     plt.close()
-    
-    return chart_filename
-    chart_filename = f"{utils.sanitize_filename(artist_name)}_share_vs_rest.png"
-    chart_path = os.path.join(output_path, chart_filename)
-    plt.savefig(chart_path, bbox_inches='tight', pad_inches=0.5)
+
+def _render_pie(spec):
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=spec["figsize"])
+    wedges, texts, autotexts = ax.pie(
+        spec["sizes"],
+        labels=spec["labels"],
+        autopct="%1.1f%%",
+        startangle=90,
+        counterclock=False,
+        colors=spec["colors"],
+        textprops=spec["textprops"],
+    )
+    ax.axis("equal")
+    ax.set_title(spec["title"])
+    if spec["legend_labels"] is not None:
+        if spec["legend_title"]:
+            ax.legend(wedges, spec["legend_labels"], title=spec["legend_title"], loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+        else:
+            ax.legend(wedges, spec["legend_labels"], loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+    if spec["tight_layout"]:
+        plt.tight_layout()
+    plt.savefig(spec["path"], bbox_inches='tight', pad_inches=0.5)
     plt.close()
-    
-    return chart_filename
+
+RENDERERS = {
+    "bar": _render_bar,
+    "line": _render_line,
+    "pie": _render_pie,
+}
+
+def render_chart(spec):
+    """Draw a single chart spec (in the calling process) and return its path"""
+    RENDERERS[spec["type"]](spec)
+    return spec["path"]
+
+def spec_hash(spec):
+    """Content hash of a chart spec (data, labels and styling) and the renderer version"""
+    payload = json.dumps([RENDERER_VERSION, _matplotlib_version(), spec], sort_keys=True, ensure_ascii=False, default=_json_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _json_default(value):
+    if isinstance(value, range):
+        return list(value)
+    if hasattr(value, "item"):  # numpy-Skalare
+        return value.item()
+    return str(value)
+
+# === Prozess-Pool ===
+_executor = None
+_pending = []
+_rendered = {}
+_stats = {"rendered": 0, "skipped": 0}
+
+def process_pool(max_workers, initializer=None, initargs=()):
+    """
+    ProcessPoolExecutor whose workers are started by a fork server (spawn where there is none).
+    A plain fork would copy this process with the locks held by its other threads
+    (e.g. the Last.fm fetcher), which can deadlock the workers.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        # Der Server lädt pyplot einmal, die Worker erben es beim Abzweigen statt es neu zu importieren
+        context.set_forkserver_preload(["chart_utils", "matplotlib.pyplot"])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=initializer, initargs=initargs)
+
+def _init_worker():
+    _pyplot().switch_backend("Agg")
+
+def render(spec, digest=None):
+    """
+    Queue a chart spec for rendering and return its path (the file exists after wait_for_charts()).
+    Charts whose spec is unchanged since the last run are skipped.
+    digest is the spec_hash of spec if the caller already computed it (e.g. in a worker process).
+    """
+    global _executor
+    path = spec["path"]
+    if digest is None:
+        digest = spec_hash(spec)
+    if os.path.exists(path) and db.get_chart_hash(os.path.normpath(path)) == digest:
+        _stats["skipped"] += 1
+        return path
+
+    _stats["rendered"] += 1
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if CHART_WORKERS <= 1:
+        render_chart(spec)
+        _rendered[os.path.normpath(path)] = digest
+        return path
+
+    if _executor is None:
+        _executor = process_pool(CHART_WORKERS, initializer=_init_worker)
+    _pending.append((_executor.submit(render_chart, spec), digest))
+    return path
+
+def wait_for_charts():
+    """Block until all queued charts are written, re-raises the first rendering error"""
+    futures = _pending[:]
+    _pending.clear()
+    try:
+        for future, digest in futures:
+            _rendered[os.path.normpath(future.result())] = digest
+    finally:
+        # Hashes erst speichern, wenn die Datei geschrieben ist
+        if _rendered:
+            db.store_chart_hashes(_rendered)
+            _rendered.clear()
+
+def get_chart_stats():
+    """Number of rendered and skipped (unchanged) charts"""
+    return dict(_stats)
@@ -1,21 +1,51 @@
 import os
-from dotenv import load_dotenv
 
-load_dotenv()
+def _find_dotenv():
+    """Path of the nearest .env file (next to this file or in a parent directory), None if there is none"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            return path
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+# python-dotenv nur laden, wenn es überhaupt eine .env gibt
+_dotenv_path = _find_dotenv()
+if _dotenv_path:
+    from dotenv import load_dotenv
+    load_dotenv(_dotenv_path)
 
 # Database configuration
 CACHE_DIR = ".cache"
 DB_PATH = os.path.join(CACHE_DIR, "cache.db")
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, "history")  # Binär-Snapshots der eingelesenen History
 
 # API configuration
 LASTFM_API_KEY = os.getenv("LASTFM_API_KEY")
+LASTFM_API_URL = os.getenv("LASTFM_API_URL", "https://ws.audioscrobbler.com/2.0/")
+LASTFM_RATE_LIMIT = float(os.getenv("LASTFM_RATE_LIMIT", 4))  # Requests pro Sekunde
+LASTFM_WORKERS = int(os.getenv("LASTFM_WORKERS", 4))  # parallele Verbindungen
+LASTFM_TIMEOUT = float(os.getenv("LASTFM_TIMEOUT", 30))  # in Sekunden
+LASTFM_MAX_RETRIES = int(os.getenv("LASTFM_MAX_RETRIES", 3))
+LASTFM_BACKOFF_BASE = float(os.getenv("LASTFM_BACKOFF_BASE", 1))  # in Sekunden, verdoppelt sich pro Versuch
+LASTFM_BACKOFF_MAX = float(os.getenv("LASTFM_BACKOFF_MAX", 60))  # in Sekunden
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", 30))  # in Tagen, danach wird erneut angefragt
 
 # Analysis configuration
 MIN_PLAY_DURATION = int(os.getenv("MIN_PLAY_DURATION", 20000))  # in ms
 TIMEZONE = os.getenv("TIMEZONE")
 RECREATE_SONGDATA_FILES = os.getenv("RECREATE_SONGDATA_FILES", False)
+FULL_REBUILD = os.getenv("FULL_REBUILD", False)  # alle Seiten neu erzeugen statt nur die von neuen Einträgen betroffenen
 
 # Output configuration
 TOP_ARTISTS_COUNT = 500
 TOP_SONGS_COUNT = 25
 CHART_DATA_SIZE = 25
+TAG_CHARTS_COUNT = int(os.getenv("TAG_CHARTS_COUNT", 100))  # Tags (nach Hörzeit) mit eigenem Monatsdiagramm
+# Diagramme und Song-Seiten werden gleichzeitig erzeugt und teilen sich die Worker-Prozesse
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", os.cpu_count() or 1))
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", max(1, WORKER_PROCESSES // 2)))  # Prozesse für das Rendern der Diagramme
+SONG_PAGE_WORKERS = int(os.getenv("SONG_PAGE_WORKERS", max(1, WORKER_PROCESSES - CHART_WORKERS)))  # Prozesse für das Erzeugen der Song-Seiten
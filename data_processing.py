@@ -1,8 +1,7 @@
-from datetime import datetime, timezone
-from zoneinfo import ZoneInfo
 from collections import defaultdict
-import json
-from config import MIN_PLAY_DURATION, TIMEZONE
+import utils
+from config import MIN_PLAY_DURATION
+from dataset import TrackStats
 
 def filter_valid_entries(data, min_duration=None):
     """Filter entries that have a timestamp, meet the minimum play duration, and contain track metadata."""
@@ -22,31 +21,29 @@ def group_by_month(data):
     monthly_data = defaultdict(list)
     
     for entry in data:
-        ts = entry.get('ts')
-        if not ts:
+        date = utils.parse_timestamp(entry.get('ts'))
+        if not date:
             continue
             
-        date = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
-        if TIMEZONE:
-            date = date.astimezone(ZoneInfo(TIMEZONE))
         month_key = date.strftime("%Y-%m")
         monthly_data[month_key].append(entry)
     
     return monthly_data
 
 def calculate_song_stats(data):
-    """Generate statistics for songs, including the number of times each song was played."""
+    """
+    Generate statistics for songs, including the number of times each song was played.
+    Returns {uri: TrackStats} with the names taken from the first valid entry of each song.
+    """
     song_stats = {}
     
     for entry in filter_valid_entries(data):
         uri = entry["spotify_track_uri"]
         
-        if uri not in song_stats:
-            new_entry = json.loads(json.dumps(entry))  # deepcopy via JSON
-            new_entry["times_played"] = 1
-            song_stats[uri] = new_entry
-        else:
-            song_stats[uri]["times_played"] += 1
+        stats = song_stats.get(uri)
+        if stats is None:
+            stats = song_stats[uri] = TrackStats(uri, entry["master_metadata_track_name"], entry.get("master_metadata_album_artist_name"))
+        stats.times_played += 1
     
     return song_stats
 
@@ -68,11 +65,8 @@ def get_date_range(data):
     
     dates = []
     for entry in data:
-        ts = entry.get('ts')
-        if ts:
-            date = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-            if TIMEZONE:
-                date = date.astimezone(ZoneInfo(TIMEZONE))
+        date = utils.parse_timestamp(entry.get('ts'))
+        if date:
             dates.append(date.date())
     
     return min(dates), max(dates) if dates else (None, None)
@@ -82,11 +76,8 @@ def get_unique_days_with_activity(data):
     days = set()
     
     for entry in data:
-        ts = entry.get('ts')
-        if ts:
-            date = datetime.strptime(ts, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
-            if TIMEZONE:
-                date = date.astimezone(ZoneInfo(TIMEZONE))
+        date = utils.parse_timestamp(entry.get('ts'))
+        if date:
             days.add(date.date())
     
     return days
@@ -1,21 +1,141 @@
 import sqlite3
 import json
 import os
-from config import DB_PATH, CACHE_DIR
+import time
+from contextlib import contextmanager
+from config import DB_PATH, CACHE_DIR, NEGATIVE_CACHE_TTL
+
+# Maximale Anzahl an Parametern pro Query (SQLite-Limit älterer Versionen: 999)
+SQL_BATCH_SIZE = 900
+
+# Version 1: songdata/artistdata nur als JSON
+# Version 2: häufig genutzte Felder als Spalten, Tags in track_tag
+SCHEMA_VERSION = 2
 
 class DatabaseManager:
     def __init__(self):
         os.makedirs(CACHE_DIR, exist_ok=True)
-        self.conn = sqlite3.connect(DB_PATH)
+        self.conn = sqlite3.connect(DB_PATH, timeout=30)
         self.conn.row_factory = sqlite3.Row
         self.cur = self.conn.cursor()
+        self._configure_connection()
         self._create_tables()
+
+        # Schreib-Batching (siehe batch_writes), None = jede Änderung sofort committen
+        self._batch = None
     
+    def _configure_connection(self):
+        """WAL-Journal (Lesen während geschrieben wird) und weniger fsyncs pro Commit"""
+        self.cur.execute("PRAGMA journal_mode = WAL")
+        self.cur.execute("PRAGMA synchronous = NORMAL")
+        self.cur.execute("PRAGMA temp_store = MEMORY")
+        self.cur.execute("PRAGMA cache_size = -20000")  # 20 MB Page-Cache
+
+    @contextmanager
+    def batch_writes(self, max_rows=500, max_seconds=5.0):
+        """
+        Group the writes inside the with-block into transactions.
+        A transaction is committed every max_rows written rows or after max_seconds,
+        and at the end of the block.
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = {"rows": 0, "started": time.monotonic(), "max_rows": max_rows, "max_seconds": max_seconds}
+        try:
+            yield
+        finally:
+            self._batch = None
+            self.conn.commit()
+
+    def _commit_write(self):
+        """Commit a write now, or later if batch_writes is active"""
+        if self._batch is None:
+            self.conn.commit()
+            return
+
+        self._batch["rows"] += 1
+        if (self._batch["rows"] >= self._batch["max_rows"]
+                or time.monotonic() - self._batch["started"] >= self._batch["max_seconds"]):
+            self.conn.commit()
+            self._batch["rows"] = 0
+            self._batch["started"] = time.monotonic()
+
     def _create_tables(self):
-        """Create necessary database tables"""
+        """Create necessary database tables and upgrade older cache files to the current schema"""
         self.cur.execute("CREATE TABLE IF NOT EXISTS songdata (id TEXT PRIMARY KEY, json JSON)")
         self.cur.execute("CREATE TABLE IF NOT EXISTS artistdata (artist_name TEXT PRIMARY KEY, json JSON)")
+        self.cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+        # Negativ-Cache: Anfragen, die Last.fm dauerhaft nicht beantworten kann (kind = "track" oder "artist")
+        self.cur.execute(
+            "CREATE TABLE IF NOT EXISTS fetch_failure (kind TEXT NOT NULL, key TEXT NOT NULL, error_code INTEGER, "
+            "message TEXT, expires_at REAL NOT NULL, PRIMARY KEY (kind, key))"
+        )
+        # Hash der Eingabedaten jedes gerenderten Diagramms (siehe chart_utils)
+        self.cur.execute("CREATE TABLE IF NOT EXISTS chart_hash (path TEXT PRIMARY KEY, hash TEXT NOT NULL)")
+        # Inkrementelle Analyse: Zeitstempel des letzten verarbeiteten Eintrags je History-Datei
+        self.cur.execute("CREATE TABLE IF NOT EXISTS ingest_state (source TEXT PRIMARY KEY, watermark INTEGER NOT NULL, event_count INTEGER NOT NULL)")
         self.conn.commit()
+
+        self.cur.execute("SELECT MAX(version) AS version FROM schema_version")
+        version = self.cur.fetchone()["version"] or 1
+        if version < 2:
+            self._migrate_to_v2()
+
+    def _migrate_to_v2(self):
+        """Extract name, artist, URL, duration and tags from the stored JSON into columns"""
+        print("🗄️  Aktualisiere Cache-Datenbank auf Schema-Version 2...")
+        self._add_columns("songdata", [
+            ("found", "INTEGER NOT NULL DEFAULT 0"),
+            ("name", "TEXT"),
+            ("artist_name", "TEXT"),
+            ("artist_url", "TEXT"),
+            ("duration", "INTEGER"),
+        ])
+        self._add_columns("artistdata", [("url", "TEXT")])
+        self.cur.execute("CREATE TABLE IF NOT EXISTS track_tag (track_id TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (track_id, tag))")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS track_tag_tag ON track_tag (tag)")
+        self.cur.execute("CREATE INDEX IF NOT EXISTS songdata_artist_name ON songdata (artist_name)")
+
+        self.cur.execute("SELECT id, json FROM songdata")
+        for row in self.cur.fetchall():
+            self._store_song_fields(row["id"], json.loads(row["json"]))
+        self.cur.execute("SELECT artist_name, json FROM artistdata")
+        for row in self.cur.fetchall():
+            url = json.loads(row["json"]).get("artist", {}).get("url")
+            self.cur.execute("UPDATE artistdata SET url = ? WHERE artist_name = ?", [url, row["artist_name"]])
+
+        self.cur.execute("DELETE FROM schema_version")
+        self.cur.execute("INSERT INTO schema_version (version) VALUES (2)")
+        self.conn.commit()
+
+    def _add_columns(self, table, columns):
+        self.cur.execute(f"PRAGMA table_info({table})")
+        existing = {row["name"] for row in self.cur.fetchall()}
+        for name, definition in columns:
+            if name not in existing:
+                self.cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def _store_song_fields(self, track_id, data):
+        """Write the extracted columns and tags of a Last.fm track.getInfo response"""
+        track = data.get("track") or {}
+        self.cur.execute(
+            "UPDATE songdata SET found = ?, name = ?, artist_name = ?, artist_url = ?, duration = ? WHERE id = ?",
+            [
+                1 if track else 0,
+                track.get("name"),
+                track.get("artist", {}).get("name"),
+                track.get("artist", {}).get("url"),
+                int(track.get("duration") or 0),
+                track_id,
+            ],
+        )
+        self.cur.execute("DELETE FROM track_tag WHERE track_id = ?", [track_id])
+        self.cur.executemany(
+            "INSERT OR IGNORE INTO track_tag (track_id, tag) VALUES (?, ?)",
+            [(track_id, tag["name"]) for tag in track.get("toptags", {}).get("tag", []) if tag.get("name")],
+        )
     
     def get_song_data(self, track_id):
         """Get song data from cache"""
@@ -24,12 +144,27 @@ class DatabaseManager:
         if row:
             return json.loads(row["json"]).get("track")
         return None
-    
+
+    def get_song_json_many(self, track_ids):
+        """
+        Get the cached Last.fm responses of many tracks as undecoded JSON, returns {track_id: json} for the cached tracks.
+        The caller decodes them (e.g. in worker processes).
+        """
+        result = {}
+        track_ids = list(dict.fromkeys(track_ids))
+        for start in range(0, len(track_ids), SQL_BATCH_SIZE):
+            batch = track_ids[start:start + SQL_BATCH_SIZE]
+            self.cur.execute(f"SELECT id, json FROM songdata WHERE id IN ({','.join('?' * len(batch))})", batch)
+            result.update((row["id"], row["json"]) for row in self.cur.fetchall())
+        return result
+
     def store_song_data(self, track_id, data):
         """Store song data in cache"""
         self.cur.execute("INSERT OR REPLACE INTO songdata (id, json) VALUES (?, ?)", 
                         [track_id, json.dumps(data)])
-        self.conn.commit()
+        self._store_song_fields(track_id, data)
+        self.cur.execute("DELETE FROM fetch_failure WHERE kind = 'track' AND key = ?", [track_id])
+        self._commit_write()
     
     def get_artist_data(self, artist_name):
         """Get artist data from cache"""
@@ -41,24 +176,137 @@ class DatabaseManager:
     
     def store_artist_data(self, artist_name, data):
         """Store artist data in cache"""
-        self.cur.execute("INSERT OR REPLACE INTO artistdata (artist_name, json) VALUES (?, ?)",
-                        (artist_name, json.dumps(data, ensure_ascii=False)))
-        self.conn.commit()
+        self.cur.execute("INSERT OR REPLACE INTO artistdata (artist_name, json, url) VALUES (?, ?, ?)",
+                        (artist_name, json.dumps(data, ensure_ascii=False), data.get("artist", {}).get("url")))
+        self.cur.execute("DELETE FROM fetch_failure WHERE kind = 'artist' AND key = ?", [artist_name])
+        self._commit_write()
+
+    def store_fetch_failure(self, kind, key, error_code=None, message=None, ttl_days=NEGATIVE_CACHE_TTL):
+        """Remember that Last.fm could not resolve a track or artist, so it is not requested again for ttl_days"""
+        self.cur.execute(
+            "INSERT OR REPLACE INTO fetch_failure (kind, key, error_code, message, expires_at) VALUES (?, ?, ?, ?, ?)",
+            [kind, key, error_code, message, time.time() + ttl_days * 86400],
+        )
+        self._commit_write()
+
+    def get_fetch_failures(self, kind, keys):
+        """Return the subset of keys with an unexpired entry in the negative cache"""
+        failed = set()
+        keys = list(dict.fromkeys(keys))
+        now = time.time()
+        for start in range(0, len(keys), SQL_BATCH_SIZE):
+            batch = keys[start:start + SQL_BATCH_SIZE]
+            self.cur.execute(
+                f"SELECT key FROM fetch_failure WHERE kind = ? AND expires_at > ? AND key IN ({','.join('?' * len(batch))})",
+                [kind, now, *batch],
+            )
+            failed.update(row["key"] for row in self.cur.fetchall())
+        return failed
     
     def has_song_data(self, track_id):
         """Check if song data exists in cache"""
-        return self.get_song_data(track_id) is not None
+        self.cur.execute("SELECT found FROM songdata WHERE id = ?", [track_id])
+        row = self.cur.fetchone()
+        return bool(row and row["found"])
     
     def get_artist_url_from_song_data(self, track_id):
         """Get artist URL from cached song data"""
-        song_data = self.get_song_data(track_id)
-        if song_data:
-            return song_data.get("artist", {}).get("url")
-        return None
+        self.cur.execute("SELECT artist_url FROM songdata WHERE id = ? AND found = 1", [track_id])
+        row = self.cur.fetchone()
+        return row["artist_url"] if row else None
+
+    def get_found_song_ids(self, track_ids):
+        """Return the subset of track_ids that have cached Last.fm data"""
+        found = set()
+        track_ids = list(dict.fromkeys(track_ids))
+        for start in range(0, len(track_ids), SQL_BATCH_SIZE):
+            batch = track_ids[start:start + SQL_BATCH_SIZE]
+            self.cur.execute(f"SELECT id FROM songdata WHERE found = 1 AND id IN ({','.join('?' * len(batch))})", batch)
+            found.update(row["id"] for row in self.cur.fetchall())
+        return found
+
+    def get_song_fields_many(self, track_ids):
+        """
+        Get the extracted columns (name, artist_name, artist_url, duration) for many tracks at once.
+        Only tracks with Last.fm data are contained in the result.
+        """
+        result = {}
+        track_ids = list(dict.fromkeys(track_ids))
+        for start in range(0, len(track_ids), SQL_BATCH_SIZE):
+            batch = track_ids[start:start + SQL_BATCH_SIZE]
+            self.cur.execute(
+                f"SELECT id, name, artist_name, artist_url, duration FROM songdata WHERE found = 1 AND id IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            for row in self.cur.fetchall():
+                result[row["id"]] = {key: row[key] for key in ("name", "artist_name", "artist_url", "duration")}
+        return result
+
+    def get_chart_hash(self, path):
+        """Get the input hash of the last chart rendered to path"""
+        self.cur.execute("SELECT hash FROM chart_hash WHERE path = ?", [path])
+        row = self.cur.fetchone()
+        return row["hash"] if row else None
+
+    def store_chart_hashes(self, hashes):
+        """Store {path: input hash} of rendered charts"""
+        self.cur.executemany("INSERT OR REPLACE INTO chart_hash (path, hash) VALUES (?, ?)", hashes.items())
+        self._commit_write()
+
+    def get_ingest_state(self, source):
+        """Watermark (UTC epoch seconds of the newest ingested event) and event count of a history file, or None"""
+        self.cur.execute("SELECT watermark, event_count FROM ingest_state WHERE source = ?", [source])
+        row = self.cur.fetchone()
+        return dict(row) if row else None
+
+    def store_ingest_state(self, source, watermark, event_count):
+        """Store the watermark and event count of a history file after its events were processed"""
+        self.cur.execute("INSERT OR REPLACE INTO ingest_state (source, watermark, event_count) VALUES (?, ?, ?)", [source, watermark, event_count])
+        self.conn.commit()
+
+    def get_tags(self, track_id):
+        """Get the Last.fm tags of a track"""
+        self.cur.execute("SELECT tag FROM track_tag WHERE track_id = ?", [track_id])
+        return [row["tag"] for row in self.cur.fetchall()]
+
+    def get_tags_many(self, track_ids):
+        """Get the Last.fm tags of many tracks at once as {track_id: [tag, ...]} (tracks without tags are missing)"""
+        result = {}
+        track_ids = list(dict.fromkeys(track_ids))
+        for start in range(0, len(track_ids), SQL_BATCH_SIZE):
+            batch = track_ids[start:start + SQL_BATCH_SIZE]
+            self.cur.execute(
+                f"SELECT track_id, tag FROM track_tag WHERE track_id IN ({','.join('?' * len(batch))}) ORDER BY track_id, rowid",
+                batch,
+            )
+            for row in self.cur.fetchall():
+                result.setdefault(row["track_id"], []).append(row["tag"])
+        return result
+
+    def get_tracks_by_tag(self, tag):
+        """Get all track ids with the given tag"""
+        self.cur.execute("SELECT track_id FROM track_tag WHERE tag = ?", [tag])
+        return [row["track_id"] for row in self.cur.fetchall()]
     
     def close(self):
         """Close database connection"""
+        self.conn.commit()
         self.conn.close()
 
-# Global database instance
-db = DatabaseManager()
+_manager = None
+
+def get_db():
+    """Shared DatabaseManager (the connection is opened on first use)."""
+    global _manager
+    if _manager is None:
+        _manager = DatabaseManager()
+    return _manager
+
+class _LazyDatabase:
+    """Stand-in for the shared DatabaseManager, forwards every attribute to get_db()"""
+
+    def __getattr__(self, name):
+        return getattr(get_db(), name)
+
+# Global database instance (importieren öffnet noch keine Verbindung)
+db = _LazyDatabase()
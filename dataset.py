@@ -0,0 +1,341 @@
+import os
+import json
+import time
+from datetime import datetime, date, timedelta, timezone
+import numpy as np
+import utils
+import history_reader
+import snapshot
+import ranking
+from config import MIN_PLAY_DURATION, TIMEZONE
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+BLOCK_SIZE = 65536  # Events pro Block beim Aufbau der Spalten
+
+# Spalten, die im Snapshot gespeichert werden
+ARRAY_COLUMNS = (
+    "ts", "ms_played", "track_codes", "artist_codes", "album_codes", "track_artist_codes",
+    "valid", "day", "weekday", "hour", "month_codes", "month_axis_codes", "reason_codes",
+)
+STRING_COLUMNS = ("track_uris", "track_names", "artists", "albums", "reasons", "months", "month_axis")
+
+class TrackStats:
+    """
+    Play counter of a track with its display names, one small record per track
+    (instead of a copy of one of its history entries with a counter attached).
+    """
+
+    __slots__ = ("uri", "track_name", "artist_name", "times_played")
+
+    def __init__(self, uri, track_name=None, artist_name=None, times_played=0):
+        self.uri = uri
+        self.track_name = track_name
+        self.artist_name = artist_name
+        self.times_played = times_played
+
+    def __repr__(self):
+        return f"TrackStats({self.uri!r}, {self.track_name!r}, {self.artist_name!r}, times_played={self.times_played})"
+
+class HistoryDataset:
+    """
+    Parsed Spotify listening history that is loaded once and shared by all analysis stages.
+
+    Every play event is stored column-wise in NumPy arrays (one element per event, file order):
+    - ts: UTC epoch seconds (int64)
+    - ms_played: playback duration in milliseconds (int32)
+    - track_codes / artist_codes / album_codes: indexes into track_uris / artists / albums (-1 = missing)
+    - day: local day number since 1970-01-01 (int32)
+    - month_codes: index into months, the sorted "YYYY-MM" keys of all local months (int32)
+    - weekday (0 = Monday) and hour of the local playback time (int8)
+    - valid: events that pass the min-duration filter and carry track metadata (bool)
+    - reason_codes: index into reasons, why playback ended (e.g. "trackdone", -1 = missing) (int16)
+
+    total_ms_played is the summed playback time of all events.
+
+    Per-track metadata (track_names, track_artist_codes) is stored in the same order as track_uris.
+    month_axis contains every month from the first to the last month (including months without plays),
+    month_axis_codes maps month_codes onto it.
+    """
+
+    def __init__(self, entries, source_path=None):
+        self.source_path = source_path
+        self._build_columns(entries)
+
+    def _build_columns(self, entries):
+        self.track_uris, self.track_names, track_artists = [], [], []
+        self.artists, self.albums, self.reasons = [], [], []
+        self.track_index, self.artist_index, self.album_index = {}, {}, {}
+        reason_index = {}
+
+        # Die Events werden blockweise in NumPy-Arrays umgewandelt, damit nie die ganze Datei als Python-Objekte im Speicher liegt
+        columns = {"ts": [], "ms_played": [], "tracks": [], "artists": [], "albums": [], "has_name": [], "reasons": []}
+        timestamps, ms_played, tracks, artists, albums, has_name, reasons = [], [], [], [], [], [], []
+        for entry in entries:
+            timestamp = entry.get("ts")
+            if not timestamp:
+                continue
+
+            timestamps.append(timestamp)
+            ms_played.append(entry.get("ms_played") or 0)
+
+            track_name = entry.get("master_metadata_track_name")
+            artist_code = _encode(entry.get("master_metadata_album_artist_name"), self.artist_index, self.artists)
+            artists.append(artist_code)
+            albums.append(_encode(entry.get("master_metadata_album_album_name"), self.album_index, self.albums))
+            has_name.append(bool(track_name))
+            reasons.append(_encode(entry.get("reason_end"), reason_index, self.reasons))
+
+            uri = entry.get("spotify_track_uri")
+            track_code = _encode(uri, self.track_index, self.track_uris)
+            if track_code == len(self.track_names):
+                self.track_names.append(track_name)
+                track_artists.append(artist_code)
+            elif track_code >= 0 and not self.track_names[track_code]:
+                self.track_names[track_code] = track_name
+            tracks.append(track_code)
+
+            if len(timestamps) == BLOCK_SIZE:
+                _flush_block(columns, timestamps, ms_played, tracks, artists, albums, has_name, reasons)
+                timestamps, ms_played, tracks, artists, albums, has_name, reasons = [], [], [], [], [], [], []
+        _flush_block(columns, timestamps, ms_played, tracks, artists, albums, has_name, reasons)
+
+        self.ms_played = np.concatenate(columns["ms_played"])
+        self.track_codes = np.concatenate(columns["tracks"])
+        self.artist_codes = np.concatenate(columns["artists"])
+        self.album_codes = np.concatenate(columns["albums"])
+        self.reason_codes = np.concatenate(columns["reasons"])
+        self.track_artist_codes = np.array(track_artists, dtype=np.int32)
+        self.total_ms_played = int(self.ms_played.sum(dtype=np.int64))
+        self.valid = (self.ms_played >= MIN_PLAY_DURATION) & (self.track_codes >= 0) & np.concatenate(columns["has_name"])
+
+        self.ts = np.concatenate(columns["ts"])
+        self.day, self.weekday, self.hour, self.month_codes, self.months = localize_timestamps(self.ts, utils.get_timezone())
+        self.month_axis = month_range(self.months[0], self.months[-1]) if self.months else []
+        axis_index = {month: i for i, month in enumerate(self.month_axis)}
+        self.month_axis_codes = np.array([axis_index[month] for month in self.months], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.ts)
+
+    @classmethod
+    def load(cls, input_path):
+        """
+        Stream a history file, directory or zip archive into a dataset.
+        A valid snapshot of an earlier run is loaded instead of parsing the history again.
+        Returns None if the history could not be read.
+        """
+        if not os.path.exists(input_path):
+            print(f"❌ Fehler: Datei '{input_path}' existiert nicht.")
+            return None
+
+        settings = _snapshot_settings()
+        try:
+            cached = snapshot.load(input_path, settings)
+        except Exception as e:
+            print(f"⚠️  Snapshot konnte nicht gelesen werden: {e}")
+            cached = None
+        if cached is not None:
+            print("⚡ Gespeicherten Snapshot der History geladen")
+            return cls.from_columns(*cached, source_path=input_path)
+
+        try:
+            dataset = cls(history_reader.iter_events(input_path), source_path=input_path)
+        except json.JSONDecodeError as e:
+            print(f"❌ Fehler beim Dekodieren der JSON-Datei '{input_path}': {e}")
+            return None
+        except Exception as e:
+            print(f"❌ Fehler beim Laden der Datei '{input_path}': {e}")
+            return None
+
+        try:
+            snapshot.store(
+                input_path, settings,
+                {name: getattr(dataset, name) for name in ARRAY_COLUMNS},
+                {name: getattr(dataset, name) for name in STRING_COLUMNS},
+            )
+        except OSError as e:
+            print(f"⚠️  Snapshot konnte nicht gespeichert werden: {e}")
+        return dataset
+
+    @classmethod
+    def from_columns(cls, arrays, strings, source_path=None):
+        """Dataset from already parsed columns (see ARRAY_COLUMNS and STRING_COLUMNS), e.g. of a snapshot"""
+        dataset = cls.__new__(cls)
+        dataset.source_path = source_path
+        for name in ARRAY_COLUMNS:
+            setattr(dataset, name, arrays[name])
+        for name in STRING_COLUMNS:
+            setattr(dataset, name, strings[name])
+        dataset.track_index = {uri: code for code, uri in enumerate(dataset.track_uris)}
+        dataset.artist_index = {artist: code for code, artist in enumerate(dataset.artists)}
+        dataset.album_index = {album: code for code, album in enumerate(dataset.albums)}
+        dataset.total_ms_played = int(dataset.ms_played.sum(dtype=np.int64))
+        return dataset
+
+    def artist_name(self, code):
+        return self.artists[code] if code >= 0 else None
+
+    def track_uri(self, code):
+        return self.track_uris[code] if code >= 0 else None
+
+    def track_stats(self, track_codes, play_counts):
+        """TrackStats records for parallel lists of track codes and play counts (e.g. a ranking from ranked_by_group)"""
+        return [
+            TrackStats(self.track_uris[code], self.track_names[code], self.artist_name(self.track_artist_codes[code]), times_played)
+            for code, times_played in zip(track_codes, play_counts)
+        ]
+
+def _snapshot_settings():
+    """Settings the derived columns depend on (a snapshot made with other settings is not used)"""
+    local_zone = None if TIMEZONE else list(time.tzname) + [time.timezone, time.altzone]
+    return {"min_play_duration": MIN_PLAY_DURATION, "timezone": TIMEZONE, "local_zone": local_zone}
+
+def _flush_block(columns, timestamps, ms_played, tracks, artists, albums, has_name, reasons):
+    """Append one block of events to the column chunks"""
+    columns["ts"].append(parse_timestamps(timestamps))
+    columns["ms_played"].append(np.array(ms_played, dtype=np.int32))
+    columns["tracks"].append(np.array(tracks, dtype=np.int32))
+    columns["artists"].append(np.array(artists, dtype=np.int32))
+    columns["albums"].append(np.array(albums, dtype=np.int32))
+    columns["has_name"].append(np.array(has_name, dtype=bool))
+    columns["reasons"].append(np.array(reasons, dtype=np.int16))
+
+def _encode(value, index, values):
+    """Dictionary-encode a string value, returns -1 for missing values."""
+    if not value:
+        return -1
+    code = index.get(value)
+    if code is None:
+        code = index[value] = len(values)
+        values.append(value)
+    return code
+
+def load_dataset(input_filename):
+    """Load userdata/<input_filename> (a JSON file, a directory or a zip archive of the export) into a HistoryDataset."""
+    input_path = os.path.join("userdata", input_filename)
+    print(f"📂 Lese Daten aus: {input_path}")
+    return HistoryDataset.load(input_path)
+
+def group_sum(keys, weights=None):
+    """
+    Vectorized group-by over an integer key array.
+    Returns (unique keys, sums, first index) ordered by first occurrence of each key.
+    Without weights the sums are the number of occurrences.
+    """
+    unique_keys, sums, first_index = _key_totals(keys, weights)
+    order = np.argsort(first_index, kind="stable")
+    return unique_keys[order], sums[order], first_index[order]
+
+def _key_totals(keys, weights=None):
+    """Like group_sum, but ordered by key"""
+    if len(keys) == 0:
+        return keys[:0], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    unique_keys, first_index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if weights is None:
+        sums = np.bincount(inverse)
+    else:
+        sums = np.bincount(inverse, weights=weights)
+        if np.issubdtype(weights.dtype, np.integer):
+            sums = sums.astype(np.int64)
+    return unique_keys, sums, first_index
+
+def ranked_by_group(groups, items, weights=None, limit=None):
+    """
+    Rank the items of every group by count (or by summed weights) in descending order.
+    Ties keep the order of first occurrence, like a stable sort over the events.
+    With a limit only the top limit items of every group are selected (ranking.top_k) instead of ranking all of them.
+    Returns {group: (item codes, sums)} with the groups in ascending order.
+    """
+    if len(items) == 0:
+        return {}
+    offset = int(items.max()) + 2  # Platz für -1 (fehlender Wert)
+    keys = groups.astype(np.int64) * offset + items + 1
+    # Nach Schlüssel sortiert, damit liegen die Einträge einer Gruppe beieinander
+    unique_keys, sums, first_index = _key_totals(keys, weights)
+    key_groups = unique_keys // offset
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(key_groups)) + 1, [len(unique_keys)]))
+
+    if limit is None:
+        order = np.lexsort((first_index, -sums, key_groups))
+        selected = [order[start:end] for start, end in zip(starts[:-1], starts[1:])]
+    else:
+        selected = [start + ranking.top_k(sums[start:end], limit, first_index[start:end]) for start, end in zip(starts[:-1], starts[1:])]
+
+    return {
+        int(key_groups[start]): ((unique_keys[rows] % offset - 1).tolist(), sums[rows].tolist())
+        for start, rows in zip(starts[:-1], selected)
+    }
+
+def totals_by_group(groups, items, weights=None):
+    """
+    Count (or sum the weights of) the items of every group without ranking them.
+    Returns {group: (item codes, sums)} with the groups in ascending order and the items in order of first occurrence.
+    """
+    if len(items) == 0:
+        return {}
+    offset = int(items.max()) + 2  # Platz für -1 (fehlender Wert)
+    unique_keys, sums, first_index = group_sum(groups.astype(np.int64) * offset + items + 1, weights)
+    key_groups = unique_keys // offset
+    order = np.argsort(key_groups, kind="stable")
+    key_groups, key_items, sums = key_groups[order], unique_keys[order] % offset - 1, sums[order]
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(key_groups)) + 1, [len(order)]))
+    return {
+        int(key_groups[start]): (key_items[start:end].tolist(), sums[start:end].tolist())
+        for start, end in zip(starts[:-1], starts[1:])
+    }
+
+def parse_timestamps(timestamps):
+    """Spotify timestamps as UTC epoch seconds (int64)"""
+    # "U19" schneidet das "Z" ab, numpy parst den Rest als ISO-Zeitstempel
+    return np.array(timestamps, dtype="U19").astype("datetime64[s]").astype(np.int64)
+
+def localize_timestamps(ts, tz=None):
+    """
+    Local calendar fields of UTC epoch seconds in tz (system local time if tz is None).
+    Returns (local day, weekday, hour, month codes, month keys).
+    """
+    local = local_timestamps(ts, tz)
+
+    day = (local // 86400).astype(np.int32)
+    weekday = ((day + 3) % 7).astype(np.int8)  # 1970-01-01 war ein Donnerstag
+    hour = (local % 86400 // 3600).astype(np.int8)
+    month_numbers, month_codes = np.unique(day.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64), return_inverse=True)
+    months = np.datetime_as_string(month_numbers.astype("datetime64[M]"), unit="M").tolist()
+    return day, weekday, hour, month_codes.astype(np.int32), months
+
+def local_timestamps(ts, tz=None):
+    """UTC epoch seconds shifted to the local time of tz (system local time if tz is None)"""
+    return ts + _utc_offsets(ts, tz)
+
+def _utc_offsets(ts, tz):
+    """
+    UTC offset in seconds for every epoch timestamp.
+    The offset is looked up once per UTC day, only days with a DST change are resolved per event.
+    """
+    days, inverse = np.unique(ts // 86400, return_inverse=True)
+    day_start = np.array([_utc_offset(int(day) * 86400, tz) for day in days], dtype=np.int64)
+    day_end = np.array([_utc_offset(int(day) * 86400 + 86399, tz) for day in days], dtype=np.int64)
+
+    offsets = day_start[inverse]
+    changed = (day_start != day_end)[inverse]
+    if changed.any():
+        offsets[changed] = [_utc_offset(int(t), tz) for t in ts[changed]]
+    return offsets
+
+def _utc_offset(timestamp, tz):
+    return int(datetime.fromtimestamp(timestamp, timezone.utc).astimezone(tz).utcoffset().total_seconds())
+
+def day_to_date(day):
+    """Convert a day number since 1970-01-01 to a date."""
+    return date.fromordinal(int(day) + EPOCH_ORDINAL)
+
+def month_range(first_month, last_month):
+    """All "YYYY-MM" keys from first_month to last_month (inclusive)."""
+    months = []
+    current = datetime.strptime(first_month, "%Y-%m")
+    while current.strftime("%Y-%m") <= last_month:
+        months.append(current.strftime("%Y-%m"))
+        current += timedelta(days=32)
+        current = current.replace(day=1)
+    return months
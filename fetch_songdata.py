@@ -1,67 +1,70 @@
-import json
-import requests
-import urllib.parse
 import os
-import time
 import sys
+from concurrent.futures import as_completed
 from database import db
-from config import LASTFM_API_KEY
+from dataset import HistoryDataset, group_sum
+from lastfm import get_fetcher, LastFmError
 
 # === Last.fm Request ===
 def get_lastfm_info(artist, track):
-    encoded_artist = urllib.parse.quote(artist)
-    encoded_track = urllib.parse.quote(track)
-    url = (
-        f"https://ws.audioscrobbler.com/2.0/?method=track.getInfo"
-        f"&api_key={LASTFM_API_KEY}&artist={encoded_artist}&track={encoded_track}&format=json"
-    )
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise Exception(f"Last.fm-Fehler: {response.status_code} - {response.text}")
-    return response.json()
+    return get_fetcher().track_info(artist, track).result()
 
 # === Hauptprogramm ===
-def main(input_filename="spotify_history.json"):
-    input_path = os.path.join("userdata", input_filename)
+def main(input_filename="spotify_history.json", dataset=None):
+    if dataset is None:
+        input_path = os.path.join("userdata", input_filename)
 
-    if not os.path.exists(input_path):
-        print(f"❌ Datei nicht gefunden: {input_path}")
-        sys.exit(1)
+        if not os.path.exists(input_path):
+            print(f"❌ Datei nicht gefunden: {input_path}")
+            sys.exit(1)
 
-    # === Daten laden ===
-    with open(input_path, "r", encoding="utf-8") as file:
-        data = json.load(file)
+        # === Daten laden ===
+        print(f"📂 Lese Daten aus: {input_path}")
+        dataset = HistoryDataset.load(input_path)
+        if dataset is None:
+            sys.exit(1)
 
-    print(f"📂 Lese Daten aus: {input_path}")
-    data_count = len(data)
-    print(f"📊 Anzahl der Einträge: {data_count}")
-    current_count = 0
-    for entry in data:
-        start_processing_ts = time.time()
-        current_count += 1
-        in_cache = False
-        track_id = entry.get('spotify_track_uri')
-        artist = entry.get("master_metadata_album_artist_name")
-        track = entry.get("master_metadata_track_name")
+    print(f"📊 Anzahl der Einträge: {len(dataset)}")
 
-        if not track_id or not artist or not track:
-            continue
+    # Jeder Song nur einmal (Artist aus dem ersten Eintrag), danach ein Abgleich mit dem Cache
+    complete = (dataset.track_codes >= 0) & (dataset.artist_codes >= 0)
+    track_codes, _, first_index = group_sum(dataset.track_codes[complete])
+    artist_codes = dataset.artist_codes[complete][first_index]
+    work = [
+        (dataset.track_uris[track_code], dataset.artists[artist_code], dataset.track_names[track_code])
+        for track_code, artist_code in zip(track_codes.tolist(), artist_codes.tolist())
+        if dataset.track_names[track_code]
+    ]
+    track_ids = [track_id for track_id, _, _ in work]
+    cached = db.get_found_song_ids(track_ids)
+    failed = db.get_fetch_failures("track", track_ids) - cached
+    missing = [key for key in work if key[0] not in cached and key[0] not in failed]
+    print(f"🎵 {len(work)} verschiedene Songs, davon {len(cached)} im Cache und {len(missing)} abzurufen")
+    if failed:
+        print(f"⏭️  {len(failed)} Songs übersprungen, die Last.fm zuletzt nicht gefunden hat")
+
+    # Gleiche Anfragen (z.B. ein Song unter mehreren IDs) teilen sich einen Future
+    fetcher = get_fetcher()
+    pending = {}
+    for key in missing:
+        pending.setdefault(fetcher.track_info(key[1], key[2]), []).append(key)
+    width = len(str(len(missing)))
+    current_count = 0
 
-        lastfm_data = db.get_song_data(track_id)
-        if lastfm_data:
-            in_cache = True
-        else:
-            try:
-                lastfm_data = get_lastfm_info(artist, track)
-            except Exception as e:
-                print(f"   ❌ Fehler: {e}")
-                continue
-            db.store_song_data(track_id, lastfm_data)
-        print(f"   ✅ | {str(current_count).zfill(len(str(data_count)))} / {data_count} | {artist} - {track} (ID: {track_id}) ({'cache' if in_cache else 'api'})")
-        end_processing_ts = time.time()
-        sleep_time: float = 0.25 - (end_processing_ts - start_processing_ts)
-        if not in_cache and sleep_time > 0:
-            time.sleep(sleep_time)  # API-Rate-Limit
+    # Schreibzugriffe gebündelt committen (statt ein fsync pro Song)
+    with db.batch_writes():
+        for request in as_completed(pending):
+            for track_id, artist, track in pending[request]:
+                current_count += 1
+                try:
+                    lastfm_data = request.result()
+                except Exception as e:
+                    print(f"   ❌ Fehler: {e}")
+                    if isinstance(e, LastFmError) and e.permanent:
+                        db.store_fetch_failure("track", track_id, e.error_code, e.text)
+                    continue
+                db.store_song_data(track_id, lastfm_data)
+                print(f"   ✅ | {str(current_count).zfill(width)} / {len(missing)} | {artist} - {track} (ID: {track_id}) (api)")
     print(f"\n✅ Alle Songdaten abgerufen!")
 
 if __name__ == "__main__":
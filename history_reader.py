@@ -0,0 +1,123 @@
+"""
+Streaming reader for Spotify streaming history exports.
+
+A history can be a single JSON file, a directory or a zip archive (as downloaded from Spotify).
+In a directory or zip all Streaming_History_Audio_*.json files are read in order (if there are none,
+every .json file). The files are decoded event by event, so only one chunk of a file is in memory
+at a time, and every event is reduced to the fields the analyses use.
+"""
+
+import io
+import os
+import re
+import json
+import zipfile
+
+# Felder, die die Analysen verwenden (alle anderen werden beim Lesen verworfen)
+HISTORY_FIELDS = (
+    "ts",
+    "ms_played",
+    "master_metadata_track_name",
+    "master_metadata_album_artist_name",
+    "master_metadata_album_album_name",
+    "spotify_track_uri",
+    "reason_end",
+)
+
+AUDIO_HISTORY_PATTERN = re.compile(r"Streaming_History_Audio_.*\.json$", re.IGNORECASE)
+CHUNK_SIZE = 1 << 20  # Zeichen pro Lesevorgang
+
+def iter_events(path, fields=HISTORY_FIELDS):
+    """
+    Yield the play events of a history file, directory or zip archive one at a time.
+    Only the given fields are kept (fields=None keeps the complete events).
+    Raises FileNotFoundError if the path does not exist and json.JSONDecodeError for broken files.
+    """
+    if os.path.isdir(path):
+        for name in _history_files(os.listdir(path)):
+            with open(os.path.join(path, name), "r", encoding="utf-8") as file:
+                yield from _select(iter_json_array(file), fields)
+    elif zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for name in _history_files(archive.namelist()):
+                with archive.open(name) as raw:
+                    yield from _select(iter_json_array(io.TextIOWrapper(raw, encoding="utf-8")), fields)
+    else:
+        with open(path, "r", encoding="utf-8") as file:
+            yield from _select(iter_json_array(file), fields)
+
+def source_files(path):
+    """The files on disk that make up the history at path (the history files of a directory, otherwise path itself)"""
+    if os.path.isdir(path):
+        return [os.path.join(path, name) for name in _history_files(os.listdir(path))]
+    return [path]
+
+def iter_json_array(file, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally decode a JSON array from a text file and yield its elements.
+    The file is read in chunks of chunk_size characters, consumed input is dropped from the buffer.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+    started = False
+    expect_value = True
+
+    while True:
+        position = _skip_whitespace(buffer, position)
+        if position < len(buffer):
+            char = buffer[position]
+            if not started:
+                if char != "[":
+                    raise json.JSONDecodeError("Expecting '['", buffer, position)
+                started = True
+                position += 1
+                continue
+            if char == "]":
+                return
+            if char == "," and not expect_value:
+                position += 1
+                expect_value = True
+                continue
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # Ein Wert am Pufferende könnte abgeschnitten sein (z.B. eine Zahl)
+                if end < len(buffer) or eof:
+                    if not expect_value:
+                        raise json.JSONDecodeError("Expecting ',' delimiter", buffer, position)
+                    yield value
+                    position = end
+                    expect_value = False
+                    continue
+        elif eof:
+            raise json.JSONDecodeError("Expecting ']'" if started else "Expecting '['", buffer, position)
+
+        # Mehr Daten nachladen, verarbeiteten Teil verwerfen
+        chunk = file.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[position:] + chunk
+        position = 0
+
+def _skip_whitespace(buffer, position):
+    while position < len(buffer) and buffer[position] in " \t\n\r":
+        position += 1
+    return position
+
+def _select(events, fields):
+    if fields is None:
+        yield from events
+        return
+    for event in events:
+        yield {field: event[field] for field in fields if field in event}
+
+def _history_files(names):
+    """The history files among names, in natural order (…_2019_1.json before …_2019_10.json)"""
+    json_files = [name for name in names if name.lower().endswith(".json") and not name.endswith("/")]
+    audio_files = [name for name in json_files if AUDIO_HISTORY_PATTERN.search(os.path.basename(name))]
+    return sorted(audio_files or json_files, key=_natural_key)
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
@@ -0,0 +1,87 @@
+"""
+Incremental runs: a watermark per history file (the timestamp of the newest processed event) tells
+which events are new since the last run, the ChangeSet lists the months, artists and songs they touch.
+Only the pages of those are written again.
+
+The statistics themselves are still computed from the whole loaded dataset on every run, there is
+no stored aggregate per (track, month) or (artist, month) that new events are added to: the stages
+aggregate the columnar dataset in one vectorized pass, a second copy in cache.db would have to be
+kept in sync with it without making the pages any cheaper to compute.
+"""
+
+import numpy as np
+from datetime import datetime, timezone
+from database import db
+from config import FULL_REBUILD
+
+class ChangeSet:
+    """
+    Months, artists and tracks affected by the events added since the last run.
+    Pages of unaffected months, artists and tracks are kept as they are (unless their file is missing).
+    With full=True everything counts as changed.
+    """
+
+    def __init__(self, full=True, months=(), artists=(), tracks=()):
+        self.full = full
+        self.months = set(months)
+        self.artists = set(artists)
+        self.tracks = set(tracks)
+        self._update = None
+
+    def month(self, month_key):
+        return self.full or month_key in self.months
+
+    def artist(self, artist_name):
+        return self.full or artist_name in self.artists
+
+    def track(self, track_id):
+        return self.full or track_id in self.tracks
+
+    def commit(self):
+        """Move the watermark past the new events (call after all pages are written)"""
+        if self._update is not None:
+            db.store_ingest_state(**self._update)
+            self._update = None
+
+def ingest(source, dataset):
+    """
+    Determine the events of `source` that are newer than the stored watermark and what they change.
+    A full rebuild is done on the first run, with FULL_REBUILD, or if older events differ from the last run.
+    """
+    state = db.get_ingest_state(source)
+    reason = None
+    if FULL_REBUILD:
+        reason = "FULL_REBUILD gesetzt"
+    elif state is None:
+        reason = "erster Durchlauf"
+    elif np.count_nonzero(dataset.ts <= state["watermark"]) != state["event_count"]:
+        # Export enthält andere alte Einträge als beim letzten Lauf
+        reason = "ältere Einträge haben sich geändert"
+
+    full = reason is not None
+    new = np.ones(len(dataset), dtype=bool) if full else dataset.ts > state["watermark"]
+    new_events = np.flatnonzero(new)
+
+    changes = ChangeSet(
+        full=full,
+        months=(dataset.months[code] for code in np.unique(dataset.month_codes[new_events])),
+        artists=_names(dataset.artist_codes[new_events], dataset.artists),
+        tracks=_names(dataset.track_codes[new_events], dataset.track_uris),
+    )
+    changes._update = {
+        "source": source,
+        "watermark": int(dataset.ts.max()) if len(dataset) else (state or {}).get("watermark", 0),
+        "event_count": len(dataset),
+    }
+
+    if full:
+        print(f"🔄 Vollständige Analyse ({reason})")
+    else:
+        since = datetime.fromtimestamp(state["watermark"], timezone.utc).strftime("%Y-%m-%d %H:%M")
+        print(f"🔁 Inkrementelle Analyse: {len(new_events)} neue Einträge seit {since} (UTC) – "
+              f"{len(changes.months)} Monate, {len(changes.artists)} Artists, {len(changes.tracks)} Songs betroffen")
+    return changes
+
+def _names(codes, names):
+    """Names of the distinct codes (missing values, -1, are left out)"""
+    return [names[code] for code in np.unique(codes[codes >= 0]).tolist()]
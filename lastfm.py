@@ -0,0 +1,199 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    LASTFM_API_KEY, LASTFM_API_URL, LASTFM_RATE_LIMIT, LASTFM_WORKERS, LASTFM_TIMEOUT,
+    LASTFM_MAX_RETRIES, LASTFM_BACKOFF_BASE, LASTFM_BACKOFF_MAX,
+)
+
+# Last.fm-Fehlercodes (https://www.last.fm/api/errorcodes)
+RATE_LIMIT_EXCEEDED = 29
+RETRYABLE_ERRORS = {8, 11, 16, RATE_LIMIT_EXCEEDED}  # Backend-Fehler, Dienst offline, temporär nicht verfügbar
+NOT_FOUND_ERRORS = {6, 7}  # Ungültige Parameter (z.B. Track nicht gefunden), ungültige Ressource
+
+class LastFmError(Exception):
+    def __init__(self, status_code, text, error_code=None):
+        super().__init__(f"Last.fm-Fehler: {status_code} - {text}")
+        self.status_code = status_code
+        self.text = text
+        self.error_code = error_code
+
+    @property
+    def rate_limited(self):
+        return self.status_code == 429 or self.error_code == RATE_LIMIT_EXCEEDED
+
+    @property
+    def retryable(self):
+        return self.rate_limited or self.status_code >= 500 or self.error_code in RETRYABLE_ERRORS
+
+    @property
+    def permanent(self):
+        """Last.fm cannot resolve the request, asking again will give the same answer."""
+        return self.error_code in NOT_FOUND_ERRORS
+
+class TokenBucket:
+    """Thread-safe token bucket: allows `rate` requests per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available and take it."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next `seconds` (e.g. after the server reported a rate limit)."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+class LastFmFetcher:
+    """
+    Concurrent Last.fm API client.
+
+    Requests run on a thread pool, share one token bucket (LASTFM_RATE_LIMIT requests per second)
+    and reuse keep-alive connections (one requests.Session per worker thread).
+    Identical requests that are still in flight are only sent once.
+    Rate limits, server and connection errors are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, api_key=LASTFM_API_KEY, base_url=LASTFM_API_URL, rate=LASTFM_RATE_LIMIT, workers=LASTFM_WORKERS,
+                 timeout=LASTFM_TIMEOUT, max_retries=LASTFM_MAX_RETRIES, backoff_base=LASTFM_BACKOFF_BASE, backoff_max=LASTFM_BACKOFF_MAX):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.workers = workers
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = TokenBucket(rate)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lastfm")
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        self.local = threading.local()
+
+    def _session(self):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            # requests erst importieren, wenn wirklich angefragt wird (langsamer Import)
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.local.session = session
+        return session
+
+    def request(self, params):
+        """
+        Send a single API request (blocking, rate limited) and return the decoded JSON.
+        Raises LastFmError for error responses and requests.RequestException if the server was not reachable,
+        both only after the retries are used up (errors that are not retryable are raised immediately).
+        """
+        import requests
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            retry_after = None
+            try:
+                response = self._session().get(
+                    self.base_url,
+                    params={**params, "api_key": self.api_key, "format": "json"},
+                    timeout=self.timeout,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                data, error = _parse_response(response)
+                if error is None:
+                    return data
+                if not error.retryable:
+                    raise error
+                retry_after = _retry_after(response)
+
+            if attempt == self.max_retries:
+                raise error
+
+            delay = self.backoff(attempt, retry_after)
+            if isinstance(error, LastFmError) and error.rate_limited:
+                # Alle Worker bremsen, nicht nur diesen
+                self.limiter.pause(delay)
+            time.sleep(delay)
+
+    def backoff(self, attempt, retry_after=None):
+        """Exponential backoff with full jitter, at least as long as the server asked for."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def submit(self, params):
+        """Schedule a request on the worker pool, returns a Future with the decoded JSON."""
+        key = tuple(sorted(params.items()))
+        with self.in_flight_lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(self.request, params)
+            self.in_flight[key] = future
+        # Außerhalb des Locks: ist der Future schon fertig, läuft der Callback sofort in diesem Thread
+        future.add_done_callback(lambda _, key=key: self._done(key))
+        return future
+
+    def _done(self, key):
+        with self.in_flight_lock:
+            self.in_flight.pop(key, None)
+
+    def track_info(self, artist, track):
+        return self.submit({"method": "track.getInfo", "artist": artist, "track": track})
+
+    def artist_info(self, artist):
+        return self.submit({"method": "artist.getinfo", "artist": artist})
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def _parse_response(response):
+    """Returns (data, None) for a successful response, (None, LastFmError) otherwise."""
+    try:
+        data = response.json()
+    except ValueError:
+        data = None
+
+    # Last.fm meldet Fehler teilweise auch mit HTTP 200 im JSON-Body
+    error_code = data.get("error") if isinstance(data, dict) else None
+    if response.status_code == 200 and error_code is None and data is not None:
+        return data, None
+    return None, LastFmError(response.status_code, response.text, error_code)
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+_fetcher = None
+
+def get_fetcher():
+    """Shared fetcher instance (created on first use)."""
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = LastFmFetcher()
+    return _fetcher
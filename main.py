@@ -4,12 +4,29 @@ import fetch_songdata
 import analyze_general
 import analyze_songs
 import analyze_artists
+import analyze_tags
+import chart_utils
+import incremental
+import utils
+from dataset import load_dataset
 
 def main(input_filename):
-    fetch_songdata.main(input_filename)
-    analyze_artists.main(input_filename)
-    analyze_songs.main(input_filename)
-    output_path = analyze_general.main(input_filename)
+    dataset = load_dataset(input_filename)
+    if dataset is None:
+        sys.exit(1)
+
+    changes = incremental.ingest(input_filename, dataset)
+    # Von den Stufen beim Schreiben gefüllt, bestimmt welche Einträge verlinkt werden
+    pages = utils.PageRegistry()
+
+    fetch_songdata.main(input_filename, dataset)
+    analyze_artists.main(input_filename, dataset, changes, pages)
+    analyze_songs.main(input_filename, dataset, changes, pages)
+    analyze_tags.main(input_filename, dataset, pages=pages)
+    output_path = analyze_general.main(input_filename, dataset, changes, pages)
+    changes.commit()
+    chart_stats = chart_utils.get_chart_stats()
+    print(f"🖼️  Diagramme: {chart_stats['rendered']} erstellt, {chart_stats['skipped']} unverändert")
     print("✅ Analyse erfolgreich abgeschlossen!")
     print(f"📂 Du findest deine Analyseergebnisse unter {os.path.realpath(output_path)}.")
 
@@ -0,0 +1,39 @@
+"""
+Bounded top-k selection for the ranking lists.
+
+Most lists only show the first few entries (top 25 songs, top 10 artists of a month, the slices of a
+pie chart), so only the k best entries are sorted instead of all of them. Ties are broken by a
+secondary key (usually the first occurrence), the result is the same as that of a stable full sort.
+"""
+
+import heapq
+import numpy as np
+
+def top_k(scores, k=None, tie_breaker=None):
+    """
+    Indices of the k largest scores in descending order, ties ordered by ascending tie_breaker
+    (by index if None). k=None ranks all scores.
+    The candidates are selected with a partition in linear time, only they are sorted.
+    """
+    count = len(scores)
+    if tie_breaker is None:
+        tie_breaker = np.arange(count)
+    if k is not None and k <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if k is not None and k < count:
+        # Alle Werte ab dem k-größten, auch die gleich großen, damit der Tie-Breaker entscheidet
+        threshold = np.partition(scores, count - k)[count - k]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(count)
+    order = np.lexsort((tie_breaker[candidates], -scores[candidates]))
+    return candidates[order[:k]]
+
+def top_items(items, k, key=None):
+    """
+    The k items with the largest key in descending order (key=None compares the items themselves),
+    ties keep their iteration order. Same result as sorted(items, key=key, reverse=True)[:k],
+    but only a heap of k items is kept.
+    """
+    return heapq.nlargest(k, items, key=key)
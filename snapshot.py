@@ -0,0 +1,108 @@
+"""
+Binary snapshots of parsed histories, so later runs do not have to decode the JSON export again.
+
+A snapshot is a directory in SNAPSHOT_DIR with one .npy file per fixed-width column (loaded
+memory-mapped, pages are only read when a column is used), strings.json with the string
+dictionaries and meta.json with the fingerprint of the source files.
+
+A snapshot is only used while every source file has the same size and mtime as when it was written.
+If only the mtimes differ (e.g. the export was copied again) the content hash decides.
+"""
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import numpy as np
+import history_reader
+from config import SNAPSHOT_DIR
+
+# Erhöhen, wenn sich das Format oder die Bedeutung der Spalten ändert
+SNAPSHOT_VERSION = 2
+
+def load(source_path, settings):
+    """
+    Return (arrays, strings) of the snapshot of source_path, None if there is no valid snapshot.
+    settings are the values the columns were derived with (e.g. time zone), a snapshot with different settings is ignored.
+    """
+    directory = _snapshot_dir(source_path)
+    meta = _read_json(os.path.join(directory, "meta.json"))
+    if meta is None or meta.get("version") != SNAPSHOT_VERSION or meta.get("settings") != settings:
+        return None
+
+    files = _stat_files(source_path)
+    if [(f["path"], f["size"]) for f in files] != [(f["path"], f["size"]) for f in meta["files"]]:
+        return None
+    if [f["mtime_ns"] for f in files] != [f["mtime_ns"] for f in meta["files"]]:
+        if _content_hash(source_path) != meta["sha256"]:
+            return None
+        # Inhalt unverändert, nur neue mtimes merken
+        meta["files"] = files
+        _write_json(os.path.join(directory, "meta.json"), meta)
+
+    strings = _read_json(os.path.join(directory, "strings.json"))
+    if strings is None:
+        return None
+    try:
+        arrays = {name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")) for name in meta["arrays"]}
+    except (OSError, ValueError):
+        return None
+    return arrays, strings
+
+def store(source_path, settings, arrays, strings):
+    """Write the snapshot of source_path (arrays: {name: ndarray}, strings: {name: list of str})"""
+    directory = _snapshot_dir(source_path)
+    files = _stat_files(source_path)
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "source": source_path,
+        "settings": settings,
+        "files": files,
+        "sha256": _content_hash(source_path),
+        "arrays": list(arrays),
+    }
+
+    # In ein temporäres Verzeichnis schreiben und erst dann austauschen
+    temp_directory = f"{directory}.tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    for name, values in arrays.items():
+        np.save(os.path.join(temp_directory, f"{name}.npy"), np.ascontiguousarray(values))
+    _write_json(os.path.join(temp_directory, "strings.json"), strings)
+    _write_json(os.path.join(temp_directory, "meta.json"), meta)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+    return directory
+
+def _snapshot_dir(source_path):
+    absolute_path = os.path.abspath(source_path)
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", os.path.basename(os.path.normpath(absolute_path)))
+    digest = hashlib.sha256(absolute_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(SNAPSHOT_DIR, f"{name}-{digest}")
+
+def _stat_files(source_path):
+    files = []
+    for path in history_reader.source_files(source_path):
+        stat = os.stat(path)
+        files.append({"path": os.path.basename(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    return files
+
+def _content_hash(source_path):
+    digest = hashlib.sha256()
+    for path in history_reader.source_files(source_path):
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False)
@@ -0,0 +1,165 @@
+"""
+Tests of the Last.fm fetcher (lastfm.py) against a local stub HTTP server: rate limit, in-flight
+deduplication, retries after rate limit errors, permanent misses and the done-callback of requests
+that finish before submit() returns.
+
+Usage: python -m unittest discover tests (or python -m pytest tests)
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import unittest
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from lastfm import LastFmFetcher, LastFmError
+
+TIMEOUT = 10  # Sekunden, bevor ein hängender Test abbricht
+
+class StubServer:
+    """
+    Last.fm stand-in on a free local port. respond(params, count) returns (status, headers, body) for
+    a request, count is the number of requests with the same method and artist so far (starting at 1).
+    Every request is recorded with its arrival time.
+    """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                params = dict(parse_qsl(urlparse(self.path).query))
+                with server.lock:
+                    server.requests.append((time.monotonic(), params))
+                    count = sum(1 for _, seen in server.requests if _same_request(seen, params))
+                status, headers, body = server.respond(params, count)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def _same_request(a, b):
+    return a.get("method") == b.get("method") and a.get("artist") == b.get("artist") and a.get("track") == b.get("track")
+
+def ok(params, count):
+    return 200, {}, {"artist": {"name": params.get("artist")}}
+
+class FetcherTest(unittest.TestCase):
+    def start(self, respond, **options):
+        """Start a stub server with respond and a fetcher that talks to it"""
+        server = StubServer(respond)
+        self.addCleanup(server.close)
+        options = {"rate": 1000, "workers": 4, "timeout": 5, "max_retries": 3, "backoff_base": 0.001, "backoff_max": 5, **options}
+        fetcher = LastFmFetcher(api_key="test", base_url=server.url, **options)
+        self.addCleanup(fetcher.close)
+        return server, fetcher
+
+    def test_rate_limit(self):
+        # 20 Anfragen sofort (Burst), die übrigen 10 mit 20 pro Sekunde
+        server, fetcher = self.start(ok, rate=20)
+        start = time.monotonic()
+        futures = [fetcher.artist_info(f"Artist {i}") for i in range(30)]
+        for future in futures:
+            future.result(timeout=TIMEOUT)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(len(server.requests), 30)
+        self.assertGreaterEqual(elapsed, 10 / 20 * 0.9)
+        # Nach dem Burst nie mehr als rate Anfragen pro Sekunde (plus der Burst selbst)
+        times = sorted(arrival for arrival, _ in server.requests)
+        self.assertGreaterEqual(times[-1] - times[20], 9 / 20 * 0.9)
+
+    def test_duplicate_requests_share_one_future(self):
+        release = threading.Event()
+
+        def slow(params, count):
+            release.wait(TIMEOUT)
+            return ok(params, count)
+
+        server, fetcher = self.start(slow)
+        futures = [fetcher.track_info("Artist", "Track") for _ in range(5)]
+        self.assertTrue(all(future is futures[0] for future in futures))
+        release.set()
+        self.assertEqual(futures[0].result(timeout=TIMEOUT), {"artist": {"name": "Artist"}})
+        self.assertEqual(len(server.requests), 1)
+
+        # Fertige Anfragen werden nicht mehr geteilt
+        self.assertIsNot(fetcher.track_info("Artist", "Track"), futures[0])
+
+    def test_rate_limit_response_is_retried_after_retry_after(self):
+        for status, body in ((429, {"error": 29, "message": "Rate Limit Exceeded"}),
+                             (200, {"error": 29, "message": "Rate Limit Exceeded"})):
+            with self.subTest(status=status):
+                def limited(params, count):
+                    if count == 1:
+                        return status, {"Retry-After": "0.3"}, body
+                    return ok(params, count)
+
+                server, fetcher = self.start(limited)
+                self.assertEqual(fetcher.artist_info("Artist").result(timeout=TIMEOUT), {"artist": {"name": "Artist"}})
+                self.assertEqual(len(server.requests), 2)
+                first, second = (arrival for arrival, _ in server.requests)
+                self.assertGreaterEqual(second - first, 0.3 * 0.9)
+
+    def test_not_found_is_permanent_and_not_retried(self):
+        for error_code in (6, 7):
+            with self.subTest(error_code=error_code):
+                server, fetcher = self.start(lambda params, count: (400, {}, {"error": error_code, "message": "not found"}))
+                with self.assertRaises(LastFmError) as raised:
+                    fetcher.track_info("Artist", "Track").result(timeout=TIMEOUT)
+                self.assertTrue(raised.exception.permanent)
+                self.assertEqual(raised.exception.error_code, error_code)
+                self.assertEqual(len(server.requests), 1)
+
+    def test_request_finished_before_submit_returns(self):
+        # Ein Executor, der synchron ausführt: der Future ist schon fertig, wenn submit() den Callback anhängt
+        server, fetcher = self.start(ok)
+
+        class ImmediateExecutor:
+            def submit(self, function, *args):
+                future = Future()
+                future.set_result(function(*args))
+                return future
+
+            def shutdown(self, wait=True):
+                pass
+
+        fetcher.executor = ImmediateExecutor()
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault("future", fetcher.artist_info("Artist")), daemon=True)
+        thread.start()
+        thread.join(TIMEOUT)
+
+        self.assertFalse(thread.is_alive(), "submit() blockiert (Deadlock im Done-Callback)")
+        self.assertEqual(result["future"].result(), {"artist": {"name": "Artist"}})
+        self.assertEqual(fetcher.in_flight, {})
+
+if __name__ == "__main__":
+    unittest.main()
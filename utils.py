@@ -1,25 +1,27 @@
-from unidecode import unidecode
-import matplotlib.pyplot as plt
 import time
 import os
 import re
 import json
+from functools import lru_cache
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 from config import TIMEZONE
+import chart_utils
+import history_reader
+import ranking
 
 def load_data(file_path):
     """
-    Lädt JSON-Daten aus einer Datei und gibt sie zurück.
+    Lädt alle Einträge einer History (JSON-Datei, Ordner oder Zip-Archiv) und gibt sie als Liste zurück.
     Fügt Fehlerbehandlung hinzu, um Probleme beim Laden zu vermeiden.
+    Für große Exporte history_reader.iter_events verwenden, das die Einträge einzeln liest.
     """
     if not os.path.exists(file_path):
         print(f"❌ Fehler: Datei '{file_path}' existiert nicht.")
         return None
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)
+        return list(history_reader.iter_events(file_path, fields=None))
     except json.JSONDecodeError as e:
         print(f"❌ Fehler beim Dekodieren der JSON-Datei '{file_path}': {e}")
     except Exception as e:
@@ -27,19 +29,114 @@ def load_data(file_path):
     
     return None
 
-def append_md(filename, text=""):
-    try:
-        with open(filename, 'a', encoding='utf-8') as f:
-            f.write(text + '\n')
-    except Exception as e:
-        print(f"Fehler beim Anhängen an die Datei '{filename}': {e}")
+def get_output_path(input_filename):
+    """Output directory of a history: output/<name without .json/.zip>"""
+    name = re.sub(r"\.(json|zip)$", "", os.path.normpath(input_filename), flags=re.IGNORECASE)
+    return os.path.join("output", name)
 
-def clear_md(filename):
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            pass
-    except Exception as e:
-        print(f"Fehler beim Leeren der Datei '{filename}': {e}")
+class MarkdownDocument:
+    """
+    Markdown page that is collected in memory and written in one go by save().
+    The content goes to a temporary file that is then renamed, so a crash never leaves a half-written page.
+    Long pages can call flush() in between to move the collected lines to the temporary file.
+    Used as a context manager the page is saved when the block finishes without an exception.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lines = []
+        self._flushed = False
+        self._failed = False
+
+    def append(self, text=""):
+        """Add text as its own line"""
+        self.lines.append(text)
+
+    def _write_lines(self):
+        with open(f"{self.filename}.tmp", 'a' if self._flushed else 'w', encoding='utf-8') as f:
+            f.write("".join(line + '\n' for line in self.lines))
+        self.lines.clear()
+        self._flushed = True
+
+    def flush(self):
+        """Write the lines collected so far to the temporary file, the page itself only changes on save()"""
+        if self._failed:
+            return
+        try:
+            self._write_lines()
+        except Exception as e:
+            print(f"Fehler beim Schreiben der Datei '{self.filename}': {e}")
+            self._failed = True
+            self.lines.clear()
+
+    def save(self):
+        """Write the page, returns False if it could not be written"""
+        temp_filename = f"{self.filename}.tmp"
+        try:
+            # Nach einem fehlgeschlagenen flush() wäre die Seite unvollständig (der Fehler wurde schon ausgegeben)
+            if not self._failed:
+                self._write_lines()
+                os.replace(temp_filename, self.filename)
+                return True
+        except Exception as e:
+            print(f"Fehler beim Schreiben der Datei '{self.filename}': {e}")
+        finally:
+            self._flushed = self._failed = False
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.save()
+
+class PageRegistry:
+    """
+    Pages of the output directory (songs, artists, tags), filled by the generators whenever they write or keep a page.
+    Whether a list item gets a link is a set lookup instead of a file system check.
+    Pages are registered by key: the track id for songs, the name for artists and tags.
+    """
+
+    KINDS = ("songs", "artists", "tags")
+
+    def __init__(self):
+        self.pages = {kind: set() for kind in self.KINDS}
+
+    @classmethod
+    def scan(cls, output_dir):
+        """Registry of the pages that already exist in output_dir (one directory listing per kind)"""
+        registry = cls()
+        for kind in cls.KINDS:
+            directory = os.path.join(output_dir, kind)
+            if os.path.isdir(directory):
+                registry.pages[kind].update(name[:-3] for name in os.listdir(directory) if name.endswith(".md"))
+        return registry
+
+    @staticmethod
+    def page_name(kind, key):
+        """File name of a page without .md"""
+        return key[14:] if kind == "songs" else sanitize_filename(key)
+
+    def add(self, kind, key):
+        self.pages[kind].add(self.page_name(kind, key))
+
+    def has(self, kind, key):
+        return bool(key) and self.page_name(kind, key) in self.pages[kind]
+
+    def link(self, kind, key, label, prefix=".", table=False):
+        """Wiki link to the page (None if there is none), table=True escapes the | for Markdown tables"""
+        if not self.has(kind, key):
+            return None
+        separator = "\\|" if table else "|"
+        return f"[[{prefix}/{kind}/{self.page_name(kind, key)}.md{separator}{label}]]"
+
+@lru_cache(maxsize=None)
+def get_timezone():
+    """Return the configured TIMEZONE as ZoneInfo (created only once), None if not configured"""
+    return ZoneInfo(TIMEZONE) if TIMEZONE else None
 
 def parse_timestamp(ts_string):
     """Parse timestamp string and convert to local timezone"""
@@ -48,7 +145,7 @@ def parse_timestamp(ts_string):
     
     date = datetime.strptime(ts_string, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
     if TIMEZONE:
-        date = date.astimezone(ZoneInfo(TIMEZONE))
+        date = date.astimezone(get_timezone())
     return date
 
 def format_duration(ms):
@@ -64,66 +161,82 @@ def create_progress_indicator(current, total):
     """Create a consistent progress indicator string"""
     return f"{str(current).zfill(len(str(total)))} / {total}"
 
-def to_ascii(text):
-    converted = unidecode(text)
-
-    replacements = {
-        # Interpunktion (volle Breite & ideografisch)
-        '、': ', ', '。': '. ', '，': ', ', '．': '. ', '：': ': ', '；': '; ',
-        '？': '? ', '！': '! ', '¡': '! ', '¿': '? ',
-        '「': '"', '」': '"', '『': '"', '』': '"',
-        '《': '"', '》': '"', '〈': '"', '〉': '"',
-        '“': '"', '”': '"', '‘': "'", '’': "'",
-
-        # Klammern & mathematische Zeichen
-        '（': '(', '）': ')', '［': '[', '］': ']', '｛': '{', '｝': '}',
-        '＜': '<', '＞': '>', '«': '"', '»': '"', '‹': '"', '›': '"',
-        '【': '[', '】': ']', '〔': '[', '〕': ']', '〘': '[', '〙': ']',
-
-        # Trennzeichen & Linien
-        'ー': '-', '—': '-', '–': '-', '―': '-', '−': '-', '‐': '-', '‑': '-',
-        '・': '-', '･': '-', '〜': '~', '～': '~',
-
-        # Punkte, Auslassung & Leerzeichen
-        '…': '...', '‥': '..', '・': '.', '•': '*', '∙': '*', '⋅': '*',
-        '　': ' ',  # full-width space
-
-        # Symbole, Pfeile & Dekoration
-        '★': '*', '☆': '*', '♠': '<>', '♣': '<>', '♥': '<3', '♦': '<>', '✓': 'check', '✔': 'check',
-        '✕': 'X', '✖': 'X', '✗': 'X', '❌': 'X', '⭕': 'O',
-        '→': '->', '←': '<-', '↑': '^', '↓': 'v',
-        '↔': '<->', '↕': '|', '⇧': '^', '⇩': 'v',
-
-        # Gradzeichen und ähnliches
-        '℃': '°C', '℉': '°F', '°': '°',
-        '©': '(c)', '®': '(r)', '™': '(tm)',
-
-        # Musik
-        '♩': '', '♪': '', '♫': '', '♬': '',
-
-        # Währungen
-        '￥': '¥', '￦': '₩', '€': 'EUR', '£': 'GBP', '¢': 'cent', '₹': 'INR',
-        '₽': 'RUB', '₺': 'TRY', '₩': 'KRW', '₴': 'UAH', '฿': 'THB',
-
-        # Zahlenzeichen
-        '①': '1', '②': '2', '③': '3', '④': '4', '⑤': '5',
-        '⑥': '6', '⑦': '7', '⑧': '8', '⑨': '9', '⑩': '10',
-    }
+# Ersetzungen nach unidecode, werden zu einer Übersetzungstabelle für str.translate zusammengefasst
+ASCII_REPLACEMENTS = {
+    # Interpunktion (volle Breite & ideografisch)
+    '、': ', ', '。': '. ', '，': ', ', '．': '. ', '：': ': ', '；': '; ',
+    '？': '? ', '！': '! ', '¡': '! ', '¿': '? ',
+    '「': '"', '」': '"', '『': '"', '』': '"',
+    '《': '"', '》': '"', '〈': '"', '〉': '"',
+    '“': '"', '”': '"', '‘': "'", '’': "'",
 
-    
-    for orig, repl in replacements.items():
-        converted = converted.replace(orig, repl)
+    # Klammern & mathematische Zeichen
+    '（': '(', '）': ')', '［': '[', '］': ']', '｛': '{', '｝': '}',
+    '＜': '<', '＞': '>', '«': '"', '»': '"', '‹': '"', '›': '"',
+    '【': '[', '】': ']', '〔': '[', '〕': ']', '〘': '[', '〙': ']',
+
+    # Trennzeichen & Linien
+    'ー': '-', '—': '-', '–': '-', '―': '-', '−': '-', '‐': '-', '‑': '-',
+    '・': '-', '･': '-', '〜': '~', '～': '~',
+
+    # Punkte, Auslassung & Leerzeichen
+    '…': '...', '‥': '..', '・': '.', '•': '*', '∙': '*', '⋅': '*',
+    '　': ' ',  # full-width space
+
+    # Symbole, Pfeile & Dekoration
+    '★': '*', '☆': '*', '♠': '<>', '♣': '<>', '♥': '<3', '♦': '<>', '✓': 'check', '✔': 'check',
+    '✕': 'X', '✖': 'X', '✗': 'X', '❌': 'X', '⭕': 'O',
+    '→': '->', '←': '<-', '↑': '^', '↓': 'v',
+    '↔': '<->', '↕': '|', '⇧': '^', '⇩': 'v',
+
+    # Gradzeichen und ähnliches
+    '℃': '°C', '℉': '°F', '°': '°',
+    '©': '(c)', '®': '(r)', '™': '(tm)',
+
+    # Musik
+    '♩': '', '♪': '', '♫': '', '♬': '',
 
-    return converted
+    # Währungen
+    '￥': '¥', '￦': '₩', '€': 'EUR', '£': 'GBP', '¢': 'cent', '₹': 'INR',
+    '₽': 'RUB', '₺': 'TRY', '₩': 'KRW', '₴': 'UAH', '฿': 'THB',
+
+    # Zahlenzeichen
+    '①': '1', '②': '2', '③': '3', '④': '4', '⑤': '5',
+    '⑥': '6', '⑦': '7', '⑧': '8', '⑨': '9', '⑩': '10',
+}
+
+def _translation_table(replacements):
+    """
+    str.translate table with the same result as applying the replacements one after another
+    (a replacement that produces a later key is resolved when the table is built)
+    """
+    table = {}
+    for char in replacements:
+        converted = char
+        for orig, repl in replacements.items():
+            converted = converted.replace(orig, repl)
+        table[ord(char)] = converted
+    return table
+
+_ASCII_TABLE = _translation_table(ASCII_REPLACEMENTS)
+TEXT_CACHE_SIZE = 65536  # Anzahl gemerkter Ergebnisse von to_ascii / sanitize_filename
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
+def to_ascii(text):
+    from unidecode import unidecode  # erst bei Bedarf importieren
+    return unidecode(text).translate(_ASCII_TABLE)
 
 def html_to_md_links(text):
     # Regulärer Ausdruck zum Erkennen von <a href="...">...</a>
     return re.sub(r'<a\s+href=["\'](.*?)["\'].*?>(.*?)<\/a>', r'[\2](\1)', text)
 
+_FORBIDDEN_FILENAME_CHARS = re.compile(r'[<>:"/\\|?*\n\r\t\s]')
+
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
 def sanitize_filename(text):
     text = to_ascii(text)
     # Verbotene Zeichen ersetzen durch '_'
-    return re.sub(r'[<>:"/\\|?*\n\r\t\s]', '_', text).strip()
+    return _FORBIDDEN_FILENAME_CHARS.sub('_', text).strip()
 
 def count_files(directory):
     return len([name for name in os.listdir(directory)
@@ -139,9 +252,9 @@ def plot_pie_chart(
     legend_title: str = "",
     show_percentages_in_legend: bool = False
 ):
-    sorted_items = sorted(data_dict.items(), key=lambda x: x[1], reverse=True)
-    top_items = sorted_items[:data_size]
-    rest_value = sum(v for _, v in sorted_items[data_size:])
+    top_items = ranking.top_items(data_dict.items(), data_size, key=lambda x: x[1])
+    top_keys = {key for key, _ in top_items}
+    rest_value = sum(v for key, v in data_dict.items() if key not in top_keys)
     
     labels = [to_ascii(artist) if artist else "Unbekannt" for artist, _ in top_items]
     sizes = [v for _, v in top_items]
@@ -150,32 +263,18 @@ def plot_pie_chart(
         labels.append("Rest")
         sizes.append(rest_value)
 
-    fig, ax = plt.subplots(figsize=(18, 9))
-    wedges, texts, autotexts = ax.pie(
-        sizes,
-        labels=labels,
-        autopct="%1.1f%%",
-        startangle=90,
-        counterclock=False,
-        textprops={'fontsize': 8}
-    )
-    ax.axis("equal")
-    ax.set_title(title)
-
+    legend_labels = None
     if display_legend:
         if show_percentages_in_legend:
             total = sum(sizes)
             legend_labels = [f"{label} ({size / total * 100:.1f}%)" for label, size in zip(labels, sizes)]
         else:
             legend_labels = labels
-        
-        if legend_title:
-            ax.legend(wedges, legend_labels, title=legend_title, loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-        else:
-            ax.legend(wedges, legend_labels, loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
 
     path = os.path.join(output_path, "img", filename)
-    plt.tight_layout()
-    plt.savefig(path, bbox_inches='tight', pad_inches=0.5)
-    plt.close()
+    chart_utils.render(chart_utils.pie_chart(
+        path, labels, sizes, title,
+        figsize=(18, 9), textprops={'fontsize': 8},
+        legend_labels=legend_labels, legend_title=legend_title, tight_layout=True,
+    ))
     return path